@@ -4,13 +4,20 @@
 # Author: CAS
 # Date: 23/08/2024
 # Version: 1.2 Edited to one function that is called multiple times
+# Version: 1.3 Option to run the scripts in-process, handing the dataframes from one script to the next rather than re-reading them from csv
+# Version: 1.4 Option to only run the scripts where the inputs, config values or code have changed since last run
+# Version: 1.5 Option to run the generic exhaustive post processing and collapse results file by file in one pass
+# Version: 1.6 Option to re-collapse the summary and daily files from the collapse statistics
+# Version: 1.7 Option to evaluate a grid of inclusion criteria in one pass (Inclusion_Sweep.py)
 ############################################################################################################
 
 # --- Importing packages --- #
 import os
+import importlib
 import subprocess
 import sys
 import config
+import Stage_Scheduler
 from colorama import Fore
 
 ################
@@ -34,6 +41,11 @@ RUN_PREPARE_SUMMARY_RELEASE = 'Yes'          # Prepares summary releases. Will b
 RUN_PREPARE_DAILY_RELEASE = 'Yes'            # Prepares daily releases. Will be outputted in the _releases folder together with a data dictionary.
 RUN_PREPARE_HOURLY_RELEASE = 'Yes'           # Prepares hourly releases. Will be outputted in the _releases folder together with a data dictionary.
 RUN_PREPARE_MINUTE_LEVEL_RELEASE = 'No'    # Prepares minute-level releases. Will be outputted in the _releases folder together with a data dictionary.
+RUN_IN_PROCESS = 'No'                       # If 'Yes' all scripts are run within this python process and the dataframes are handed from one script to the next (part processed -> collapsed -> appended) instead of being re-read from csv. The csv files are still written out. If 'No' each script is run as a separate process.
+RUN_ONLY_CHANGED_STAGES = 'No'              # If 'Yes' the scripts switched on above are only run if their input files, the config.py values they use or their code have changed since they were last run (or if their outputs are missing). Scripts that are up-to-date are skipped. If 'No' all scripts switched on are run.
+RUN_FUSED_GENERIC_AND_COLLAPSE = 'No'       # If 'Yes' the generic exhaustive post processing and collapse results are run together file by file (Fused_Pipeline.py), so the part processed files are not written and re-read. Only used if RUN_GENERIC_EXH_POSTPROCESSING and RUN_COLLAPSE_RESULTS_TO_SUMMARY/DAILY (or RUN_CREATE_TRIMMED_FILE) are 'Yes'. Set OUTPUT_PART_PROC_FILES in config.py to 'Yes' to still output the part processed files.
+RUN_RECOLLAPSE_FROM_STATISTICS = 'No'       # If 'Yes' the individual summary and daily files are re-collapsed from the collapse statistics (Collapse_Statistics.py) instead of running Collapse_Results. Only works if OUTPUT_COLLAPSE_STATISTICS in config.py was 'Yes' when Collapse_Results was last run, and only SUM_MIN_HOUR_INCLUSION, DAY_MIN_HOUR_INCLUSION, IMPUTE_DATA, IMPUTE_HOURS or MIN_DAY_HOURS have changed since (REMOVE_MECH_NOISE also changes the trimmed files, so Collapse_Results has to be run again). Set RUN_GENERIC_EXH_POSTPROCESSING to 'No' when using this.
+RUN_INCLUSION_SWEEP = 'No'                  # If 'Yes' the inclusion criteria set in the INCLUSION CRITERIA SWEEP section of config.py are evaluated (Inclusion_Sweep.py). Outputs the number of files/days included and the distribution of enmo_mean for each setting. Needs OUTPUT_COLLAPSE_STATISTICS in config.py to be 'Yes' when Collapse_Results is run.
 
 # Python executable used in the virtual environment
 venv_python = sys.executable
@@ -46,6 +58,24 @@ def run_script(script):
         return
     subprocess.run([venv_python, filelist_script_path], check=True)
 
+# Running stage either in-process (calling main() of the script and returning what it returns) or as a separate process:
+# If RUN_ONLY_CHANGED_STAGES is 'Yes' the script is skipped if it is up-to-date:
+def run_stage(script, *args):
+    if RUN_ONLY_CHANGED_STAGES.lower() == 'yes' and Stage_Scheduler.stage_up_to_date(script):
+        print(f"{script} is up-to-date (no changes to inputs, config values or code since last run). Skipping this script.")
+        return None
+
+    if RUN_IN_PROCESS.lower() == 'yes':
+        module = importlib.import_module(os.path.splitext(script)[0])
+        stage_output = module.main(*args)
+    else:
+        run_script(script)
+        stage_output = None
+
+    if RUN_ONLY_CHANGED_STAGES.lower() == 'yes':
+        Stage_Scheduler.record_stage(script)
+    return stage_output
+
 # Print message that script is being run:
 def print_message(message):
     print(Fore.GREEN + message + Fore.RESET)
@@ -55,37 +85,58 @@ if __name__ == '__main__':
     if config.PROCESSING.lower() == 'pampro':
         if RUN_PAMPRO_MERGE_METAFILES.lower() == 'yes':
             print_message("MERGING METAFILES")
-            run_script("Pampro_Merge_MetaFiles.py")
+            run_stage("Pampro_Merge_MetaFiles.py")
         if RUN_PAMPRO_COLLATE_ANOMALIES.lower() == 'yes':
             print_message("COLLATING ANOMALIES")
-            run_script("Pampro_Collate_Anomalies.py")
+            run_stage("Pampro_Collate_Anomalies.py")
 
     # Running the Filelist_Generation script:
     if RUN_FILELIST_GENERATION.lower() == 'yes':
         print_message("CREATING FILELIST")
-        run_script("Filelist_Generation.py")
+        run_stage("Filelist_Generation.py")
+
+    # Dataframes handed from one script to the next if run in-process (None otherwise, then the scripts read in the csv files)
+    part_proc_dfs = None
+    collapsed_dfs = None
+    appended_dfs = None
+
+    run_collapse = RUN_COLLAPSE_RESULTS_TO_SUMMARY.lower() == 'yes' or RUN_COLLAPSE_RESULTS_TO_DAILY.lower() == 'yes' or RUN_CREATE_TRIMMED_FILE.lower() == 'yes'
+    if RUN_FUSED_GENERIC_AND_COLLAPSE.lower() == 'yes' and RUN_GENERIC_EXH_POSTPROCESSING.lower() == 'yes' and run_collapse:
+        # Running GENERIC_EXH_POSTPROCESSING and Collapse_Results together file by file:
+        print_message("COMPLETING GENERIC EXHAUSTIVE ANALYSIS AND COLLAPSING DATA FILE BY FILE")
+        collapsed_dfs = run_stage("Fused_Pipeline.py", True)
+
+    else:
+        # Running the GENERIC_EXH_POSTPROCESSING script:
+        if RUN_GENERIC_EXH_POSTPROCESSING.lower() == 'yes':
+            print_message("COMPLETING GENERIC EXHAUSTIVE ANALYSIS")
+            # If run in-process the part processed dataframes of all files are kept in memory to hand over to Collapse_Results (use RUN_FUSED_GENERIC_AND_COLLAPSE to only hold one part processed file at a time)
+            part_proc_dfs = run_stage("GENERIC_exh_postprocessing.py", True)
 
-    # Running the GENERIC_EXH_POSTPROCESSING script:
-    if RUN_GENERIC_EXH_POSTPROCESSING.lower() == 'yes':
-        print_message("COMPLETING GENERIC EXHAUSTIVE ANALYSIS")
-        run_script("GENERIC_exh_postprocessing.py")
+        # Running the Collapse_Results script (to Summary and/or Daily), or re-collapsing the files from the collapse statistics:
+        if RUN_COLLAPSE_RESULTS_TO_SUMMARY.lower() == 'yes' or RUN_COLLAPSE_RESULTS_TO_DAILY.lower() == 'yes':
+            if RUN_RECOLLAPSE_FROM_STATISTICS.lower() == 'yes':
+                collapsed_dfs = run_stage("Collapse_Statistics.py")
+            else:
+                collapsed_dfs = run_stage("Collapse_Results.py", part_proc_dfs, True)
 
-    # Running the Collapse_Results script (to Summary and/or Daily:
-    if RUN_COLLAPSE_RESULTS_TO_SUMMARY.lower() == 'yes' or RUN_COLLAPSE_RESULTS_TO_DAILY.lower() == 'yes':
-        run_script("Collapse_Results.py")
+    # Running the Inclusion_Sweep script:
+    if RUN_INCLUSION_SWEEP.lower() == 'yes':
+        print_message("EVALUATING THE INCLUSION CRITERIA SWEEP")
+        run_stage("Inclusion_Sweep.py")
 
     # Running the Append_Files script (Appending summary and/or daily and/or hourly):
     if RUN_APPEND_SUMMARY_FILES.lower() == 'yes' or RUN_APPEND_DAILY_FILES.lower() == 'yes' or RUN_APPEND_HOURLY_FILES.lower() == 'yes':
-        run_script("Appending_Files.py")
+        appended_dfs = run_stage("Appending_Files.py", collapsed_dfs)
 
     # Running the Verification_Checks script:
     if RUN_VERIFICATION_CHECKS.lower() == 'yes':
         print_message("COMPLETING VERIFICATION CHECKS ON SUMMARY AND HOURLY DATA")
-        run_script("Verification_Checks.py")
+        run_stage("Verification_Checks.py", appended_dfs)
 
     # Preparing releases
     if RUN_PREPARE_SUMMARY_RELEASE.lower() == 'yes' or RUN_PREPARE_DAILY_RELEASE.lower() == 'yes' or RUN_PREPARE_HOURLY_RELEASE.lower() == 'yes' or RUN_PREPARE_MINUTE_LEVEL_RELEASE.lower() == 'yes':
-        run_script("Prepare_releases.py")
+        run_stage("Prepare_releases.py", appended_dfs)
 
     print_message(Fore.BLUE + "The Acc Post Processing code has finished running successfully. \n If ran in PyCharm you can now close PyCharm. \n If ran as batch file: Press Enter to close the script." + Fore.RESET)
 
@@ -3,42 +3,40 @@
 # Author: CAS
 # Date: 03/07/2024
 # Version: 1.0 Translated from Stata code
+# Version: 1.1 The individual files are read by a pool of threads (APPEND_WORKERS) and the hourly/minute level file can be written in chunks while it is appended (STREAM_HOURLY_APPEND)
+# Version: 1.2 Option to only add, replace or remove the individual files that have changed since the last run (INCREMENTAL_APPEND)
+# Version: 1.3 Metadata of the files without an analysis file is looked up in the metadata catalogue (Metadata_Catalogue.py) and appended once
+# Version: 1.4 The individual files folders are listed with os.scandir (Results_Index.py) instead of writing a filelist with dir/ls
 ############################################################################################################
 # IMPORTING PACKAGES #
 import config
+import Dtype_Schema
+import Intermediate_Files
+import Metadata_Catalogue
+import Results_Index
 import os
 import pandas as pd
 import Acc_Post_Processing_Orchestra
 import numpy as np
+import json
+import base64
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 
 ############################################################################################################
 # PART A: This do file will append together all individual Summary files as well as join the files which have not produced an individual summary file
 ############################################################################################################
 
-# CREATING A FILE LIST OF ALL FILES IN THE RESULTS FOLDER #
+# CREATING A FILE LIST OF ALL FILES IN THE INDIVIDUAL FILES FOLDER #
 def create_filelist(folder):
-
-    # DELETE ALL PAST FILELISTS IN INDIVIDUAL SUMMARY FOLDER
     file_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER, folder, config.TIME_RES_FOLDER)
-
-    if os.path.exists(os.path.join(file_path, "filelist.txt")):  # If any filelist in the summary folder, this will be deleted.
-        os.remove(os.path.join(file_path, "filelist.txt"))
-
-    # CREATING NEW FILELIST IN INDIVIDUAL SUMMARY FOLDER - CODE IS DIFFERENT FOR MAC AND WINDOWS, CHANGE PC TYPE IN THE BEGINNING OF SCRIPT
-    os.chdir(file_path)
-
-    if config.PC_TYPE.lower() == "windows":
-        os.system('dir /b *.csv > filelist.txt')
-    elif config.PC_TYPE.lower() == "mac":
-        os.system('ls /b *csv > filelist.txt')
-
-    return file_path
+    filelist_df = Results_Index.listing(file_path, extension=Intermediate_Files.extension())
+    return file_path, filelist_df
 
 # REMOVING FILES THAT SHOULD NOT BE APPENDED #
-def remove_files(output_file):
-    filelist_df = pd.read_csv('filelist.txt', header=None, names=['v1'])  # Reading in the filelist
-    filelist_df = filelist_df.rename(columns={'v1': 'file_name'})
+def remove_files(filelist_df, output_file):
+    filelist_df = filelist_df.rename(columns={'filename': 'file_name'})
 
     # Dropping the data dictionary from the list and also the list of the main output file if saved in the same location so it is not looped through
     data_dictionary = 'dictionary'
@@ -49,18 +47,45 @@ def remove_files(output_file):
     files_list = filelist_df['file_name'].tolist()
     return files_list
 
-# Appending summary files
-def appending_files(files_list, file_path, append_level):
-    dataframes = []
+# Reading the individual files with a pool of threads (APPEND_WORKERS in config.py), so several files are read from disk at the same time.
+# The files are returned in the order of the list and only a few files are read ahead, so the files do not all have to be held in memory at once.
+# If the individual dataframes are handed over from Collapse_Results (in-process mode), these are used instead of reading the files
+def reading_in_parallel(file_paths, collapsed_dfs=None):
+    def read_file(full_file_path):
+        if collapsed_dfs is not None and full_file_path in collapsed_dfs:
+            return Dtype_Schema.compact_dtypes(collapsed_dfs[full_file_path])
+        if os.path.exists(full_file_path):
+            return Intermediate_Files.read(full_file_path)
+        return None
+
+    with ThreadPoolExecutor(max_workers=config.APPEND_WORKERS) as executor:
+        futures = deque()
+        for full_file_path in file_paths:
+            futures.append(executor.submit(read_file, full_file_path))
+            if len(futures) > config.APPEND_WORKERS:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+# REMOVING THRESHOLDS FROM THE MAIN OUTPUT FILE IF THIS IS SPECIFIED IN CONFIG FILE
+def threshold_columns(columns):
+    columns_to_drop = []
+    if config.REMOVE_THRESHOLDS.lower() == 'yes':
+        variable_prefixes = 'enmo_'
+        if not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP):
+            variable_prefixes += 'HPFVM_'
+        variable_suffix = 'plus'
 
-    # Looping though each file and appending
-    if files_list:
-        for file_name in files_list:
-            full_file_path = os.path.join(file_path, f"{file_name}")
+        for variable_prefix in variable_prefixes:
+            for column_name in columns:
+                if column_name.startswith(variable_prefix) and column_name.endswith(variable_suffix):
+                    columns_to_drop.append(column_name)
+    return columns_to_drop
 
-            if os.path.exists(full_file_path):
-                dataframe = pd.read_csv(full_file_path)
-                dataframes.append(dataframe)
+# Appending summary files
+def appending_files(files_list, file_path, append_level, collapsed_dfs=None):
+    file_paths = [os.path.join(file_path, f"{file_name}") for file_name in files_list]
+    dataframes = [dataframe for dataframe in reading_in_parallel(file_paths, collapsed_dfs) if dataframe is not None]
 
     if dataframes:
         appended_df = pd.concat(dataframes, ignore_index=True)
@@ -73,20 +98,7 @@ def appending_files(files_list, file_path, append_level):
     # DROP ANY FILE WITH NO ID
     appended_df = appended_df.dropna(subset=['id'])
 
-    # REMOVING THRESHOLDS FROM THE MAIN OUTPUT FILE IF THIS IS SPECIFIED IN CONFIG FILE
-    if config.REMOVE_THRESHOLDS.lower() == 'yes':
-        variable_prefixes = 'enmo_'
-        if not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP):
-            variable_prefixes += 'HPFVM_'
-        variable_suffix = 'plus'
-
-        columns_to_drop = []
-        for variable_prefix in variable_prefixes:
-            for column_name in appended_df.columns:
-                if column_name.startswith(variable_prefix) and column_name.endswith(variable_suffix):
-                    columns_to_drop.append(column_name)
-
-        appended_df = appended_df.drop(columns=columns_to_drop)
+    appended_df = appended_df.drop(columns=threshold_columns(appended_df.columns))
     return appended_df
 
 # Creating filelist of any IDS that have not had an analysis file produced from post processing
@@ -104,6 +116,48 @@ def no_analysis_filelist():
         return []
 
 
+# Looking up the metadata of an ID that has not had an analysis file produced from post processing in the metadata catalogue
+def no_analysis_metadata(file_id, metadata_catalogue):
+    no_analysis_metadata_df = Metadata_Catalogue.lookup(metadata_catalogue, 'metadata', file_id)
+    if no_analysis_metadata_df is None:
+        return None
+
+    # Specifying what variables to keep
+    variables_to_keep = [
+        '.*start_error*.', '.*end_error*.', '^calibration_method$', '^noise_cutoff_mg$',
+        '^generic_first_timestamp$', '^generic_last_timestamp$', '^device$', '^processing_epoch$', '^frequency$'
+    ]
+    # Variables to keep if processed through Wave
+    if config.PROCESSING.lower() == 'wave':
+        variables_to_keep.extend(['.*anom*.', '.*batt*.'])
+    # Variables to keep if processed through Pampro
+    if config.PROCESSING.lower() == 'pampro':
+        variables_to_keep.extend(['^calibration_type$', '^QC_axis_anomaly$'])
+
+    # Joining the variables to be able to use regular expression
+    combined_variables = '|'.join(variables_to_keep)
+    no_analysis_metadata_df = no_analysis_metadata_df.filter(regex=combined_variables)
+    no_analysis_metadata_df['id'] = file_id
+
+    # Renaming variables
+    no_analysis_metadata_df = no_analysis_metadata_df.rename(columns={'end_error': 'file_end_error', 'start_error': 'file_start_error', 'noise_cutoff_mg': 'noise_cutoff'})
+    variables_to_lower_case = [col for col in no_analysis_metadata_df.columns if col.startswith('QC_') and col != 'QC_axis_anomaly']
+    lower_case_mapping = {col: col.lower() for col in variables_to_lower_case}
+    no_analysis_metadata_df = no_analysis_metadata_df.rename(columns=lower_case_mapping)
+
+    # Dropping variables:
+    if config.PROCESSING.lower() == 'wave':
+        no_analysis_metadata_df.drop(columns=['first_battery', 'last_battery'], inplace=True)
+
+    # Formatting time stamp variables:
+    generic_timestamps = ['generic_first_timestamp', 'generic_last_timestamp']
+    no_analysis_metadata_df[generic_timestamps] = no_analysis_metadata_df[generic_timestamps].apply(lambda x: x.str[:19])
+
+    # Creating variable to flag files that were unable to process
+    no_analysis_metadata_df['flag_unable_to_process'] = 1
+    return no_analysis_metadata_df
+
+
 # Appending any IDS that have not had an analysis file produced from post processing and outputting the dataset
 def appending_no_analysis_files(no_analysis_files, appended_df, file_name):
     no_analysis_dataframes = []
@@ -111,85 +165,220 @@ def appending_no_analysis_files(no_analysis_files, appended_df, file_name):
         print("All files had a metadata and data file. No extra data to append.")
         output_file_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER)
         os.makedirs(output_file_path, exist_ok=True)
-        file_name = os.path.join(output_file_path, f"{file_name}.csv")
-        appended_df.to_csv(file_name, index=False)
+        file_name = Intermediate_Files.path(output_file_path, file_name)
+        Intermediate_Files.write(appended_df, file_name)
 
-        return
+        return appended_df
 
+    metadata_catalogue = Metadata_Catalogue.catalogue()
     for file_id in no_analysis_files:
-
-        metadata_file_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, f"metadata_{file_id}.csv")
-        if os.path.exists(metadata_file_path):
-            no_analysis_metadata_df = pd.read_csv(metadata_file_path)
-
-            # Specifying what variables to keep
-            variables_to_keep = [
-                '.*start_error*.', '.*end_error*.', '^calibration_method$', '^noise_cutoff_mg$',
-                '^generic_first_timestamp$', '^generic_last_timestamp$', '^device$', '^processing_epoch$', '^frequency$'
-            ]
-            # Variables to keep if processed through Wave
-            if config.PROCESSING.lower() == 'wave':
-                variables_to_keep.extend(['.*anom*.', '.*batt*.'])
-            # Variables to keep if processed through Pampro
-            if config.PROCESSING.lower() == 'pampro':
-                variables_to_keep.extend(['^calibration_type$', '^QC_axis_anomaly$'])
-
-            # Joining the variables to be able to use regular expression
-            combined_variables = '|'.join(variables_to_keep)
-            no_analysis_metadata_df = no_analysis_metadata_df.filter(regex=combined_variables)
-            no_analysis_metadata_df['id'] = file_id
-
-            # Renaming variables
-            no_analysis_metadata_df = no_analysis_metadata_df.rename(columns={'end_error': 'file_end_error', 'start_error': 'file_start_error', 'noise_cutoff_mg': 'noise_cutoff'})
-            variables_to_lower_case = [col for col in no_analysis_metadata_df.columns if col.startswith('QC_') and col != 'QC_axis_anomaly']
-            lower_case_mapping = {col: col.lower() for col in variables_to_lower_case}
-            no_analysis_metadata_df = no_analysis_metadata_df.rename(columns=lower_case_mapping)
-
-            # Dropping variables:
-            if config.PROCESSING.lower() == 'wave':
-                no_analysis_metadata_df.drop(columns=['first_battery', 'last_battery'], inplace=True)
-
-            # Formatting time stamp variables:
-            generic_timestamps = ['generic_first_timestamp', 'generic_last_timestamp']
-            no_analysis_metadata_df[generic_timestamps] = no_analysis_metadata_df[generic_timestamps].apply(lambda x: x.str[:19])
-
-            # Creating variable to flag files that were unable to process
-            no_analysis_metadata_df['flag_unable_to_process'] = 1
-
+        no_analysis_metadata_df = no_analysis_metadata(file_id, metadata_catalogue)
+        if no_analysis_metadata_df is not None:
             no_analysis_dataframes.append(no_analysis_metadata_df)
 
-        # Appending dataframes if there are any
-        if no_analysis_dataframes:
-            appended_no_analysis_df = pd.concat(no_analysis_dataframes, ignore_index=True)
-        else:
-            appended_no_analysis_df = pd.DataFrame()
+    # Appending dataframes if there are any
+    if no_analysis_dataframes:
+        appended_no_analysis_df = pd.concat(no_analysis_dataframes, ignore_index=True)
+    else:
+        appended_no_analysis_df = pd.DataFrame()
 
-        # appending the dataset from no_analysis with the ones that have analysis data.
-        merged_df = pd.concat([appended_df, appended_no_analysis_df], ignore_index=True)
+    # appending the dataset from no_analysis with the ones that have analysis data.
+    merged_df = pd.concat([appended_df, appended_no_analysis_df], ignore_index=True)
 
-        # Changing the variable valid into a boolean variable so missing values are set to FALSE
-        if 'valid' in merged_df.columns:
-            merged_df['valid'] = merged_df['valid'].replace('', np.nan)
-            merged_df['valid'] = merged_df['valid'].astype('bool', errors='ignore')
+    # Changing the variable valid into a boolean variable so missing values are set to FALSE
+    if 'valid' in merged_df.columns:
+        merged_df['valid'] = merged_df['valid'].replace('', np.nan)
+        merged_df['valid'] = merged_df['valid'].astype('bool', errors='ignore')
 
     # Outputting appended summary dataframe
     output_file_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER)
     os.makedirs(output_file_path, exist_ok=True)
-    file_name = os.path.join(output_file_path, f"{file_name}.csv")
+    file_name = Intermediate_Files.path(output_file_path, file_name)
 
-    merged_df.to_csv(file_name, index=False)
+    Intermediate_Files.write(merged_df, file_name)
 
+    return merged_df
 
 
-if __name__ == '__main__':
+# Reading and saving the manifest of an appended file written incrementally (INCREMENTAL_APPEND in config.py). The manifest records which individual files are in the appended file and where (partition).
+def manifest_path(file_name):
+    return os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER, f"{file_name}_manifest.json")
+
+def load_manifest(file_name):
+    if os.path.exists(manifest_path(file_name)):
+        with open(manifest_path(file_name)) as f:
+            return json.load(f)
+    return {'files': {}}
+
+def save_manifest(manifest, file_name):
+    with open(manifest_path(file_name), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+def serialise_schema(schema):
+    return base64.b64encode(schema.serialize().to_pybytes()).decode() if schema is not None else None
+
+def deserialise_schema(schema):
+    import pyarrow
+    return pyarrow.ipc.read_schema(pyarrow.py_buffer(base64.b64decode(schema)))
+
+
+# Appending the individual files and the IDS that have not had an analysis file produced, writing the appended dataset in chunks of APPEND_CHUNK_ROWS rows while the files are read (STREAM_HOURLY_APPEND in config.py).
+# The columns of the appended dataset are taken from the headers of the files before any data is read, so only the chunk being written is held in memory.
+# If incremental is True (INCREMENTAL_APPEND in config.py) each individual file is written as its own chunk and the files that are unchanged since the last run are copied across from the appended file without reading them in.
+def streaming_files(files_list, file_path, append_level, no_analysis_files, file_name, collapsed_dfs=None, incremental=False):
+    in_memory = collapsed_dfs or {}
+    file_paths = [os.path.join(file_path, f"{name}") for name in files_list]
+    file_paths = [full_file_path for full_file_path in file_paths if full_file_path in in_memory or os.path.exists(full_file_path)]
+
+    output_file_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER)
+    os.makedirs(output_file_path, exist_ok=True)
+    output_file = Intermediate_Files.path(output_file_path, file_name)
+    binary_format = Intermediate_Files.intermediate_format() != 'csv'
+
+    # Files are unchanged if they have the same size and modified time as when they were appended (dataframes handed over from Collapse_Results are always new)
+    manifest = load_manifest(file_name) if incremental else {'files': {}}
+    stats = {full_file_path: os.stat(full_file_path) if os.path.exists(full_file_path) else None for full_file_path in file_paths}
+    unchanged = {}
+    for full_file_path, stat in stats.items():
+        entry = manifest['files'].get(os.path.basename(full_file_path))
+        if full_file_path not in in_memory and entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            unchanged[full_file_path] = entry
+
+    file_headers = {full_file_path: unchanged[full_file_path]['header'] if full_file_path in unchanged else list(in_memory[full_file_path].columns) if full_file_path in in_memory
+                    else Intermediate_Files.read_columns(full_file_path) for full_file_path in file_paths}
+    headers = list(file_headers.values())
+
+    if not no_analysis_files:
+        print("All files had a metadata and data file. No extra data to append.")
+    metadata_catalogue = Metadata_Catalogue.catalogue() if no_analysis_files else None
+    no_analysis_dataframes = [df for df in (no_analysis_metadata(file_id, metadata_catalogue) for file_id in no_analysis_files) if df is not None]
+    no_analysis_df = pd.concat(no_analysis_dataframes, ignore_index=True) if no_analysis_dataframes else pd.DataFrame()
+
+    # Columns in the order they appear in the files (the same order as when appending the dataframes)
+    columns = list(dict.fromkeys([column for header in headers for column in header] + (['id'] if append_level == 'hourly' else [])))
+    columns = [column for column in columns if column not in threshold_columns(columns)]
+    columns += [column for column in no_analysis_df.columns if column not in columns]
+
+    # Whole number columns are changed to decimals if they have missing values in the appended dataset (as pandas does when appending the dataframes)
+    missing_columns = [column for column in columns if not all(column in header for header in headers)]
+    if not no_analysis_df.empty:
+        missing_columns += [column for column in columns if column not in no_analysis_df.columns and column not in missing_columns]
+
+    def formatting_chunk(chunk, analysis_files):
+        if analysis_files:
+            if append_level == 'hourly':
+                chunk['id'] = chunk['file_id']
+            chunk = chunk.dropna(subset=['id'])
+        chunk = chunk.reindex(columns=columns)
+        for column in missing_columns:
+            if pd.api.types.is_integer_dtype(chunk[column]):
+                chunk[column] = chunk[column].astype('float64')
+        if no_analysis_files and 'valid' in chunk.columns:
+            chunk['valid'] = chunk['valid'].replace('', np.nan)
+            chunk['valid'] = chunk['valid'].astype('bool', errors='ignore')
+        return chunk
+
+    # The binary files need the data type of each column before writing. These are read from the file footers and the most general type is used if they differ between files.
+    schema = None
+    file_schemas = {}
+    if binary_format:
+        import pyarrow
+        for full_file_path in file_paths:
+            if full_file_path in unchanged:
+                file_schemas[full_file_path] = deserialise_schema(unchanged[full_file_path]['schema'])
+            elif full_file_path in in_memory:
+                file_schemas[full_file_path] = pyarrow.Schema.from_pandas(in_memory[full_file_path], preserve_index=False).remove_metadata()
+            else:
+                file_schemas[full_file_path] = Intermediate_Files.read_schema(full_file_path)
+        schemas = list(file_schemas.values())
+        if not no_analysis_df.empty:
+            schemas.append(pyarrow.Schema.from_pandas(no_analysis_df, preserve_index=False).remove_metadata())
+        # Category columns (COMPACT_DTYPES in config.py) are written as plain text, as they cannot be merged with the text columns of the no analysis metadata
+        schemas = [pyarrow.schema([pyarrow.field(field.name, field.type.value_type) if pyarrow.types.is_dictionary(field.type) else field for field in file_schema]) for file_schema in schemas]
+        unified_schema = pyarrow.unify_schemas(schemas, promote_options='permissive')
+        fields = []
+        for column in columns:
+            field_type = unified_schema.field(column if column in unified_schema.names else 'file_id').type
+            if column in missing_columns and pyarrow.types.is_integer(field_type):
+                field_type = pyarrow.float64()
+            fields.append(pyarrow.field(column, field_type))
+        schema = pyarrow.schema(fields)
+
+    # The unchanged files can only be copied across if the appended file is the one the manifest was written for and the columns and settings of the appended file are the same
+    settings = {'format': Intermediate_Files.intermediate_format(), 'append_level': append_level, 'REMOVE_THRESHOLDS': config.REMOVE_THRESHOLDS,
+                'VARIABLES_TO_DROP': list(config.VARIABLES_TO_DROP), 'PROCESSING': config.PROCESSING, 'COMPACT_DTYPES': config.COMPACT_DTYPES,
+                'no_analysis_files': bool(no_analysis_files), 'columns': columns, 'missing_columns': missing_columns, 'schema': serialise_schema(schema)}
+    output_stat = os.stat(output_file) if os.path.exists(output_file) else None
+    copy_unchanged = (incremental and output_stat is not None and manifest.get('settings') == settings
+                      and manifest.get('size') == output_stat.st_size and manifest.get('mtime_ns') == output_stat.st_mtime_ns)
+    if not copy_unchanged:
+        unchanged = {}
+    elif len(unchanged) == len(file_paths) == len(manifest['files']) and manifest.get('no_analysis') == no_analysis_files:
+        print(f"{os.path.basename(output_file)} is up-to-date (no individual files added, changed or removed since last run).")
+        return
+
+    def chunks():
+        if incremental:
+            # One chunk per individual file, so each file can be replaced on its own next time. The unchanged files are copied across (partition of the appended file).
+            dataframes = reading_in_parallel([full_file_path for full_file_path in file_paths if full_file_path not in unchanged], collapsed_dfs)
+            for full_file_path in file_paths:
+                if full_file_path in unchanged:
+                    yield unchanged[full_file_path]['partition']
+                    continue
+                dataframe = next(dataframes)
+                yield formatting_chunk(dataframe, analysis_files=True) if dataframe is not None else None
+        else:
+            buffered, buffered_rows = [], 0
+            for dataframe in reading_in_parallel(file_paths, collapsed_dfs):
+                if dataframe is None:
+                    continue
+                buffered.append(dataframe)
+                buffered_rows += len(dataframe)
+                if buffered_rows >= config.APPEND_CHUNK_ROWS:
+                    yield formatting_chunk(pd.concat(buffered, ignore_index=True), analysis_files=True)
+                    buffered, buffered_rows = [], 0
+            if buffered:
+                yield formatting_chunk(pd.concat(buffered, ignore_index=True), analysis_files=True)
+        if not no_analysis_df.empty:
+            yield formatting_chunk(no_analysis_df, analysis_files=False)
+
+    # Outputting appended dataframe
+    partitions = Intermediate_Files.write_chunks(chunks(), output_file, columns, schema, source_path=output_file if unchanged else None)
+
+    if incremental:
+        print(f"Appended {len(file_paths) - len(unchanged)} new or changed files and kept {len(unchanged)} unchanged files in {os.path.basename(output_file)}.")
+        output_stat = os.stat(output_file)
+        files = {}
+        for full_file_path, partition in zip(file_paths, partitions):
+            entry = unchanged.get(full_file_path)
+            if entry is None and stats[full_file_path] is not None:
+                entry = {'size': stats[full_file_path].st_size, 'mtime_ns': stats[full_file_path].st_mtime_ns, 'header': file_headers[full_file_path],
+                         'schema': serialise_schema(file_schemas.get(full_file_path))}
+            if entry is not None:
+                files[os.path.basename(full_file_path)] = dict(entry, partition=partition)
+        save_manifest({'settings': settings, 'size': output_stat.st_size, 'mtime_ns': output_stat.st_mtime_ns, 'no_analysis': no_analysis_files, 'files': files}, file_name)
+
+
+def main(collapsed_dfs=None):
+    """
+    Appending the individual summary, daily and hourly/minute level files.
+    :param collapsed_dfs: Optional dictionary of individual dataframes (by file path) handed over from Collapse_Results when the orchestra is run in-process. Files not in the dictionary are read from the individual files folders.
+    :return: appended_dfs: Dictionary of the appended datasets ('summary', 'daily' and/or 'hourly'), so they can be handed over to Verification_Checks and Prepare_releases.
+    """
+    appended_dfs = {}
+
     # Appending summary files
     if Acc_Post_Processing_Orchestra.RUN_APPEND_SUMMARY_FILES.lower() == 'yes':
         Acc_Post_Processing_Orchestra.print_message("APPENDING ALL INDIVIDUAL SUMMARY FILES TOGETHER")
-        summary_file_path = create_filelist(folder=config.INDIVIDUAL_SUM_F)
-        summary_files_list = remove_files(output_file=config.SUM_OUTPUT_FILE)
-        summary_appended_df = appending_files(summary_files_list, file_path=summary_file_path, append_level='summary')
+        summary_file_path, summary_filelist_df = create_filelist(folder=config.INDIVIDUAL_SUM_F)
+        summary_files_list = remove_files(summary_filelist_df, output_file=config.SUM_OUTPUT_FILE)
         no_analysis_files = no_analysis_filelist()
-        appending_no_analysis_files(no_analysis_files, summary_appended_df, file_name=config.SUM_OUTPUT_FILE)
+        # Only adding, replacing or removing the files changed since last run. It is not handed over in memory, so Verification_Checks and Prepare_releases read it in from the Summary_Files folder
+        if config.INCREMENTAL_APPEND.lower() == 'yes':
+            streaming_files(summary_files_list, file_path=summary_file_path, append_level='summary', no_analysis_files=no_analysis_files, file_name=config.SUM_OUTPUT_FILE, collapsed_dfs=collapsed_dfs, incremental=True)
+        else:
+            summary_appended_df = appending_files(summary_files_list, file_path=summary_file_path, append_level='summary', collapsed_dfs=collapsed_dfs)
+            appended_dfs['summary'] = appending_no_analysis_files(no_analysis_files, summary_appended_df, file_name=config.SUM_OUTPUT_FILE)
 
     # Appending hourly/minute level trimmed files
     if Acc_Post_Processing_Orchestra.RUN_APPEND_HOURLY_FILES.lower() == 'yes' or Acc_Post_Processing_Orchestra.RUN_APPEND_MINUTE_LEVEL_FILES.lower() == 'yes':
@@ -197,17 +386,31 @@ if __name__ == '__main__':
             Acc_Post_Processing_Orchestra.print_message("APPENDING ALL INDIVIDUAL HOURLY FILES TOGETHER")
         if config.count_prefixes.lower() == '1m':
             Acc_Post_Processing_Orchestra.print_message("APPENDING ALL INDIVIDUAL MINUTE LEVEL FILES")
-        hourly_file_path = create_filelist(folder=config.INDIVIDUAL_TRIMMED_F)
-        hourly_files_list = remove_files(output_file=config.HOUR_OUTPUT_FILE)
-        hourly_appended_df = appending_files(hourly_files_list, file_path=hourly_file_path, append_level='hourly')
+        hourly_file_path, hourly_filelist_df = create_filelist(folder=config.INDIVIDUAL_TRIMMED_F)
+        hourly_files_list = remove_files(hourly_filelist_df, output_file=config.HOUR_OUTPUT_FILE)
         no_analysis_files = no_analysis_filelist()
-        appending_no_analysis_files(no_analysis_files, hourly_appended_df, file_name=config.HOUR_OUTPUT_FILE)
+        # Writing the appended file in chunks. It is not handed over in memory, so Verification_Checks and Prepare_releases read it in from the Summary_Files folder
+        if config.STREAM_HOURLY_APPEND.lower() == 'yes' or config.INCREMENTAL_APPEND.lower() == 'yes':
+            streaming_files(hourly_files_list, file_path=hourly_file_path, append_level='hourly', no_analysis_files=no_analysis_files, file_name=config.HOUR_OUTPUT_FILE, collapsed_dfs=collapsed_dfs,
+                            incremental=config.INCREMENTAL_APPEND.lower() == 'yes')
+        else:
+            hourly_appended_df = appending_files(hourly_files_list, file_path=hourly_file_path, append_level='hourly', collapsed_dfs=collapsed_dfs)
+            appended_dfs['hourly'] = appending_no_analysis_files(no_analysis_files, hourly_appended_df, file_name=config.HOUR_OUTPUT_FILE)
 
     # Appending daily files
     if Acc_Post_Processing_Orchestra.RUN_APPEND_DAILY_FILES.lower() == 'yes':
         Acc_Post_Processing_Orchestra.print_message("APPENDING ALL INDIVIDUAL DAILY FILES TOGETHER")
-        daily_file_path = create_filelist(folder=config.INDIVIDUAL_DAILY_F)
-        daily_files_list = remove_files(output_file=config.DAY_OUTPUT_FILE)
-        daily_appended_df = appending_files(daily_files_list, file_path=daily_file_path, append_level='daily')
+        daily_file_path, daily_filelist_df = create_filelist(folder=config.INDIVIDUAL_DAILY_F)
+        daily_files_list = remove_files(daily_filelist_df, output_file=config.DAY_OUTPUT_FILE)
         no_analysis_files = no_analysis_filelist()
-        appending_no_analysis_files(no_analysis_files, daily_appended_df, file_name=config.DAY_OUTPUT_FILE)
+        if config.INCREMENTAL_APPEND.lower() == 'yes':
+            streaming_files(daily_files_list, file_path=daily_file_path, append_level='daily', no_analysis_files=no_analysis_files, file_name=config.DAY_OUTPUT_FILE, collapsed_dfs=collapsed_dfs, incremental=True)
+        else:
+            daily_appended_df = appending_files(daily_files_list, file_path=daily_file_path, append_level='daily', collapsed_dfs=collapsed_dfs)
+            appended_dfs['daily'] = appending_no_analysis_files(no_analysis_files, daily_appended_df, file_name=config.DAY_OUTPUT_FILE)
+
+    return appended_dfs
+
+
+if __name__ == '__main__':
+    main()
@@ -4,11 +4,24 @@
 # Date: 26/06/2024
 # Version: 1.0 Translated from Stata code
 # Version: 2.0 - 21/11/2024: Updated to run on Pampro output
+# Version: 2.1 - 16/10/2026: Individual files can be written as parquet/feather files (INTERMEDIATE_FORMAT in config.py)
+# Version: 2.2 - 16/10/2026: Diurnally adjusted means for all variables are solved at once instead of one statsmodels regression per variable
+# Version: 2.3 - 16/10/2026: Diurnally adjusted means for all days are solved at once in the daily collapse
+# Version: 2.4 - 16/10/2026: Day number is created with a cumulative sum instead of looping through each row
+# Version: 2.5 - 16/10/2026: Each file is read in and trimmed once and then collapsed to both summary and daily level
+# Version: 2.6 - 16/10/2026: Pwear by quadrant/weekday and hourly/daily means are summed in one pass with np.bincount
+# Version: 2.7 - 16/10/2026: Sleep imputation is done for all days in one vectorized step and does not change the trimmed dataframe
+# Version: 2.8 - 16/10/2026: The imputed (_IMP) regressions are only refitted for files/days where hours were imputed
+# Version: 2.9 - 16/10/2026: Files can be collapsed in batches (COLLAPSE_BATCH_SIZE in config.py), solving the regressions of all files in a batch together
+# Version: 3.0 - 16/10/2026: Option to output the collapse statistics of each file, so the files can be re-collapsed with other inclusion settings (Collapse_Statistics.py)
+# Version: 3.1 - 17/10/2026: The REMOVE_MECH_NOISE setting used is saved in the collapse statistics
 ############################################################################################################
 # IMPORTING PACKAGES #
 import os
 import pandas as pd
 import config
+import Dtype_Schema
+import Intermediate_Files
 from datetime import timedelta
 import numpy as np
 import statsmodels.api as sm
@@ -41,10 +54,16 @@ def reading_filelist():
 
 
 # LOOPING THROUGH EACH FILE FOR COLLAPSING
-def reading_part_proc(date_orig):
-    part_proc_file_path = os.path.join(partPro_path, f"{file_id}_{config.OUTPUT_FILE_EXT}.csv")
-    if os.path.exists(part_proc_file_path):
-        df = pd.read_csv(part_proc_file_path)
+# If the part processed dataframes are handed over from GENERIC_exh_postprocessing (in-process mode), these are used instead of reading the csv files
+def reading_part_proc(file_id, partPro_path, date_orig, part_proc_dfs=None):
+    part_proc_file_path = Intermediate_Files.path(partPro_path, f"{file_id}_{config.OUTPUT_FILE_EXT}")
+    df = None
+    if part_proc_dfs is not None and file_id in part_proc_dfs:
+        df = Dtype_Schema.compact_dtypes(part_proc_dfs[file_id].copy())
+    elif os.path.exists(part_proc_file_path):
+        df = Intermediate_Files.read(part_proc_file_path)
+
+    if df is not None:
         df.sort_values(by=['file_id', 'DATETIME'], inplace=True)
         df[date_orig] = pd.to_datetime(df[date_orig], format='%Y-%m-%d %H:%M:%S')
         time_difference = df[date_orig].iloc[1] - df[date_orig].iloc[0]
@@ -85,7 +104,7 @@ def remove_data(df):
     return df
 
 # CREATING "DUMMY" DATASET (EMPTY) IF ALL TIMES FALL OUTSIDE WEAR LOG TIMES OR LESS THAN 1 HOUR DATA
-def creating_dummy(df, file_id, time_resolution):
+def creating_dummy(df, file_id, time_resolution, partPro_path, summary_files_path, part_proc_dfs=None, collapsed_dfs=None):
     row_count = len(df)
     flag_valid_total = df['temp_flag_no_valid_days'].min()
 
@@ -94,10 +113,6 @@ def creating_dummy(df, file_id, time_resolution):
             'file_id': file_id,
             'FLAG_NO_VALID_DAYS': [1]
         })
-        part_proc_file_path = os.path.join(partPro_path, f"{file_id}_{config.OUTPUT_FILE_EXT}.csv")
-        if os.path.exists(part_proc_file_path):
-            part_proc_merge_df = pd.read_csv(part_proc_file_path)
-        new_dummy_df = pd.merge(dummy_df, part_proc_merge_df, on='file_id', how='outer', validate='1:m', indicator=True)
         columns_to_keep = ['file_id', 'FLAG_NO_VALID_DAYS', 'device', 'calibration_method', 'noise_cutoff_mg', 'processing_epoch',
                            'generic_first_timestamp', 'generic_last_timestamp', 'QC_first_battery_pct', 'QC_last_battery_pct', 'frequency']
         if config.PROCESSING.lower() == 'wave':
@@ -106,6 +121,14 @@ def creating_dummy(df, file_id, time_resolution):
             columns_to_keep += config.ANOM_VAR_PAMPRO + ['subject_code', 'calibration_type', 'file_start_error', 'file_end_error', 'mf_start_error', 'mf_end_error']
         if config.USE_WEAR_LOG.lower() == 'yes':
             columns_to_keep.extend(['start', 'end'])
+
+        # Only reading in the metadata columns from the part processed file
+        part_proc_file_path = Intermediate_Files.path(partPro_path, f"{file_id}_{config.OUTPUT_FILE_EXT}")
+        if part_proc_dfs is not None and file_id in part_proc_dfs:
+            part_proc_merge_df = part_proc_dfs[file_id]
+        elif os.path.exists(part_proc_file_path):
+            part_proc_merge_df = Intermediate_Files.read(part_proc_file_path, columns=[col for col in columns_to_keep if col != 'FLAG_NO_VALID_DAYS'])
+        new_dummy_df = pd.merge(dummy_df, part_proc_merge_df, on='file_id', how='outer', validate='1:m', indicator=True)
         new_dummy_df = new_dummy_df[columns_to_keep]
         new_dummy_df['TIME_RESOLUTION'] = time_resolution
 
@@ -119,13 +142,15 @@ def creating_dummy(df, file_id, time_resolution):
         new_dummy_df['id'] = new_dummy_df['id'].str.upper()
 
         # Outputting dummy dataset
-        file_name = os.path.join(summary_files_path, f"{file_id}_{config.SUM_OVERALL_MEANS}.csv")
-        new_dummy_df.to_csv(file_name, index=False)
+        file_name = Intermediate_Files.path(summary_files_path, f"{file_id}_{config.SUM_OVERALL_MEANS}")
+        Intermediate_Files.write(new_dummy_df, file_name)
+        if collapsed_dfs is not None:
+            collapsed_dfs[file_name] = new_dummy_df
 
     return row_count, flag_valid_total
 
 
-def trimmed_dataset(df, file_id, time_resolution, output_trimmed_df):
+def trimmed_dataset(df, file_id, time_resolution, output_trimmed_df, row_count, flag_valid_total, trimmed_path, collapsed_dfs=None):
 
     if row_count > 1 and flag_valid_total != 1:
         df.drop(columns='temp_flag_no_valid_days').sort_values(by=['file_id', 'DATETIME'])
@@ -133,8 +158,9 @@ def trimmed_dataset(df, file_id, time_resolution, output_trimmed_df):
         if output_trimmed_df == 'Yes':
             # Outputting dataset
             os.makedirs(trimmed_path, exist_ok=True)
-            file_name = os.path.join(trimmed_path, f"{file_id}_TRIMMED_{config.count_prefixes}.csv")
-            df.to_csv(file_name, index=False)
+            file_name = Intermediate_Files.path(trimmed_path, f"{file_id}_TRIMMED_{config.count_prefixes}")
+            # The trimmed file is not handed over to Appending_Files (it is read back in from the file), so the hourly/minute level data of all files is not held in memory
+            Intermediate_Files.write(df, file_name)
         else:
             pass
 
@@ -142,11 +168,7 @@ def trimmed_dataset(df, file_id, time_resolution, output_trimmed_df):
         df['day_number'] = 1
         df['day_change'] = 0
         df.loc[(df['hourofday'] == 1) & (df['hourofday'].shift(1) == 24) & (df['file_id'] == df['file_id'].shift(1)), 'day_change'] = 1
-        day_number = 1
-        for idx, row in df.iterrows():
-            if row['day_change'] == 1:
-                day_number += 1
-            df.at[idx, 'day_number'] = day_number
+        df['day_number'] = 1 + df['day_change'].cumsum()
         df.drop(columns=['day_change'], inplace=True)
 
         # Excluding data (based on local exclude_hours list) only if specified in header
@@ -163,10 +185,10 @@ def trimmed_dataset(df, file_id, time_resolution, output_trimmed_df):
         df['MORNING'] = np.sin(2 * np.pi * (df['hourofday'] / 24))
         df['MIDNIGHT'] = np.cos(2 * np.pi * (df['hourofday'] / 24))
 
-        df['index'] = df.groupby('file_id').cumcount() + 1
+        df['index'] = df.groupby('file_id', observed=True).cumcount() + 1
 
         # Generating PWEAR variables
-        df['row'] = df.groupby('file_id').cumcount() + 1
+        df['row'] = df.groupby('file_id', observed=True).cumcount() + 1
 
         df['Pwear'] = pd.to_numeric(df['Pwear'])
         df['PWEAR_MORNING'] = df['Pwear'] * df['MORNING']
@@ -276,9 +298,9 @@ def creating_headers(file_id, collapse_level, file_path, file_name):
     headers_df = pd.DataFrame(columns=list_of_variables)
 
     # Outputting empty dataframe
-    os.makedirs(summary_files_path, exist_ok=True)
-    file_name = os.path.join(file_path, f"{file_id}_{file_name}.csv")
-    headers_df.to_csv(file_name, index=False)
+    os.makedirs(file_path, exist_ok=True)
+    file_name = Intermediate_Files.path(file_path, f"{file_id}_{file_name}")
+    Intermediate_Files.write(headers_df, file_name)
 
     return headers_df
 
@@ -425,351 +447,401 @@ def input_data(df, time_resolution, collapse_level):
         return dictionary
 
 
-# CREATING PWEAR VARIABLES AND INPUTTING TO THE EMPTY DATAFRAME
-def input_pwear_segment(df, dictionary, collapse_level):
-    if df is not None and not df.empty:
+# SUMMING PWEAR BY QUADRANT OF THE DAY AND WEEKDAY/WEEKEND
+QUADRANTS = ['morning', 'noon', 'afternoon', 'night']     # Hours 1-6, 7-12, 13-18 and 19-24
+DAY_TYPES = ['wkday', 'wkend']
 
-        variables = [
-            'Pwear', 'RecordLength',
-            'Pwear_morning', 'Pwear_noon', 'Pwear_afternoon', 'Pwear_night']
+def pwear_by_segment(df):
+    """
+    Summing Pwear for each quadrant of the day, weekday/weekend and quadrant by weekday/weekend in one pass. Each row is put in a (quadrant, day type) bucket and all buckets are summed with one np.bincount.
+    :param df: Trimmed dataframe (or one day of it).
+    :return: Dictionary with the Pwear sum for each quadrant (e.g. 'morning'), day type ('wkday', 'wkend') and quadrant by day type (e.g. ('morning', 'wkend')).
+    """
+    hourofday = df['hourofday'].to_numpy(dtype=float)
+    in_quadrant = (hourofday > 0) & (hourofday <= 24)
+    quadrant = np.where(in_quadrant, np.ceil(np.where(in_quadrant, hourofday, 1) / 6) - 1, len(QUADRANTS)).astype(int)
+    day_type = np.where(df['wkday'] == 1, 1, np.where(df['wkend'] == 1, 2, 0))
 
-        if collapse_level == 'summary':
-            variables.extend(['Pwear_morning_wkday', 'Pwear_noon_wkday', 'Pwear_afternoon_wkday', 'Pwear_night_wkday',
-            'Pwear_morning_wkend', 'Pwear_noon_wkend', 'Pwear_afternoon_wkend', 'Pwear_night_wkend',
-            'Pwear_wkday', 'Pwear_weekend'])
+    pwear = df['Pwear'].to_numpy(dtype=float)
+    buckets = np.bincount(quadrant * 3 + day_type, weights=np.nan_to_num(pwear), minlength=(len(QUADRANTS) + 1) * 3).reshape(len(QUADRANTS) + 1, 3)
+
+    pwear_sums = {}
+    for i, quad in enumerate(QUADRANTS):
+        pwear_sums[quad] = buckets[i].sum()
+        for j, day in enumerate(DAY_TYPES):
+            pwear_sums[(quad, day)] = buckets[i, j + 1]
+    for j, day in enumerate(DAY_TYPES):
+        pwear_sums[day] = buckets[:, j + 1].sum()
+    return pwear_sums
 
-        results = {var: np.nan for var in variables}
 
-        results['PWear'] = df['Pwear'].sum() / formula
+# CREATING PWEAR VARIABLES AND INPUTTING TO THE EMPTY DATAFRAME
+def input_pwear_segment(df, dictionary, collapse_level, formula):
+    if df is not None and not df.empty:
+
         PWear_count = df['Pwear'].notna().sum()
         RecordLength = PWear_count * formula
         dictionary['RecordLength'] = RecordLength
 
         # PWear variables by quadrants
-        Pwear_by_quad = {}
-
-        # Defining quad variables
-        quad_morning_hours = (df['hourofday'] > 0) & (df['hourofday'] <= 6)
-        quad_noon_hours = (df['hourofday'] > 6) & (df['hourofday'] <= 12)
-        quad_afternoon_hours = (df['hourofday'] > 12) & (df['hourofday'] <= 18)
-        quad_night_hours = (df['hourofday'] > 18) & (df['hourofday'] <= 24)
-        quadrants = ['morning', 'noon', 'afternoon', 'night']
-        quad_variables = [quad_morning_hours, quad_noon_hours, quad_afternoon_hours, quad_night_hours]
-
-
-        for quad, variables in zip(quadrants, quad_variables):
-            Pwear_sum = df.loc[variables, 'Pwear'].sum()
-            quadrant = f'Pwear_{quad}'
-            Pwear_by_quad[quadrant] = Pwear_sum/formula
-            dictionary[quadrant] = Pwear_by_quad[quadrant]
+        pwear_sums = pwear_by_segment(df)
+        for quad in QUADRANTS:
+            dictionary[f'Pwear_{quad}'] = pwear_sums[quad] / formula
 
         if collapse_level == 'summary':
             # PWear variables by weekend/weekday
-            PWear_wkday = df[df['wkday'] == 1]['Pwear'].sum()/formula
-            PWear_wkend = df[df['wkend'] == 1]['Pwear'].sum()/formula
-
-            dictionary['Pwear_wkday'] = PWear_wkday
-            dictionary['Pwear_wkend'] = PWear_wkend
+            dictionary['Pwear_wkday'] = pwear_sums['wkday'] / formula
+            dictionary['Pwear_wkend'] = pwear_sums['wkend'] / formula
 
             #PWear variables by quadrant and weekend/weekday
-            day_types = ['wkday', 'wkend']
-
-            Pwear_by_quad_daytime = {}
-            for day_type in day_types:
-                for quad, variables in zip(quadrants, quad_variables):
-                    condition = variables & (df[day_type] == 1)
-                    Pwear_sum = df.loc[condition, 'Pwear'].sum()
-                    key = f'Pwear_{quad}_{day_type}'
-                    Pwear_by_quad_daytime[key] = Pwear_sum / formula
-
-                    dictionary[key] = Pwear_by_quad_daytime[key]
+            for day_type in DAY_TYPES:
+                for quad in QUADRANTS:
+                    dictionary[f'Pwear_{quad}_{day_type}'] = pwear_sums[(quad, day_type)] / formula
 
         return dictionary
 
 
 # SUMMARISING HOURLY AND DAILY ENMO AND PWEAR VARIABLES
+# Summing values for each hour of the day (1-24) or day of the week (1-7) in one pass
+def sums_by_group(df, group_variable, n_groups, values):
+    """
+    Summing several variables for each group in one pass with np.bincount (missing values are skipped, as in groupby().sum()).
+    :param df: Trimmed dataframe.
+    :param group_variable: 'hourofday' (n_groups 24) or 'dayofweek' (n_groups 7).
+    :param values: Dictionary of series to sum for each group.
+    :return: rows. Number of rows in each group (position 0 is group 1). Groups without rows are missing in groupby.
+    :return: sums. Dictionary with the sum for each group of each series in values.
+    :return: counts. Dictionary with the number of non missing values for each group of each series in values.
+    """
+    groups = df[group_variable].to_numpy(dtype=float)
+    in_range = (groups >= 1) & (groups <= n_groups) & (groups == np.round(groups))
+    group_index = np.where(in_range, groups, 0).astype(int)
+
+    rows = np.bincount(group_index, minlength=n_groups + 1)[1:]
+    sums = {}
+    counts = {}
+    for name, series in values.items():
+        value = series.to_numpy(dtype=float)
+        sums[name] = np.bincount(group_index, weights=np.nan_to_num(value), minlength=n_groups + 1)[1:]
+        counts[name] = np.bincount(group_index, weights=~np.isnan(value), minlength=n_groups + 1)[1:]
+    return rows, sums, counts
+
+def hourly_daily_sums(df):
+    """
+    Summing the Pwear weighted ENMO, Pwear and HPFVM for each hour of the day and day of the week.
+    :return: Dictionary with (rows, sums, counts) for 'hour' and 'day', see sums_by_group().
+    """
+    values = {'weighted_ENMO': df['ENMO_mean'] * df['Pwear'], 'Pwear': df['Pwear']}
+    if not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP):
+        values['HPFVM_mean'] = df['HPFVM_mean']
+    return {'hour': sums_by_group(df, 'hourofday', 24, values), 'day': sums_by_group(df, 'dayofweek', 7, values)}
+
+def hourly_daily_variables(group_sums, dictionary, suffix='', hourly_zero_pwear=None):
+    """
+    Inputting the Pwear weighted ENMO means, Pwear sums and HPFVM means for each hour of the day and day of the week (e.g. enmo_mean_hour1, pwear_day7).
+    :param group_sums: Sums for each hour and day, see hourly_daily_sums().
+    :param suffix: Added to the variable names, e.g. '_IMP' for the imputed variables.
+    :param hourly_zero_pwear: Hourly ENMO mean used for hours with no Pwear. If None the mean is missing (0/0).
+    :return: The dictionary with the hourly and daily variables added.
+    """
+    hpfvm = not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP)
+    for name, (rows, sums, counts) in group_sums.items():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weighted_means = sums['weighted_ENMO'] / sums['Pwear']
+            if name == 'hour' and hourly_zero_pwear is not None:
+                weighted_means = np.where(sums['Pwear'] != 0, weighted_means, hourly_zero_pwear)
+            hpfvm_means = sums['HPFVM_mean'] / counts['HPFVM_mean'] if hpfvm else None
+
+        for group in range(1, len(rows) + 1):
+            present = rows[group - 1] > 0
+            dictionary[f'enmo_mean_{name}{group}{suffix}'] = weighted_means[group - 1] if present else np.nan
+            dictionary[f'pwear_{name}{group}{suffix}'] = sums['Pwear'][group - 1] if present else np.nan
+            if hpfvm:
+                dictionary[f'hpfvm_mean_{name}{group}{suffix}'] = hpfvm_means[group - 1] if present else np.nan
+
+    return dictionary
+
+def hourly_daily_means(df, dictionary, suffix='', hourly_zero_pwear=None):
+    return hourly_daily_variables(hourly_daily_sums(df), dictionary, suffix, hourly_zero_pwear)
+
 def input_hourly_daily(df, dictionary):
     if df is not None and not df.empty:
-
-        weighted_hourly_means = (
-            df.assign(weighted_ENMO = df['ENMO_mean'] * df['Pwear']).groupby('hourofday')
-            .apply(lambda x: x['weighted_ENMO'].sum() / x['Pwear'].sum() if x['Pwear'].sum() != 0 else 0, include_groups=False)
-        )
-        hourly_enmo_variables = {
-            f'enmo_mean_hour{hour}': weighted_hourly_means.get(hour, np.nan) for hour in range(1, 25)
-        }
-        dictionary.update(hourly_enmo_variables)
-
-        hourly_pwear_sums = df.groupby('hourofday')['Pwear'].sum()
-        hourly_pwear_variables = {
-            f'pwear_hour{hour}': hourly_pwear_sums.get(hour, np.nan) for hour in range(1, 25)
-        }
-        dictionary.update(hourly_pwear_variables)
-
-
-        weighted_daily_means = (
-            df.assign(weighted_daily_ENMO = df['ENMO_mean'] * df['Pwear']).groupby('dayofweek')
-            .apply(lambda x: x['weighted_daily_ENMO'].sum() / x['Pwear'].sum(), include_groups=False)
-        )
-        daily_enmo_variables = {
-            f'enmo_mean_day{day}': weighted_daily_means.get(day, np.nan) for day in range(1, 8)
-        }
-        dictionary.update(daily_enmo_variables)
-
-        daily_pwear_sums = df.groupby('dayofweek')['Pwear'].sum()
-        daily_pwear_variables = {
-            f'pwear_day{day}': daily_pwear_sums.get(day, np.nan) for day in range(1, 8)
-        }
-        dictionary.update(daily_pwear_variables)
-
-        if not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP):
-            hourly_hpfvm_means = df.groupby('hourofday')['HPFVM_mean'].mean()
-            hourly_hpfvm_variables = {
-                f'hpfvm_mean_hour{hour}': hourly_hpfvm_means.get(hour, np.nan) for hour in range(1, 25)
-            }
-            dictionary.update(hourly_hpfvm_variables)
-
-            daily_hpfvm_means = df.groupby('dayofweek')['HPFVM_mean'].mean()
-            daily_hpfvm_variables = {
-                f'hpfvm_mean_day{day}': daily_hpfvm_means.get(day, np.nan) for day in range(1, 8)
-            }
-            dictionary.update(daily_hpfvm_variables)
+        dictionary = hourly_daily_means(df, dictionary, hourly_zero_pwear=0)
+        return dictionary
 
 
-        return dictionary
+# DIURNALLY ADJUSTED MEANS (WEIGHTED LEAST SQUARES ON MORNING AND MIDNIGHT)
+# Condition number above which the weighted design is treated as singular and the regression is left to statsmodels
+WLS_MAX_CONDITION = 1e10
+
+# Variables the diurnally adjusted means are calculated for (ENMO/HPFVM mean and intensity variables)
+def wls_variables(df):
+    hpfvm = not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP)
+    mean_variables = ['ENMO_mean', 'HPFVM_mean'] if hpfvm else ['ENMO_mean']
+
+    # INTENSITY VARIABLES
+    variable_prefixes = 'ENMO_'
+    if hpfvm:
+        variable_prefixes += 'HPFVM_'
+    variable_suffix = 'plus'
+
+    intensity_variables = []
+    for variable_prefix in variable_prefixes:
+        for column_name in df.columns:
+            if column_name.startswith(variable_prefix) and column_name.endswith(variable_suffix) and column_name not in intensity_variables:
+                intensity_variables.append(column_name)
+    return mean_variables, intensity_variables
+
+# Running one regression with statsmodels (used if the weighted design is singular, so the result is the same as statsmodels gives)
+def wls_constant(subset_df, column_name, time_resolution):
+    X = subset_df[['MORNING', 'MIDNIGHT']]
+    Y = subset_df[column_name]
+    X = sm.add_constant(X)
+    weights = np.floor(time_resolution * subset_df['Pwear'])
+    model = sm.WLS(Y, X, weights=weights)
+    results = model.fit()
+    return results.params['const']
+
+def diurnal_adjusted_means(df, variables, time_resolution, inclusion_criteria, formula, by=None):
+    """
+    Calculating the diurnally adjusted mean of several variables at once. For each variable this is the constant from the weighted least squares regression
+    Y ~ const + MORNING + MIDNIGHT with weights floor(time_resolution * Pwear), using the epochs where Pwear > 0 and the variable is not missing.
+    Variables with the same missing epochs share the same weighted design (X'WX), which is only created once. All variables are then solved in one batched 3x3 solve.
+    :param df: Trimmed dataframe.
+    :param variables: List of variables to calculate the adjusted means for.
+    :param time_resolution: Epoch length in minutes.
+    :param inclusion_criteria: Minimum hours of wear time (Pwear sum / formula) needed for the mean to be calculated.
+    :param formula: Number of epochs in an hour.
+    :param by: Variable (or list of variables) to split the data by, e.g. 'day_number' to calculate the means for each day. All days are solved in the same batched solve. If None the whole dataframe is used.
+    :return: constants. Dictionary with the adjusted mean of each variable with enough wear time. If by is given, this is a dictionary for each value of by (e.g. constants[day_number][variable], or constants[(file_id, day_number)][variable] if by is a list).
+    :return: pwear_sums. Dictionary with the sum of Pwear of the epochs used for each variable (also for each value of by if given).
+    """
+    constants = {}
+    pwear_sums = {}
+    if not variables or df.empty:
+        return constants, pwear_sums
+
+    X = np.column_stack([np.ones(len(df)), df['MORNING'].to_numpy(dtype=float), df['MIDNIGHT'].to_numpy(dtype=float)])
+    Y = df[variables].to_numpy(dtype=float)
+    pwear = df['Pwear'].to_numpy(dtype=float)
+    weights = np.floor(time_resolution * pwear)
+    used = (pwear > 0)[:, None] & ~np.isnan(Y)
+
+    # Rows of each segment (in their original order), so each segment is only a slice of the sorted rows
+    if by is None:
+        segment_values, order, bounds = [0], np.arange(len(df)), [0, len(df)]
+    else:
+        codes, segment_values = pd.factorize(df[by] if isinstance(by, str) else pd.MultiIndex.from_frame(df[by]))
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(segment_values) + 1))
+
+    # Grouping the variables with the same epochs used (within each day if by is 'day_number')
+    groups = {}
+    for k, segment in enumerate(segment_values):
+        rows = order[bounds[k]:bounds[k + 1]]
+        constants[segment] = {}
+        pwear_sums[segment] = {}
+        for i in range(len(variables)):
+            mask = used[rows, i]
+            groups.setdefault((segment, mask.tobytes()), (rows[mask], []))[1].append(i)
+
+    design_list, right_hand_list, solved_variables = [], [], []
+    for (segment, _), (used_rows, group) in groups.items():
+        Pwear_sum = df['Pwear'].iloc[used_rows].sum()
+        for i in group:
+            pwear_sums[segment][variables[i]] = Pwear_sum
+        if not Pwear_sum / formula >= inclusion_criteria:
+            continue
+
+        X_group = X[used_rows]
+        weighted_X = X_group * weights[used_rows][:, None]
+        design = X_group.T @ weighted_X
+
+        # statsmodels does not add a constant if MORNING or MIDNIGHT is constant (non zero), and uses the pseudo inverse if the design is singular, so these are left to statsmodels
+        constant_regressor = ((np.ptp(X_group[:, 1:], axis=0) == 0) & np.all(X_group[:, 1:] != 0, axis=0)).any()
+        if constant_regressor or np.linalg.cond(design) > WLS_MAX_CONDITION:
+            subset_df = df.iloc[used_rows]
+            for i in group:
+                constants[segment][variables[i]] = wls_constant(subset_df, variables[i], time_resolution)
+            continue
+
+        right_hand = weighted_X.T @ Y[used_rows][:, group]
+        for k, i in enumerate(group):
+            design_list.append(design)
+            right_hand_list.append(right_hand[:, k])
+            solved_variables.append((segment, variables[i]))
+
+    # Solving the (days x variables, 3, 3) systems at once
+    if solved_variables:
+        params = np.linalg.solve(np.stack(design_list), np.stack(right_hand_list)[:, :, None])
+        for (segment, variable), const in zip(solved_variables, params[:, 0, 0]):
+            constants[segment][variable] = const
+
+    if by is None:
+        return constants[0], pwear_sums[0]
+    return constants, pwear_sums
 
 
 # SUMMARISING OUTPUT VARIABLES
-def input_output_variables(df, dictionary, time_resolution, inclusion_criteria):
+# If the adjusted means have already been calculated (for all days at once in the daily collapse) these are used
+def input_output_variables(df, dictionary, time_resolution, inclusion_criteria, formula, adjusted_means=None):
     if df is not None and not df.empty:
+        mean_variables, intensity_variables = wls_variables(df)
+        if adjusted_means is None:
+            adjusted_means = diurnal_adjusted_means(df, mean_variables + intensity_variables, time_resolution, inclusion_criteria, formula)
+        constants, pwear_sums = adjusted_means
 
-        # ENMO MEAN
-        filtered_df = df[(df['ENMO_mean'].notna()) & (df['Pwear'].notna()) & (df['Pwear'] > 0)]
-        Pwear_sum = filtered_df['Pwear'].sum()
-        dictionary['Pwear'] = Pwear_sum
-
-        if Pwear_sum / formula >= inclusion_criteria:
-
-            X = filtered_df[['MORNING', 'MIDNIGHT']]
-            Y = filtered_df['ENMO_mean']
-            X = sm.add_constant(X)
-            weights = np.floor(time_resolution * filtered_df['Pwear'])
-            model = sm.WLS(Y, X, weights=weights)
-            results = model.fit()
-            dictionary['enmo_mean'] = results.params['const']
-        
-        # HPFVM 
-        if not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP):
-            # HPFVM MEAN
-            filtered_df = df[(df['HPFVM_mean'].notna()) & (df['Pwear'].notna()) & (df['Pwear'] > 0)]
-            Pwear_sum = filtered_df['Pwear'].sum()
-            dictionary['Pwear'] = Pwear_sum
-
-            if Pwear_sum / formula >= inclusion_criteria:
-                X = filtered_df[['MORNING', 'MIDNIGHT']]
-                Y = filtered_df['HPFVM_mean']
-                X = sm.add_constant(X)
-                weights = np.floor(time_resolution * filtered_df['Pwear'])
-                model = sm.WLS(Y, X, weights=weights)
-                results = model.fit()
-                dictionary['hpfvm_mean'] = results.params['const']
-
-        # INTENSITY VARIABLES
-        variable_prefix = 'ENMO_'
-        variable_suffix = 'plus'
+        # ENMO MEAN and HPFVM MEAN (Pwear is from the last of these)
+        for variable in mean_variables:
+            dictionary['Pwear'] = pwear_sums[variable]
+            if variable in constants:
+                dictionary[variable.lower()] = constants[variable]
 
         # INTENSITY VARIABLES
-        variable_prefixes = 'ENMO_'
-        if not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP):
-            variable_prefixes += 'HPFVM_'
-        variable_suffix = 'plus'
-
-        for variable_prefix in variable_prefixes:
-            for column_name in df.columns:
-                if column_name.startswith(variable_prefix) and column_name.endswith(variable_suffix):
-                    threshold_subset = df[(df['Pwear'] > 0) & (df[column_name].notna())]
-                    PWEAR_sum = threshold_subset['Pwear'].sum()
-
-                    if PWEAR_sum / formula >= inclusion_criteria:
-                        X = threshold_subset[['MORNING', 'MIDNIGHT']]
-                        Y = threshold_subset[column_name]
-                        X = sm.add_constant(X)
-                        weights = np.floor(time_resolution * threshold_subset['Pwear'])
-                        model = sm.WLS(Y, X, weights=weights)
-                        results = model.fit()
-                        column_name = column_name.lower()
-                        dictionary[column_name] = results.params['const']
+        for column_name in intensity_variables:
+            if column_name in constants:
+                dictionary[column_name.lower()] = constants[column_name]
         return dictionary
 
+# IMPUTING SLEEP DATA FOR ALL DAYS AT ONCE (the same as impute_data does for each day in the daily collapse)
+def impute_days(df, inplace=False, by='day_number'):
+    """
+    Imputing sleep hours for all days at once: on days with more than MIN_DAY_HOURS fully worn (Pwear == 1), the IMPUTE_HOURS with no wear are set to ENMO_mean 0, ENMO_0plus 1 and Pwear 1.
+    :param df: Trimmed dataframe (or one day of it).
+    :param inplace: If True the imputed values are written into df. If False (default) df is left unchanged and an imputed copy is returned.
+    :param by: Variable(s) identifying a day, ['batch_file_id', 'day_number'] if several files are concatenated.
+    :return: imputed_df. The imputed dataframe.
+    :return: imputed_rows. Boolean series, True for the rows that were imputed.
+    """
+    imputed_df = df if inplace else df.copy()
+    fully_worn_sum = imputed_df['Pwear'].where(imputed_df['Pwear'] == 1, 0).groupby([imputed_df[column] for column in ([by] if isinstance(by, str) else by)]).transform('sum')
+    condition = (
+            (imputed_df['hourofday'].isin(config.IMPUTE_HOURS)) &
+            (imputed_df['Pwear'] == 0) &
+            (fully_worn_sum > config.MIN_DAY_HOURS))
+
+    imputed_df.loc[condition, ['ENMO_mean', 'ENMO_0plus', 'Pwear']] = [0, 1, 1]
+    return imputed_df, condition
+
 # IMPUTING SLEEP DATA
-def impute_data(df, time_resolution, dictionary, collapse_level, inclusion_criteria):
+def impute_data(df, time_resolution, dictionary, collapse_level, inclusion_criteria, formula, adjusted_means=None, inplace=False, not_imputed_means=None):
+    """
+    Creating the imputed (_IMP) variables. Each day is imputed separately, see impute_days().
+    :param adjusted_means: Diurnally adjusted means of the imputed data, if already calculated.
+    :param inplace: If True the imputed values are written into df. If False (default) df is left unchanged.
+    :param not_imputed_means: Diurnally adjusted means of the data before imputation. If no rows are imputed these are used instead of refitting the regressions.
+    :return: The dictionary with the imputed variables added.
+    """
     if df is not None and not df.empty:
 
-        if collapse_level == 'summary':
-            max_days = df['day_number'].max()
-            for dayNum in range(1, max_days + 1):
-                subset_df = df[(df['day_number'] == dayNum) & (df['Pwear'] == 1)]
-                Pwear_sum = subset_df['Pwear'].sum()
-                if Pwear_sum > config.MIN_DAY_HOURS:
-                    for X in config.IMPUTE_HOURS:
-                        condition = (
-                                (df['hourofday'] == X) &
-                                (df['Pwear'] == 0) &
-                                (df['day_number'] == dayNum))
-
-                        df.loc[condition, ['ENMO_mean', 'ENMO_0plus', 'Pwear']] = [0, 1, 1]
-
-        if collapse_level == 'daily':
-            subset_df = df[(df['Pwear'] == 1)]
-            Pwear_sum = subset_df['Pwear'].sum()
-            if Pwear_sum > config.MIN_DAY_HOURS:
-                for X in config.IMPUTE_HOURS:
-                    condition = (
-                            (df['hourofday'] == X) &
-                            (df['Pwear'] == 0))
-
-                    df.loc[condition, ['ENMO_mean', 'ENMO_0plus', 'Pwear']] = [0, 1, 1]
+        df, imputed_rows = impute_days(df, inplace=inplace)
 
         # Calculating Pwear Imputed variables by quadrants
         dictionary['Pwear_IMP'] = df['Pwear'].sum() / formula
 
-        # Defining quad variables
-        quad_morning_hours = (df['hourofday'] > 0) & (df['hourofday'] <= 6)
-        quad_noon_hours = (df['hourofday'] > 6) & (df['hourofday'] <= 12)
-        quad_afternoon_hours = (df['hourofday'] > 12) & (df['hourofday'] <= 18)
-        quad_night_hours = (df['hourofday'] > 18) & (df['hourofday'] <= 24)
-        quadrants = ['morning', 'noon', 'afternoon', 'night']
-        quad_variables = [quad_morning_hours, quad_noon_hours, quad_afternoon_hours, quad_night_hours]
-
-        Pwear_IMP_by_quad = {}
-        for quad, variables in zip(quadrants, quad_variables):
-            Pwear_IMP_sum = df.loc[variables, 'Pwear'].sum()
-            quadrant = f'Pwear_{quad}_IMP'
-            Pwear_IMP_by_quad[quadrant] = Pwear_IMP_sum / formula
-            dictionary[quadrant] = Pwear_IMP_by_quad[quadrant]
+        pwear_sums = pwear_by_segment(df)
+        for quad in QUADRANTS:
+            dictionary[f'Pwear_{quad}_IMP'] = pwear_sums[quad] / formula
 
         if collapse_level == 'summary':
 
             # PWear imputed variables by weekend/weekday
-            PWear_wkday_IMP = df[df['wkday'] == 1]['Pwear'].sum() / formula
-            PWear_wkend_IMP = df[df['wkend'] == 1]['Pwear'].sum() / formula
-
-            dictionary['Pwear_wkday_IMP'] = PWear_wkday_IMP
-            dictionary['Pwear_wkend_IMP'] = PWear_wkend_IMP
+            dictionary['Pwear_wkday_IMP'] = pwear_sums['wkday'] / formula
+            dictionary['Pwear_wkend_IMP'] = pwear_sums['wkend'] / formula
 
             # PWear imputed variables by quadrant and weekend/weekday
-            day_types = ['wkday', 'wkend']
-            Pwear_by_quad_daytime_IMP = {}
-            for day_type in day_types:
-                for quad, variables in zip(quadrants, quad_variables):
-                    condition = variables & (df[day_type] == 1)
-                    Pwear_sum_IMP = df.loc[condition, 'Pwear'].sum()
-                    key = f'Pwear_{quad}_{day_type}_IMP'
-                    Pwear_by_quad_daytime_IMP[key] = Pwear_sum_IMP / formula
-
-                    dictionary[key] = Pwear_by_quad_daytime_IMP[key]
-
-        # ENMO MEAN imputed
-        impute_enmo_df = df[
-            (df['ENMO_mean'].notna()) & (df['Pwear'].notna()) & (df['Pwear'] > 0)]
-        Pwear_sum = impute_enmo_df['Pwear'].sum()
-
-        if Pwear_sum / formula >= inclusion_criteria:
-            X = impute_enmo_df[['MORNING', 'MIDNIGHT']]
-            Y = impute_enmo_df['ENMO_mean']
-            X = sm.add_constant(X)
-            weights = np.floor(time_resolution * impute_enmo_df['Pwear'])
-            model = sm.WLS(Y, X, weights=weights)
-            results = model.fit()
-            dictionary['enmo_mean_IMP'] = results.params['const']
-
-        if not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP):
-            # HPFVM MEAN imputed
-            impute_hpfvm_df = df[
-                (df['HPFVM_mean'].notna()) & (df['Pwear'].notna()) & (df['Pwear'] > 0)]
-            Pwear_sum = impute_hpfvm_df['Pwear'].sum()
-
-            if Pwear_sum / formula >= inclusion_criteria:
-                X = impute_hpfvm_df[['MORNING', 'MIDNIGHT']]
-                Y = impute_hpfvm_df['HPFVM_mean']
-                X = sm.add_constant(X)
-                weights = np.floor(time_resolution * impute_hpfvm_df['Pwear'])
-                model = sm.WLS(Y, X, weights=weights)
-                results = model.fit()
-                dictionary['hpfvm_mean_IMP'] = results.params['const']
-
-        # INTENSITY VARIABLES
-        variable_prefixes = 'ENMO_'
-        if not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP):
-            variable_prefixes += 'HPFVM_'
-        variable_suffix = 'plus'
-
-        for variable_prefix in variable_prefixes:
-            for column_name in df.columns:
-                if column_name.startswith(variable_prefix) and column_name.endswith(variable_suffix):
-                    threshold_subset = df[(df['Pwear'] > 0) & (df[column_name].notna())]
-                    PWEAR_sum = threshold_subset['Pwear'].sum()
-
-                    if PWEAR_sum / formula >= inclusion_criteria:
-                        X = threshold_subset[['MORNING', 'MIDNIGHT']]
-                        Y = threshold_subset[column_name]
-                        X = sm.add_constant(X)
-                        weights = np.floor(time_resolution * threshold_subset['Pwear'])
-                        model = sm.WLS(Y, X, weights=weights)
-                        results = model.fit()
-                        column_name = f'{column_name.lower()}_IMP'
-                        dictionary[column_name] = results.params['const']
+            for day_type in DAY_TYPES:
+                for quad in QUADRANTS:
+                    dictionary[f'Pwear_{quad}_{day_type}_IMP'] = pwear_sums[(quad, day_type)] / formula
+
+        # ENMO MEAN, HPFVM MEAN and INTENSITY VARIABLES imputed
+        mean_variables, intensity_variables = wls_variables(df)
+        if adjusted_means is None and not_imputed_means is not None and not imputed_rows.any():
+            # Nothing was imputed, so the imputed means are the same as the means before imputation
+            adjusted_means = not_imputed_means
+        if adjusted_means is None:
+            adjusted_means = diurnal_adjusted_means(df, mean_variables + intensity_variables, time_resolution, inclusion_criteria, formula)
+        constants, pwear_sums = adjusted_means
+        for column_name in mean_variables + intensity_variables:
+            if column_name in constants:
+                dictionary[f'{column_name.lower()}_IMP'] = constants[column_name]
 
         if collapse_level == 'summary':
             # Hourly and daily Enmo and Pwear variables
-            weighted_hourly_means_IMP = (
-                df.assign(weighted_ENMO_IMP=df['ENMO_mean'] * df['Pwear']).groupby('hourofday')
-                .apply(lambda x: x['weighted_ENMO_IMP'].sum() / x['Pwear'].sum(), include_groups=False)
-            )
-            hourly_enmo_IMP_variables = {
-                f'enmo_mean_hour{hour}_IMP': weighted_hourly_means_IMP.get(hour, np.nan) for hour in range(1, 25)
-            }
-            dictionary.update(hourly_enmo_IMP_variables)
-
-            hourly_pwear_sums = df.groupby('hourofday')['Pwear'].sum()
-            hourly_pwear_IMP_variables = {
-                f'pwear_hour{hour}_IMP': hourly_pwear_sums.get(hour, np.nan) for hour in range(1, 25)
-            }
-            dictionary.update(hourly_pwear_IMP_variables)
-
-            weighted_daily_means_IMP = (
-                df.assign(weighted_daily_ENMO_IMP=df['ENMO_mean'] * df['Pwear']).groupby('dayofweek')
-                .apply(lambda x: x['weighted_daily_ENMO_IMP'].sum() / x['Pwear'].sum(), include_groups=False)
-            )
-            daily_enmo_IMP_variables = {
-                f'enmo_mean_day{day}_IMP': weighted_daily_means_IMP.get(day, np.nan) for day in range(1, 8)
-            }
-            dictionary.update(daily_enmo_IMP_variables)
-
-            daily_pwear_sums = df.groupby('dayofweek')['Pwear'].sum()
-            daily_pwear_IMP_variables = {
-                f'pwear_day{day}_IMP': daily_pwear_sums.get(day, np.nan) for day in range(1, 8)
-            }
-            dictionary.update(daily_pwear_IMP_variables)
-
-            if not any(item.lower() == "hpfvm" for item in config.VARIABLES_TO_DROP):
-                # Hourly and daily hpfvm variables
-                hourly_hpfvm_means = df.groupby('hourofday')['HPFVM_mean'].mean()
-                hourly_hpfvm_IMP_variables = {
-                    f'hpfvm_mean_hour{hour}_IMP': hourly_hpfvm_means.get(hour, np.nan) for hour in range(1, 25)
-                }
-                dictionary.update(hourly_hpfvm_IMP_variables)
-
-                daily_hpfvm_means = df.groupby('dayofweek')['HPFVM_mean'].mean()
-                daily_hpfvm_IMP_variables = {
-                    f'hpfvm_mean_day{day}_IMP': daily_hpfvm_means.get(day, np.nan) for day in range(1, 8)
-                }
-                dictionary.update(daily_hpfvm_IMP_variables)
+            dictionary = hourly_daily_means(df, dictionary, suffix='_IMP')
 
         return dictionary
 
+# CALCULATING THE DIURNALLY ADJUSTED MEANS BEFORE AND AFTER IMPUTATION FOR ALL DAYS (OR FILES) AT ONCE
+def adjusted_and_imputed_means(df, time_resolution, inclusion_criteria, by):
+    """
+    Calculating the diurnally adjusted means for each value of by, and for the imputed data if IMPUTE_DATA is 'Yes' in config.py.
+    The imputed regressions are only fitted for the days/files with imputed hours, the others have the same means as before imputation.
+    :param df: Trimmed dataframe, or several trimmed dataframes concatenated with the batch_file_id column added (see collapsing_batch()).
+    :param by: 'day_number' (each day of one file), 'batch_file_id' (each file of a batch) or ['batch_file_id', 'day_number'] (each day of each file of a batch).
+    :return: adjusted_means. (constants, pwear_sums) for each value of by, see diurnal_adjusted_means().
+    :return: imputed_adjusted_means. The same for the imputed data (None if IMPUTE_DATA is not 'Yes').
+    """
+    formula = 60 / time_resolution
+    mean_variables, intensity_variables = wls_variables(df)
+    adjusted_means = diurnal_adjusted_means(df, mean_variables + intensity_variables, time_resolution, inclusion_criteria, formula, by=by)
+    if config.IMPUTE_DATA.lower() != 'yes':
+        return adjusted_means, None
+
+    imputed_df, imputed_rows = impute_days(df, by=['batch_file_id', 'day_number'] if 'batch_file_id' in df.columns else 'day_number')
+    segments = imputed_df[by] if isinstance(by, str) else pd.MultiIndex.from_frame(imputed_df[by])
+    imputed_segments = np.asarray(segments.isin(segments[imputed_rows.to_numpy()]))
+    imputed_adjusted_means = diurnal_adjusted_means(imputed_df[imputed_segments], mean_variables + intensity_variables, time_resolution, inclusion_criteria, formula, by=by)
+    for segment in adjusted_means[0]:
+        if segment not in imputed_adjusted_means[0]:
+            imputed_adjusted_means[0][segment] = adjusted_means[0][segment]
+            imputed_adjusted_means[1][segment] = adjusted_means[1][segment]
+    return adjusted_means, imputed_adjusted_means
+
+# SUMMING THE STATISTICS NEEDED TO RE-COLLAPSE A FILE WITHOUT RE-READING IT (see Collapse_Statistics.py)
+PWEAR_STATES = {'missing': 0, 'zero': 1, 'part': 2, 'full': 3}
+
+def collapse_statistics(df, time_resolution, pwear_before_noise):
+    """
+    Summing the statistics of a trimmed file for each day, hour of day, day of week, mechanical noise flag and Pwear state (Pwear before mechanical noise is removed).
+    For each regression variable this is the number of values (n__), their sum (y__) and for the worn epochs the sum of the weights (w__), weighted sum (wy__) and Pwear (p__),
+    which are sufficient to solve the diurnal adjustment regressions with any inclusion criteria, mechanical noise removal or imputed hours.
+    :param df: Trimmed dataframe.
+    :param time_resolution: Epoch length in minutes.
+    :param pwear_before_noise: Pwear of the part processed file before it was set to 0 for mechanical noise (see remove_data()).
+    :return: Dataframe with one row per bucket. MECH_NOISE_REMOVED is the REMOVE_MECH_NOISE setting used for the trimmed file (1 if 'Yes').
+    """
+    pwear = pd.to_numeric(pwear_before_noise.loc[df.index]).to_numpy(dtype=float)
+    weights = np.floor(time_resolution * pwear)
+    worn = pwear > 0
+    buckets = {'day_number': df['day_number'].to_numpy(), 'hourofday': df['hourofday'].to_numpy(), 'dayofweek': df['dayofweek'].to_numpy(),
+               'FLAG_MECH_NOISE': df['FLAG_MECH_NOISE'].fillna(0).to_numpy() if 'FLAG_MECH_NOISE' in df.columns else np.zeros(len(df)),
+               'pwear_state': np.select([np.isnan(pwear), pwear == 0, pwear == 1], [PWEAR_STATES['missing'], PWEAR_STATES['zero'], PWEAR_STATES['full']], default=PWEAR_STATES['part'])}
+
+    values = {'rows': np.ones(len(df)), 'n_pwear': ~np.isnan(pwear), 'sum_pwear': np.nan_to_num(pwear), 'sum_enmo_pwear': np.nan_to_num(df['ENMO_mean'].to_numpy(dtype=float) * pwear)}
+    if 'HPFVM_mean' in df.columns:
+        hpfvm = df['HPFVM_mean'].to_numpy(dtype=float)
+        values['sum_hpfvm'] = np.nan_to_num(hpfvm)
+        values['n_hpfvm'] = ~np.isnan(hpfvm)
+
+    mean_variables, intensity_variables = wls_variables(df)
+    for variable in mean_variables + intensity_variables:
+        y = df[variable].to_numpy(dtype=float)
+        present = ~np.isnan(y)
+        used = present & worn
+        values[f'n__{variable}'] = present
+        values[f'y__{variable}'] = np.where(present, y, 0)
+        values[f'w__{variable}'] = np.where(used, weights, 0)
+        values[f'wy__{variable}'] = np.where(used, weights * y, 0)
+        values[f'p__{variable}'] = np.where(used, pwear, 0)
+
+    statistics_df = pd.DataFrame(values).astype(float).groupby([pd.Series(value, name=name) for name, value in buckets.items()], dropna=False).sum().reset_index()
+    statistics_df['TIME_RESOLUTION'] = time_resolution
+    statistics_df['MECH_NOISE_REMOVED'] = int(config.REMOVE_MECH_NOISE.lower() == 'yes')
+    return statistics_df
+
 # Inputting data into headers dataframe and outputting summary_means dataset
-def output_summary_means(dictionary, headers_df):
+def output_summary_means(dictionary, headers_df, df, file_id, summary_files_path, collapsed_dfs=None):
     if df is not None and not df.empty:
 
         # Adding the data from the summary dictionary into the empty dataframe (using the headers)
@@ -777,12 +849,14 @@ def output_summary_means(dictionary, headers_df):
 
         # Outputting summary dataframe
         os.makedirs(summary_files_path, exist_ok=True)
-        file_name = os.path.join(summary_files_path, f"{file_id}_{config.SUM_OVERALL_MEANS}.csv")
-        summary_data.to_csv(file_name, index=False)
+        file_name = Intermediate_Files.path(summary_files_path, f"{file_id}_{config.SUM_OVERALL_MEANS}")
+        Intermediate_Files.write(summary_data, file_name)
+        if collapsed_dfs is not None:
+            collapsed_dfs[file_name] = summary_data
         return summary_data
 
 # Appending daily means so only one dataframe per id
-def append_daily_means(dictionary, headers_df, accumulated_dataframes):
+def append_daily_means(dictionary, headers_df, accumulated_dataframes, file_id):
 
     # Converting dictionary to a single-row dataframe
     daily_row = pd.DataFrame([dictionary], columns=headers_df.columns)
@@ -893,12 +967,185 @@ def data_dic(headers_df, collapse_level, file_path, dictionary_name):
 
     df_labels = pd.DataFrame(list(variable_label.items()), columns=["Variable", "Label"])
 
-    os.makedirs(summary_files_path, exist_ok=True)
+    os.makedirs(file_path, exist_ok=True)
     file_name = os.path.join(file_path, dictionary_name)
     df_labels.to_csv(file_name, index=False)
 
 # Calling the functions
-if __name__ == '__main__':
+# READING AND TRIMMING ONE FILE AND OUTPUTTING THE TRIMMED HOURLY/MINUTE LEVEL FILE (done once per file and used for both the summary and daily files)
+def prepared_file(file_id, partPro_path, summary_files_path, trimmed_path, part_proc_dfs=None, collapsed_dfs=None):
+    time_resolution, df = reading_part_proc(file_id, partPro_path, date_orig='DATETIME_ORIG', part_proc_dfs=part_proc_dfs)
+
+    # Keeping Pwear before mechanical noise is removed for the collapse statistics, so these can be re-collapsed with or without removing mechanical noise
+    output_statistics = config.OUTPUT_COLLAPSE_STATISTICS.lower() == 'yes'
+    pwear_before_noise = df['Pwear'].copy() if output_statistics else None
+
+    # Truncating data (depending on what is specified in config file) and creating dataframe if no valid data:
+    df = remove_data(df)
+    row_count, flag_valid_total = creating_dummy(df, file_id, time_resolution, partPro_path, summary_files_path, part_proc_dfs, collapsed_dfs)
+    df = trimmed_dataset(df, file_id, time_resolution, output_trimmed_df='Yes', row_count=row_count, flag_valid_total=flag_valid_total, trimmed_path=trimmed_path, collapsed_dfs=collapsed_dfs)
+
+    # Outputting the collapse statistics (only for files with valid data)
+    if output_statistics and row_count > 1 and flag_valid_total != 1:
+        statistics_path = create_path(config.INDIVIDUAL_STATS_F)
+        os.makedirs(statistics_path, exist_ok=True)
+        Intermediate_Files.write(collapse_statistics(df, time_resolution, pwear_before_noise), Intermediate_Files.path(statistics_path, f"{file_id}_{config.STATS_FILE_EXT}"))
+
+    return time_resolution, df
+
+
+# COLLAPSING ONE FILE TO SUMMARY LEVEL
+def summary_file(file_id, time_resolution, df, summary_files_path, collapsed_dfs=None, adjusted_means=None, imputed_adjusted_means=None):
+
+    # Creating empty dataframe with headers, to fill in with data later
+    summary_headers_df = creating_headers(file_id, collapse_level='summary', file_path=summary_files_path, file_name=config.SUM_OVERALL_MEANS)
+
+    # Summarizing data and inputting into dataframe
+    formula = 60 / time_resolution   # Formula used when creating data for dataframe
+    summary_dict = input_data(df, time_resolution, collapse_level='summary')
+    summary_dict = input_pwear_segment(df, summary_dict, collapse_level='summary', formula=formula)
+
+    if config.PROCESSING.lower() == 'pampro':
+        summary_dict = input_hourly_daily(df, summary_dict)
+    if adjusted_means is None:
+        mean_variables, intensity_variables = wls_variables(df)
+        adjusted_means = diurnal_adjusted_means(df, mean_variables + intensity_variables, time_resolution, inclusion_criteria=config.SUM_MIN_HOUR_INCLUSION, formula=formula)
+    summary_dict = input_output_variables(df, summary_dict, time_resolution, inclusion_criteria=config.SUM_MIN_HOUR_INCLUSION, formula=formula, adjusted_means=adjusted_means)
+
+    # Impute hours (the regressions are only refitted if any hours are imputed)
+    if config.IMPUTE_DATA.lower() == 'yes':
+        summary_dict = impute_data(df, time_resolution, summary_dict, collapse_level='summary', inclusion_criteria=config.SUM_MIN_HOUR_INCLUSION, formula=formula,
+                                   adjusted_means=imputed_adjusted_means, not_imputed_means=adjusted_means)
+
+    # Outputting summary means dataset
+    output_summary_means(summary_dict, summary_headers_df, df, file_id, summary_files_path, collapsed_dfs)
+
+    return summary_headers_df
+
+
+# COLLAPSING ONE FILE TO DAILY LEVEL
+def daily_file(file_id, time_resolution, daily_df, daily_files_path, accumulated_dataframes, collapsed_dfs=None, adjusted_means=None, imputed_adjusted_means=None):
+
+    # Creating empty dataframe with headers, to fill in with data later
+    daily_headers_df = creating_headers(file_id, collapse_level='daily', file_path=daily_files_path, file_name=config.DAY_OVERALL_MEAN)
+
+    # Calculating the diurnally adjusted means for all days at once (also for the imputed data), unless already calculated for the whole batch
+    if adjusted_means is None:
+        adjusted_means, imputed_adjusted_means = adjusted_and_imputed_means(daily_df, time_resolution, inclusion_criteria=config.DAY_MIN_HOUR_INCLUSION, by='day_number')
+
+    # Counting how many days in file to loop through each day:
+    DAY_MAX = daily_df['day_number'].max()
+    for day_number in range(1, DAY_MAX + 1):
+        day_df = daily_df[daily_df['day_number'] == day_number].copy()
+
+        # Creating daily summarized variables
+        if not day_df.empty:
+            formula = 60 / time_resolution  # Formula used when creating data for dataframe
+            daily_summary_dict = input_data(day_df, time_resolution, collapse_level='daily')
+            daily_summary_dict = input_pwear_segment(day_df, daily_summary_dict, collapse_level='daily', formula=formula)
+            daily_summary_dict = input_output_variables(day_df, daily_summary_dict, time_resolution, inclusion_criteria=config.DAY_MIN_HOUR_INCLUSION, formula=formula,
+                                                        adjusted_means=(adjusted_means[0][day_number], adjusted_means[1][day_number]))
+
+            # Impute hours
+            if config.IMPUTE_DATA.lower() == 'yes':
+                daily_summary_dict = impute_data(day_df, time_resolution, daily_summary_dict, collapse_level='daily', inclusion_criteria=config.DAY_MIN_HOUR_INCLUSION, formula=formula,
+                                                 adjusted_means=(imputed_adjusted_means[0][day_number], imputed_adjusted_means[1][day_number]))
+
+            # Appendinging daily means so only one file per id
+            accumulated_dataframes = append_daily_means(daily_summary_dict, daily_headers_df, accumulated_dataframes, file_id)
+
+    # Outputting daily_means csv, one per id
+    if file_id in accumulated_dataframes and not accumulated_dataframes[file_id].empty:
+        os.makedirs(daily_files_path, exist_ok=True)
+        output_file = Intermediate_Files.path(daily_files_path, f'{file_id}_{config.DAY_OVERALL_MEAN}')
+        Intermediate_Files.write(accumulated_dataframes[file_id], output_file)
+        if collapsed_dfs is not None:
+            collapsed_dfs[output_file] = accumulated_dataframes[file_id]
+
+    return daily_headers_df
+
+
+# COLLAPSING ONE FILE: READING AND TRIMMING IT ONCE AND CREATING THE SUMMARY AND/OR DAILY FILES FROM IT
+def collapsing_file(file_id, partPro_path, summary_files_path, trimmed_path, daily_files_path, accumulated_dataframes, run_summary, run_daily, part_proc_dfs=None, collapsed_dfs=None):
+    """
+    Collapsing one part processed file. The file is read in and trimmed once (outputting the trimmed file) and then collapsed to the summary and/or daily level.
+    :param run_summary: True if the summary file should be created.
+    :param run_daily: True if the daily file should be created.
+    :return: summary_headers_df and daily_headers_df (None if not created), used for the data dictionaries.
+    """
+    summary_headers_df = None
+    daily_headers_df = None
+    time_resolution, df = prepared_file(file_id, partPro_path, summary_files_path, trimmed_path, part_proc_dfs, collapsed_dfs)
+
+    if run_summary:
+        summary_headers_df = summary_file(file_id, time_resolution, df, summary_files_path, collapsed_dfs)
+    if run_daily:
+        daily_headers_df = daily_file(file_id, time_resolution, df, daily_files_path, accumulated_dataframes, collapsed_dfs)
+
+    return summary_headers_df, daily_headers_df
+
+
+# COLLAPSING A BATCH OF FILES: THE REGRESSIONS OF ALL FILES (AND ALL DAYS) IN THE BATCH ARE SOLVED TOGETHER
+def split_by_file(adjusted_means):
+    # Splitting means calculated by ['batch_file_id', 'day_number'] into means by day_number for each file
+    split_means = {}
+    for (file_id, day_number), constants in adjusted_means[0].items():
+        file_means = split_means.setdefault(file_id, ({}, {}))
+        file_means[0][day_number] = constants
+        file_means[1][day_number] = adjusted_means[1][(file_id, day_number)]
+    return split_means
+
+def collapsing_batch(file_ids, partPro_path, summary_files_path, trimmed_path, daily_files_path, accumulated_dataframes, run_summary, run_daily, part_proc_dfs=None, collapsed_dfs=None):
+    """
+    Collapsing several part processed files together. Each file is read in and trimmed once (outputting the trimmed file), then the trimmed files are concatenated (keyed by batch_file_id)
+    so the diurnally adjusted means of all files and days are solved in one batched solve. The summary and daily files are then written for each file.
+    :param file_ids: List of file_ids in the batch (COLLAPSE_BATCH_SIZE in config.py).
+    :return: summary_headers_df and daily_headers_df (None if not created), used for the data dictionaries.
+    """
+    summary_headers_df = None
+    daily_headers_df = None
+    prepared = {file_id: prepared_file(file_id, partPro_path, summary_files_path, trimmed_path, part_proc_dfs, collapsed_dfs) for file_id in file_ids}
+
+    # Only the files with valid data are trimmed, the other files are collapsed one by one as before
+    trimmed_ids = [file_id for file_id, (time_resolution, df) in prepared.items() if df is not None and not df.empty and 'day_number' in df.columns]
+
+    summary_means = {}
+    daily_means = {}
+    for time_resolution in set(prepared[file_id][0] for file_id in trimmed_ids):
+        batch_ids = [file_id for file_id in trimmed_ids if prepared[file_id][0] == time_resolution]
+        batch_df = pd.concat([prepared[file_id][1].assign(batch_file_id=file_id) for file_id in batch_ids], ignore_index=True)
+
+        if run_summary:
+            adjusted_means, imputed_adjusted_means = adjusted_and_imputed_means(batch_df, time_resolution, inclusion_criteria=config.SUM_MIN_HOUR_INCLUSION, by='batch_file_id')
+            for file_id in batch_ids:
+                summary_means[file_id] = ((adjusted_means[0][file_id], adjusted_means[1][file_id]),
+                                          (imputed_adjusted_means[0][file_id], imputed_adjusted_means[1][file_id]) if imputed_adjusted_means is not None else None)
+        if run_daily:
+            adjusted_means, imputed_adjusted_means = adjusted_and_imputed_means(batch_df, time_resolution, inclusion_criteria=config.DAY_MIN_HOUR_INCLUSION, by=['batch_file_id', 'day_number'])
+            adjusted_means = split_by_file(adjusted_means)
+            imputed_adjusted_means = split_by_file(imputed_adjusted_means) if imputed_adjusted_means is not None else {}
+            for file_id in batch_ids:
+                daily_means[file_id] = (adjusted_means.get(file_id, ({}, {})), imputed_adjusted_means.get(file_id))
+        del batch_df
+
+    for file_id, (time_resolution, df) in prepared.items():
+        if run_summary:
+            summary_headers_df = summary_file(file_id, time_resolution, df, summary_files_path, collapsed_dfs, *summary_means.get(file_id, (None, None)))
+        if run_daily:
+            daily_headers_df = daily_file(file_id, time_resolution, df, daily_files_path, accumulated_dataframes, collapsed_dfs, *daily_means.get(file_id, (None, None)))
+
+    return summary_headers_df, daily_headers_df
+
+
+def main(part_proc_dfs=None, hand_over_dataframes=False):
+    """
+    Collapsing the part processed files to trimmed, summary and/or daily level files.
+    :param part_proc_dfs: Optional dictionary of part processed dataframes (by file_id) handed over from GENERIC_exh_postprocessing when the orchestra is run in-process. Files not in the dictionary are read from the Individual_PartPro_files folder.
+    :param hand_over_dataframes: If True the individual summary and daily dataframes are kept and returned so they can be handed over to Appending_Files when the orchestra is run in-process.
+    :return: collapsed_dfs: Dictionary of the individual summary and daily files outputted by this script (by file path) if hand_over_dataframes is True, otherwise None.
+    """
+    collapsed_dfs = {} if hand_over_dataframes else None
+
     # Creating folder paths user for this script
     trimmed_path = create_path(config.INDIVIDUAL_TRIMMED_F)
     summary_files_path = create_path(config.INDIVIDUAL_SUM_F)
@@ -911,106 +1158,54 @@ if __name__ == '__main__':
     # Creating filelist to loop through each file individually:
     file_list = reading_filelist()
 
+    run_summary = Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_SUMMARY.lower() == 'yes'
+    run_daily = Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_DAILY.lower() == 'yes'
+
     # Creating and outputting trimmed hourly/minute level file if specifies in orchestra file and the other collapse files are not needed
-    if Acc_Post_Processing_Orchestra.RUN_CREATE_TRIMMED_FILE.lower() == 'yes' and Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_SUMMARY.lower() == 'no' and Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_DAILY.lower() == 'no':
+    if Acc_Post_Processing_Orchestra.RUN_CREATE_TRIMMED_FILE.lower() == 'yes' and not run_summary and not run_daily:
         if config.count_prefixes.lower() == '1h':
             level = 'HOURLY'
         if config.count_prefixes.lower() == '1m':
             level = 'MINUTE LEVEL'
         Acc_Post_Processing_Orchestra.print_message(f"CREATING TRIMMED {level} FILES")
-        for file_id in file_list:
-            time_resolution, df = reading_part_proc(date_orig='DATETIME_ORIG')
-
-            # Truncating data (depending on what is specified in config file) and creating dataframe if no valid data:
-            df = remove_data(df)
-            row_count, flag_valid_total = creating_dummy(df, file_id, time_resolution)
-            df = trimmed_dataset(df, file_id, time_resolution, output_trimmed_df='Yes')
 
     # Collapsing results to summary level if specified in orchestra file
-    if Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_SUMMARY.lower() == 'yes':
+    if run_summary:
         Acc_Post_Processing_Orchestra.print_message("COLLAPSING DATA TO INDIVIDUAL SUMMARY FILES")
-        for file_id in file_list:
-            time_resolution, df = reading_part_proc(date_orig='DATETIME_ORIG')
-
-            # Truncating data (depending on what is specified in config file) and creating dataframe if no valid data:
-            df = remove_data(df)
-            row_count, flag_valid_total = creating_dummy(df, file_id, time_resolution)
-            df = trimmed_dataset(df, file_id, time_resolution, output_trimmed_df='Yes')
-
-            # Creating empty dataframe with headers, to fill in with data later
-            summary_headers_df = creating_headers(file_id, collapse_level='summary', file_path=summary_files_path, file_name=config.SUM_OVERALL_MEANS)
-
-            # Summarizing data and inputting into dataframe
-            formula = 60 / time_resolution   # Formula used when creating data for dataframe
-            summary_dict = input_data(df, time_resolution, collapse_level='summary')
-            summary_dict = input_pwear_segment(df, summary_dict, collapse_level='summary')
-
-            if config.PROCESSING.lower() == 'pampro':
-                summary_dict = input_hourly_daily(df, summary_dict)
-            summary_dict = input_output_variables(df, summary_dict, time_resolution, inclusion_criteria=config.SUM_MIN_HOUR_INCLUSION)
-
-            # Impute hours
-            if config.IMPUTE_DATA.lower() == 'yes':
-                summary_dict = impute_data(df, time_resolution, summary_dict, collapse_level='summary', inclusion_criteria=config.SUM_MIN_HOUR_INCLUSION)
-
-            # Outputting summary means dataset
-            summary_data = output_summary_means(summary_dict, summary_headers_df)
-
-        # Outputting data dictionary
-        data_dic(summary_headers_df, collapse_level='summary', file_path=summary_files_path, dictionary_name="Data_dictionary_summary_means.csv")
 
     # Collapsing results to daily level if specified in orchestra file
-    if Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_DAILY.lower() == 'yes':
+    daily_files_path = create_path(config.INDIVIDUAL_DAILY_F)
+    if run_daily:
         Acc_Post_Processing_Orchestra.print_message("COLLAPSING DATA TO INDIVIDUAL DAILY FILES")
 
-        # Creating folder paths to save collapsed results daily level in
-        daily_files_path = create_path(config.INDIVIDUAL_DAILY_F)
-
         # Creating folder if it doesn't already exist
         create_folders(daily_files_path)
 
-        accumulated_dataframes = {}
-
-        # Looping through each file in the filelist:
-        for file_id in file_list:
-            time_resolution, daily_df = reading_part_proc(date_orig='DATETIME_ORIG')
-
-            # Truncating data (depending on what is specified in config file) and creating dataframe if no valid data:
-            daily_df = remove_data(daily_df)
-            row_count, flag_valid_total = creating_dummy(daily_df, file_id, time_resolution)
-            daily_df = trimmed_dataset(daily_df, file_id, time_resolution, output_trimmed_df='Yes' if Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_SUMMARY.lower() == 'no' else 'No')
-
-            # Creating empty dataframe with headers, to fill in with data later
-            daily_headers_df = creating_headers(file_id, collapse_level='daily', file_path=daily_files_path, file_name=config.DAY_OVERALL_MEAN)
-
-            # Counting how many days in file to loop through each day:
-            DAY_MAX = daily_df['day_number'].max()
-            for day_number in range(1, DAY_MAX + 1):
-                day_df = daily_df[daily_df['day_number'] == day_number].copy()
-
-                # Creating daily summarized variables
-                if not day_df.empty:
-                    formula = 60 / time_resolution  # Formula used when creating data for dataframe
-                    daily_summary_dict = input_data(day_df, time_resolution, collapse_level='daily')
-                    daily_summary_dict = input_pwear_segment(day_df, daily_summary_dict, collapse_level='daily')
-                    daily_summary_dict = input_output_variables(day_df, daily_summary_dict, time_resolution, inclusion_criteria=config.DAY_MIN_HOUR_INCLUSION)
-
-                    # Impute hours
-                    if config.IMPUTE_DATA.lower() == 'yes':
-                        daily_summary_dict = impute_data(day_df, time_resolution, daily_summary_dict, collapse_level='daily', inclusion_criteria=config.DAY_MIN_HOUR_INCLUSION)
-
-                    # Appendinging daily means so only one file per id
-                    accumulated_dataframes = append_daily_means(daily_summary_dict, daily_headers_df, accumulated_dataframes)
-
-            # Outputting daily_means csv, one per id
-            if file_id in accumulated_dataframes and not accumulated_dataframes[file_id].empty:
-                os.makedirs(daily_files_path, exist_ok=True)
-                output_file = os.path.join(daily_files_path, f'{file_id}_{config.DAY_OVERALL_MEAN}.csv')
-                accumulated_dataframes[file_id].to_csv(output_file, index=False)
+    # Looping through each file in the filelist once, creating all the files needed from it
+    accumulated_dataframes = {}
+    summary_headers_df = None
+    daily_headers_df = None
+    # If COLLAPSE_BATCH_SIZE in config.py is more than 1 the files are collapsed in batches, solving the regressions of all files in a batch together
+    batch_size = max(int(config.COLLAPSE_BATCH_SIZE), 1)
+    for start in range(0, len(file_list), batch_size):
+        if batch_size == 1:
+            file_summary_headers_df, file_daily_headers_df = collapsing_file(file_list[start], partPro_path, summary_files_path, trimmed_path, daily_files_path, accumulated_dataframes,
+                                                                             run_summary, run_daily, part_proc_dfs, collapsed_dfs)
+        else:
+            file_summary_headers_df, file_daily_headers_df = collapsing_batch(file_list[start:start + batch_size], partPro_path, summary_files_path, trimmed_path, daily_files_path, accumulated_dataframes,
+                                                                              run_summary, run_daily, part_proc_dfs, collapsed_dfs)
+        summary_headers_df = file_summary_headers_df if file_summary_headers_df is not None else summary_headers_df
+        daily_headers_df = file_daily_headers_df if file_daily_headers_df is not None else daily_headers_df
 
-        # Outputting data dictionary
+    # Outputting data dictionaries
+    if summary_headers_df is not None:
+        data_dic(summary_headers_df, collapse_level='summary', file_path=summary_files_path, dictionary_name="Data_dictionary_summary_means.csv")
+    if daily_headers_df is not None:
         data_dic(daily_headers_df, collapse_level='daily', file_path=daily_files_path,
                  dictionary_name="Data_dictionary_daily_means.csv")
 
+    return collapsed_dfs
 
 
+if __name__ == '__main__':
+    main()
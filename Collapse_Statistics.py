@@ -0,0 +1,245 @@
+############################################################################################################
+# This file re-collapses the individual summary and daily files from the collapse statistics saved by Collapse_Results (OUTPUT_COLLAPSE_STATISTICS in config.py), without re-reading the part processed files.
+# The statistics are sums for each day, hour of day, day of week, mechanical noise flag and Pwear state, so the Pwear, ENMO/HPFVM and imputed (_IMP) variables can be re-calculated in seconds
+# after changing SUM_MIN_HOUR_INCLUSION, DAY_MIN_HOUR_INCLUSION, IMPUTE_DATA, IMPUTE_HOURS or MIN_DAY_HOURS. The other variables in the individual files are kept as they are.
+# Any other changes (e.g. new data, the wear log, TRUNCATE_DATA or REMOVE_MECH_NOISE, which also changes Pwear in the trimmed files) need Collapse_Results to be run again.
+# Date: 16/10/2026
+# Version: 1.0
+# Version: 1.1 - 17/10/2026: Stops if REMOVE_MECH_NOISE has changed since the statistics were saved, as the trimmed files are not re-written
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import numpy as np
+import pandas as pd
+import config
+import Intermediate_Files
+import Collapse_Results
+import Acc_Post_Processing_Orchestra
+
+
+# --- READING THE STATISTICS --- #
+def reading_statistics(file_id, statistics_path):
+    file_path = Intermediate_Files.path(statistics_path, f"{file_id}_{config.STATS_FILE_EXT}")
+    if not os.path.exists(file_path):
+        return None
+    return Intermediate_Files.read(file_path)
+
+def statistics_variables(statistics_df):
+    # Regression variables the statistics were saved for (same order as in Collapse_Results)
+    columns = [column[len('n__'):] for column in statistics_df.columns if column.startswith('n__')]
+    return Collapse_Results.wls_variables(pd.DataFrame(columns=columns))
+
+
+# REMOVE_MECH_NOISE also sets Pwear to 0 in the trimmed files, which are not re-written here. It has to be the same as when the statistics were saved, so the re-collapsed files agree with the trimmed and hourly files.
+def checking_settings(statistics_df, file_id):
+    if 'MECH_NOISE_REMOVED' in statistics_df.columns and (statistics_df['MECH_NOISE_REMOVED'] != int(config.REMOVE_MECH_NOISE.lower() == 'yes')).any():
+        raise RuntimeError(f"REMOVE_MECH_NOISE has changed since the collapse statistics of {file_id} were saved. Run Collapse_Results again (RUN_RECOLLAPSE_FROM_STATISTICS = 'No') so the trimmed files are updated too.")
+
+
+# --- REMOVING MECHANICAL NOISE AND IMPUTING SLEEP DATA ON THE STATISTICS --- #
+def adjusted_statistics(statistics_df, variables, impute):
+    """
+    Applying the current REMOVE_MECH_NOISE and imputation settings to the statistics, the same as remove_data() and impute_days() in Collapse_Results do to the epochs.
+    :param statistics_df: Statistics of one file.
+    :param variables: Regression variables in the statistics.
+    :param impute: If True the sleep hours are imputed.
+    :return: The statistics with the epochs flagged as mechanical noise counted as not worn (if REMOVE_MECH_NOISE is 'Yes') and the imputed epochs counted as worn.
+    """
+    statistics_df = statistics_df.copy()
+    state = statistics_df['pwear_state'].copy()
+    worn_columns = ['sum_pwear', 'sum_enmo_pwear'] + [f'{statistic}__{variable}' for variable in variables for statistic in ['w', 'wy', 'p']]
+
+    # Pwear set to 0 for epochs flagged as mechanical noise
+    if config.REMOVE_MECH_NOISE.lower() == 'yes':
+        noise = statistics_df['FLAG_MECH_NOISE'] == 1
+        statistics_df.loc[noise, worn_columns] = 0
+        statistics_df.loc[noise, 'n_pwear'] = statistics_df.loc[noise, 'rows']
+        state = state.mask(noise, Collapse_Results.PWEAR_STATES['zero'])
+
+    # Imputed epochs: ENMO_mean 0, ENMO_0plus 1 and Pwear 1 on days with more than MIN_DAY_HOURS fully worn epochs
+    if impute:
+        fully_worn_sum = statistics_df['rows'].where(state == Collapse_Results.PWEAR_STATES['full'], 0).groupby(statistics_df['day_number']).transform('sum')
+        imputed = (state == Collapse_Results.PWEAR_STATES['zero']) & statistics_df['hourofday'].isin(config.IMPUTE_HOURS) & (fully_worn_sum > config.MIN_DAY_HOURS)
+        rows = statistics_df.loc[imputed, 'rows']
+        weight = np.floor(statistics_df['TIME_RESOLUTION'].iloc[0])
+        statistics_df.loc[imputed, ['sum_pwear', 'n_pwear']] = np.column_stack([rows, rows])
+        statistics_df.loc[imputed, 'sum_enmo_pwear'] = 0
+        for variable in variables:
+            if variable == 'ENMO_mean':
+                count, total = rows, 0 * rows
+            elif variable == 'ENMO_0plus':
+                count, total = rows, rows
+            else:
+                count, total = statistics_df.loc[imputed, f'n__{variable}'], statistics_df.loc[imputed, f'y__{variable}']
+            statistics_df.loc[imputed, [f'n__{variable}', f'y__{variable}', f'w__{variable}', f'wy__{variable}', f'p__{variable}']] = \
+                np.column_stack([count, total, weight * count, weight * total, count])
+
+    return statistics_df
+
+
+# --- COLLAPSING THE STATISTICS --- #
+def adjusted_means(statistics_df, variables, inclusion_criteria, formula, by=None):
+    """
+    Solving the diurnal adjustment regressions from the summed statistics (the same regressions as diurnal_adjusted_means() in Collapse_Results solves on the epochs).
+    :param by: 'day_number' to calculate the means for each day. If None all days are used.
+    :return: constants and pwear_sums, as returned by diurnal_adjusted_means(). Regressions with a singular design are solved with the pseudo inverse (as statsmodels does).
+    """
+    if by is None:
+        codes, segments = np.zeros(len(statistics_df), dtype=int), [0]
+    else:
+        codes, segments = pd.factorize(statistics_df[by])
+    hourofday = statistics_df['hourofday'].to_numpy(dtype=float)
+    X = np.column_stack([np.ones(len(statistics_df)), np.sin(2 * np.pi * (hourofday / 24)), np.cos(2 * np.pi * (hourofday / 24))])
+
+    constants = {segment: {} for segment in segments}
+    pwear_sums = {segment: {} for segment in segments}
+    for variable in variables:
+        weights = statistics_df[f'w__{variable}'].to_numpy(dtype=float)
+        weighted_y = statistics_df[f'wy__{variable}'].to_numpy(dtype=float)
+        Pwear_sum = np.bincount(codes, weights=statistics_df[f'p__{variable}'].to_numpy(dtype=float), minlength=len(segments))
+        design = np.stack([np.bincount(codes, weights=weights * X[:, i] * X[:, j], minlength=len(segments)) for i in range(3) for j in range(3)], axis=1).reshape(-1, 3, 3)
+        right_hand = np.stack([np.bincount(codes, weights=weighted_y * X[:, i], minlength=len(segments)) for i in range(3)], axis=1)
+
+        for k, segment in enumerate(segments):
+            pwear_sums[segment][variable] = Pwear_sum[k]
+            if not Pwear_sum[k] / formula >= inclusion_criteria:
+                continue
+            if np.linalg.cond(design[k]) > Collapse_Results.WLS_MAX_CONDITION:
+                constants[segment][variable] = (np.linalg.pinv(design[k]) @ right_hand[k])[0]
+            else:
+                constants[segment][variable] = np.linalg.solve(design[k], right_hand[k])[0]
+
+    if by is None:
+        return constants[0], pwear_sums[0]
+    return constants, pwear_sums
+
+def collapsed_variables(statistics_df, mean_variables, intensity_variables, adjusted, formula, collapse_level, suffix=''):
+    """
+    Creating the variables of one file (or one day) from its statistics, the same as input_pwear_segment(), input_output_variables(), impute_data() and input_hourly_daily() in Collapse_Results.
+    :param adjusted: (constants, pwear_sums) for the file/day from adjusted_means().
+    :param suffix: '' for the variables before imputation, '_IMP' for the imputed variables.
+    :return: Dictionary of variables. Variables that do not meet the inclusion criteria are missing.
+    """
+    constants, pwear_sums = adjusted
+    dictionary = {}
+
+    # Pwear by quadrant and weekday/weekend (from the Pwear summed in each hour of day and day of week)
+    pwear_df = pd.DataFrame({'hourofday': statistics_df['hourofday'], 'Pwear': statistics_df['sum_pwear'],
+                             'wkday': ((statistics_df['dayofweek'] <= 5) & statistics_df['dayofweek'].notna()).astype(int),
+                             'wkend': ((statistics_df['dayofweek'] == 6) | (statistics_df['dayofweek'] == 7)).astype(int)})
+    pwear_by_segment = Collapse_Results.pwear_by_segment(pwear_df)
+    for quad in Collapse_Results.QUADRANTS:
+        dictionary[f'Pwear_{quad}{suffix}'] = pwear_by_segment[quad] / formula
+    if collapse_level == 'summary':
+        for day_type in Collapse_Results.DAY_TYPES:
+            dictionary[f'Pwear_{day_type}{suffix}'] = pwear_by_segment[day_type] / formula
+            for quad in Collapse_Results.QUADRANTS:
+                dictionary[f'Pwear_{quad}_{day_type}{suffix}'] = pwear_by_segment[(quad, day_type)] / formula
+
+    if suffix == '':
+        dictionary['RecordLength'] = statistics_df['n_pwear'].sum() * formula
+        dictionary['Pwear'] = pwear_sums[mean_variables[-1]]
+    else:
+        dictionary[f'Pwear{suffix}'] = statistics_df['sum_pwear'].sum() / formula
+
+    for variable in mean_variables + intensity_variables:
+        dictionary[f'{variable.lower()}{suffix}'] = constants.get(variable, np.nan)
+
+    # Hourly and daily variables (Pampro summary files only)
+    if config.PROCESSING.lower() == 'pampro' and collapse_level == 'summary':
+        values = {'rows': statistics_df['rows'], 'weighted_ENMO': statistics_df['sum_enmo_pwear'], 'Pwear': statistics_df['sum_pwear']}
+        if 'sum_hpfvm' in statistics_df.columns:
+            values.update({'HPFVM_mean': statistics_df['sum_hpfvm'], 'n_hpfvm': statistics_df['n_hpfvm']})
+        group_sums = {}
+        for name, group_variable, n_groups in [('hour', 'hourofday', 24), ('day', 'dayofweek', 7)]:
+            rows, sums, counts = Collapse_Results.sums_by_group(statistics_df, group_variable, n_groups, values)
+            group_sums[name] = (sums['rows'], sums, {'HPFVM_mean': sums.get('n_hpfvm')})
+        dictionary = Collapse_Results.hourly_daily_variables(group_sums, dictionary, suffix, hourly_zero_pwear=0 if suffix == '' else None)
+
+    return dictionary
+
+def recollapsed_variables(statistics_df, collapse_level):
+    """
+    Re-collapsing the statistics of one file with the current config.py settings.
+    :param collapse_level: 'summary' or 'daily'.
+    :return: Dictionary of variables (summary) or dictionary of variables for each day_number (daily).
+    """
+    time_resolution = statistics_df['TIME_RESOLUTION'].iloc[0]
+    formula = 60 / time_resolution
+    inclusion_criteria = config.SUM_MIN_HOUR_INCLUSION if collapse_level == 'summary' else config.DAY_MIN_HOUR_INCLUSION
+    by = None if collapse_level == 'summary' else 'day_number'
+    mean_variables, intensity_variables = statistics_variables(statistics_df)
+    variables = mean_variables + intensity_variables
+
+    versions = [('', adjusted_statistics(statistics_df, variables, impute=False))]
+    if config.IMPUTE_DATA.lower() == 'yes':
+        versions.append(('_IMP', adjusted_statistics(statistics_df, variables, impute=True)))
+
+    recollapsed = {}
+    for suffix, version_df in versions:
+        constants, pwear_sums = adjusted_means(version_df, variables, inclusion_criteria, formula, by=by)
+        if by is None:
+            recollapsed.update(collapsed_variables(version_df, mean_variables, intensity_variables, (constants, pwear_sums), formula, collapse_level, suffix))
+            continue
+        for day_number, day_df in version_df.groupby('day_number'):
+            recollapsed.setdefault(day_number, {}).update(collapsed_variables(day_df, mean_variables, intensity_variables, (constants[day_number], pwear_sums[day_number]), formula, collapse_level, suffix))
+    return recollapsed
+
+
+# --- UPDATING THE INDIVIDUAL FILES --- #
+def updating_file(file_path, recollapsed, collapse_level):
+    """
+    Replacing the re-collapsed variables in an individual summary/daily file. Only the variables already in the file are replaced.
+    :return: The updated dataframe (None if the file does not exist).
+    """
+    if not os.path.exists(file_path):
+        return None
+    df = Intermediate_Files.read(file_path, dtype={'id': str, 'subject_code': str})
+
+    if collapse_level == 'summary':
+        rows = {index: recollapsed for index in df.index}
+    else:
+        rows = {index: recollapsed.get(day_number, {}) for index, day_number in df['day_number'].items()}
+
+    for index, variables in rows.items():
+        columns = [column for column in variables if column in df.columns]
+        if columns:
+            df.loc[index, columns] = [variables[column] for column in columns]
+
+    Intermediate_Files.write(df, file_path)
+    return df
+
+
+def main():
+    """
+    Re-collapsing the individual summary and/or daily files of all files in the filelist that have collapse statistics.
+    :return: collapsed_dfs: Dictionary of the individual files updated (by file path), so they can be handed over to Appending_Files.
+    """
+    Acc_Post_Processing_Orchestra.print_message("RE-COLLAPSING DATA FROM THE COLLAPSE STATISTICS")
+    collapsed_dfs = {}
+    statistics_path = Collapse_Results.create_path(config.INDIVIDUAL_STATS_F)
+    summary_files_path = Collapse_Results.create_path(config.INDIVIDUAL_SUM_F)
+    daily_files_path = Collapse_Results.create_path(config.INDIVIDUAL_DAILY_F)
+
+    collapse_levels = []
+    if Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_SUMMARY.lower() == 'yes':
+        collapse_levels.append(('summary', summary_files_path, config.SUM_OVERALL_MEANS))
+    if Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_DAILY.lower() == 'yes':
+        collapse_levels.append(('daily', daily_files_path, config.DAY_OVERALL_MEAN))
+
+    for file_id in Collapse_Results.reading_filelist():
+        statistics_df = reading_statistics(file_id, statistics_path)
+        if statistics_df is None:
+            continue
+        checking_settings(statistics_df, file_id)
+        for collapse_level, file_path, file_name in collapse_levels:
+            output_file = Intermediate_Files.path(file_path, f"{file_id}_{file_name}")
+            df = updating_file(output_file, recollapsed_variables(statistics_df, collapse_level), collapse_level)
+            if df is not None:
+                collapsed_dfs[output_file] = df
+
+    return collapsed_dfs
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+############################################################################################################
+# This file describes compact data types for the Wave and Pampro columns, used when reading in files if COMPACT_DTYPES is 'Yes' in config.py.
+# By default pandas reads all decimals as float64 and all text as python strings repeated on every row. To reduce memory:
+#   - Proportions, means and sums (ENMO_*, HPFVM_*, PITCH_*, ROLL_*, ...) are stored as float32.
+#   - Pwear (and ENMO_0plus, which Pwear is made from) and the MORNING/MIDNIGHT regressors are kept as float64, as they are used for the regression weights (floor(time_resolution * Pwear)), the inclusion criteria and the mechanical noise flags.
+#   - Hour/day fields and flags are stored as small integers (or float32 if they have missing values).
+#   - Text that is repeated on every row (file_id, device info, timestamps from the metadata, ...) is stored as categories.
+# Date: 16/10/2026
+# Version: 1.0
+# Version: 1.1 - 17/10/2026: Pwear, ENMO_0plus and the MORNING/MIDNIGHT regressors are kept as float64
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import pandas as pd
+import numpy as np
+import config
+
+# --- SCHEMA --- #
+# Text columns with the same value repeated on many rows, stored as categories
+CATEGORY_COLUMNS = ['file_id', 'id', 'filename', 'subject_code', 'calibration_method', 'calibration_type', 'processing_script',
+                    'generic_first_timestamp', 'generic_last_timestamp', 'QC_axis_anomaly', 'start', 'end']
+
+# Hour/day fields and flags, stored as small integers. If there are missing values they are stored as float32 instead.
+SMALL_INT_COLUMNS = {'hourofday': 'int8', 'dayofweek': 'int8', 'minuteofhour': 'int8', 'day_number': 'int16', 'freeday_number': 'int16',
+                     'prestart': 'int8', 'postend': 'int8', 'day_valid': 'int8', 'flag_no_wear_info': 'int8', 'temp_flag_no_valid_days': 'int8',
+                     'wkend': 'int8', 'wkday': 'int8', 'INCLUDE': 'int8', 'noise_cutoff_mg': 'int16', 'processing_epoch': 'int16', 'frequency': 'int16'}
+SMALL_INT_PREFIXES = {'FLAG_': 'int8', 'flag_': 'int8', 'QC_anomaly_': 'int8', 'Anom_': 'int8'}
+
+# Proportions, means and sums, stored as float32
+FLOAT32_PREFIXES = ('ENMO_', 'HPFVM_', 'PITCH_', 'ROLL_', 'Battery_', 'Temperature_',
+                    'enmo_', 'hpfvm_', 'pitch_', 'roll_', 'QC_first_battery_pct', 'QC_last_battery_pct')
+# Columns starting with one of the float32 prefixes that are kept as float64: Pwear is made from ENMO_0plus, and float32 rounding would change the regression weights floor(time_resolution * Pwear)
+FLOAT64_COLUMNS = ['ENMO_0plus']
+
+# Number of rows read in at a time, so the float64 version of a large file is never held in memory all at once
+CHUNK_ROWS = 500000
+
+
+# --- APPLYING SCHEMA --- #
+def small_int_dtype(column):
+    if column in SMALL_INT_COLUMNS:
+        return SMALL_INT_COLUMNS[column]
+    for prefix, dtype in SMALL_INT_PREFIXES.items():
+        if column.startswith(prefix):
+            return dtype
+    return None
+
+# Changing numeric columns to float32/small integers
+def compact_numeric(df):
+    for column in df.columns:
+        dtype = small_int_dtype(column)
+        if dtype is not None and pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column]):
+            values = df[column]
+            if values.notna().all() and (values == np.round(values)).all() and values.abs().max() <= np.iinfo(dtype).max:
+                df[column] = values.astype(dtype)
+            else:
+                df[column] = values.astype('float32')
+        elif column.startswith(FLOAT32_PREFIXES) and column not in FLOAT64_COLUMNS and pd.api.types.is_float_dtype(df[column]):
+            df[column] = df[column].astype('float32')
+    return df
+
+# Changing repeated text columns to categories
+def compact_text(df):
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and (pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_string_dtype(df[column])):
+            df[column] = df[column].astype('category')
+    return df
+
+def compact_dtypes(df):
+    """
+    Changing the columns of a dataframe to the compact data types described above (only if COMPACT_DTYPES is 'Yes' in config.py).
+    :param df: Dataframe read in from a Wave/Pampro output file or one of the post processing files.
+    :return: The dataframe with compact data types.
+    """
+    if config.COMPACT_DTYPES.lower() != 'yes' or df is None:
+        return df
+    return compact_text(compact_numeric(df))
+
+def read_csv(file_path, **kwargs):
+    """
+    Reading in csv file with the compact data types (if COMPACT_DTYPES is 'Yes' in config.py). The file is read in chunks so the full float64 version is never held in memory.
+    :param file_path: File to read in.
+    :param kwargs: Any other arguments for pd.read_csv (e.g. dtype={'subject_code': str}).
+    :return: The dataframe.
+    """
+    if config.COMPACT_DTYPES.lower() != 'yes':
+        return pd.read_csv(file_path, **kwargs)
+
+    chunks = [compact_numeric(chunk) for chunk in pd.read_csv(file_path, chunksize=CHUNK_ROWS, **kwargs)]
+    if not chunks:
+        return pd.read_csv(file_path, **kwargs)
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+    return compact_text(df)
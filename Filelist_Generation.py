@@ -3,11 +3,15 @@
 # Author: CAS
 # Date: 31/05/2024 (Started)
 # Version: 1.0 Translated from Stata code
+# Version: 1.1 The results folder is listed with os.scandir (Results_Index.py) instead of writing a filelist with dir/ls
 ############################################################################################################
 # --- IMPORTING PACKAGES --- #
 import os
+import re
 import pandas as pd
 import config
+import Intermediate_Files
+import Results_Index
 from colorama import Fore
 
 # --- CREATING SPECIFIC FOLDERS WITHIN THE RESULTS FOLDER FOR HOUSING INDIVIDUAL FILES --- #
@@ -43,29 +47,18 @@ def create_folders():
 
 # --- CREATING A FILELIST OF ALL FILES IN THE RESULTS FOLDER --- #
 def create_filelist():
-
-    # Deleting all past filelists in results folder
-    if os.path.exists(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, "filelist.txt")):
-        os.remove(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, "filelist.txt"))
-
-    # Creating a new filelist in the results folder (The code is different for mac and windows, change pc type in the beginning of script)
-    os.chdir(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER))
-    if config.PC_TYPE.lower() == "windows":
-        os.system('dir /b *csv > filelist.txt')
-    elif config.PC_TYPE.lower() == "mac":
-        os.system('ls /b *csv > filelist.txt')
+    # Listing all csv files in the results folder (the index is also saved in the Filelists folder)
+    return Results_Index.results_index()
 
 
 # --- REMOVING FILES THAT ARE NEVER TO BE CONSOLIDATED --- #
-def remove_files():
-    # Reading in the filelist
-    filelist_df = pd.read_csv('filelist.txt', header=None, names=['v1'])
+def remove_files(results_index_df):
+    filelist_df = pd.DataFrame({'v1': results_index_df['filename']})
     filelist_df['file_type'] = filelist_df['v1']
 
     # Running the consolidation on only specific runs -  creating a temp_keep variable and replacing the value with true if the filename contains any of the specifies prefixes:
-    filelist_df['temp_keep'] = False
-    for prefix in config.SUB_SET_PREFIXES:
-        filelist_df['temp_keep'] = filelist_df['temp_keep'] | filelist_df['v1'].str.contains(prefix, regex=True)
+    sub_set_prefixes = re.compile('|'.join(f'(?:{prefix})' for prefix in config.SUB_SET_PREFIXES))
+    filelist_df['temp_keep'] = filelist_df['v1'].str.contains(sub_set_prefixes) if config.SUB_SET_PREFIXES else False
 
     # Only keeping rows where temp_keep is true
     filelist_df = filelist_df[filelist_df['temp_keep']]
@@ -80,12 +73,10 @@ def remove_files():
 
     # GENERATING A FILE ID TO MAKE SURE ALL FILES FOR ONE ID ARE GROUPED TOGETHER #
     # Creating a new variable called filename_temp and replacing it with the variable filename but without .csv
-    filelist_df['filename_temp'] = filelist_df['filename'].str.replace(".csv", "")
+    filelist_df['filename_temp'] = filelist_df['filename'].str.replace(r"\.csv$", "", case=False, regex=True)
 
-    # Extracting the file type from the filename_temp (The lambda function is used because the change is row specific, axis=1 indicates to apply the function to each row)
-    filelist_df['filename_temp'] = filelist_df.apply(
-        lambda row: row['filename_temp'].replace(f"{row['file_type']}_", ""), axis=1
-    )
+    # Removing the file type from the filename_temp
+    filelist_df['filename_temp'] = [filename_temp.replace(f"{file_type}_", "") for filename_temp, file_type in zip(filelist_df['filename_temp'], filelist_df['file_type'])]
 
     # Tagging duplicates to see which files have the metadata but no hour or minute dataset (Which have failed due to calibration) - These will be tagged as False
     filelist_df['duplicate'] = filelist_df['filename_temp'].duplicated(keep=False)
@@ -98,8 +89,7 @@ def remove_files():
     filelist_df = filelist_df.drop(columns=['duplicate'])
 
     if len(filelist_df) != 0:
-        os.chdir(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.FILELIST_FOLDER))
-        filelist_df.to_csv("No_Analysis_Files.txt", index=False, header=True, mode='w')
+        filelist_df.to_csv(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.FILELIST_FOLDER, "No_Analysis_Files.txt"), index=False, header=True, mode='w')
 
     # Restoring dataset and keep only files that have calibrated:
     filelist_df = original_df.copy()
@@ -112,11 +102,11 @@ def remove_files():
     # OPENING THE FINAL DATASET FROM LAST PROCESS TO KNOW WHAT HAS BEEN PROCESSED ALREADY
     if config.ONLY_NEW_FILES.lower() == "yes":
         try:
-            summary_file_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER, f'{config.PROJECT}_SUMMARY_MEANS.csv')
+            summary_file_path = Intermediate_Files.path(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER), f'{config.PROJECT}_SUMMARY_MEANS')
 
             # Opening the file if present and only keeping 1 ID per person
             if os.path.exists(summary_file_path):
-                last_process_df = pd.read_csv(summary_file_path)
+                last_process_df = Intermediate_Files.read(summary_file_path, columns=['id'])
                 last_process_df = last_process_df.filter(items=['id'])
                 last_process_df = last_process_df.drop_duplicates(subset=['id'], keep='first')
                 last_process_df = last_process_df.rename(columns={'id': 'filename_temp'})
@@ -141,7 +131,11 @@ def remove_files():
     filelist_df.to_csv(output_file, sep='\t', index=False)
 
 
-if __name__ == '__main__':
+def main():
     create_folders()
-    create_filelist()
-    remove_files()
+    results_index_df = create_filelist()
+    remove_files(results_index_df)
+
+
+if __name__ == '__main__':
+    main()
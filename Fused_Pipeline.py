@@ -0,0 +1,86 @@
+############################################################################################################
+# This file runs the generic exhaustive post processing and collapses the results file by file in one pass.
+# Each file is taken through merging -> indicator variable -> pwear -> wear log -> mechanical noise (GENERIC_exh_postprocessing)
+# and then straight on to the trimmed, summary and daily files (Collapse_Results) without writing and re-reading the part processed csv file.
+# The part processed csv file is only written if OUTPUT_PART_PROC_FILES is set to 'Yes' in config.py.
+# Date: 16/10/2026
+# Version: 1.0
+# Version: 1.1 Files that fail (or have no metadata or data file) are reported and stop the run, the same as in GENERIC_exh_postprocessing
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import traceback
+import config
+import Intermediate_Files
+import Acc_Post_Processing_Orchestra
+import GENERIC_exh_postprocessing
+import Metadata_Catalogue
+import Collapse_Results
+
+
+def main(hand_over_dataframes=False):
+    """
+    Running GENERIC_exh_postprocessing and Collapse_Results file by file.
+    :param hand_over_dataframes: If True the individual summary and daily dataframes are kept and returned so they can be handed over to Appending_Files when the orchestra is run in-process.
+    :return: collapsed_dfs: Dictionary of the individual summary and daily files outputted (by file path) if hand_over_dataframes is True, otherwise None.
+    """
+    collapsed_dfs = {} if hand_over_dataframes else None
+
+    # Creating folder paths used for this script
+    trimmed_path = Collapse_Results.create_path(config.INDIVIDUAL_TRIMMED_F)
+    summary_files_path = Collapse_Results.create_path(config.INDIVIDUAL_SUM_F)
+    partPro_path = Collapse_Results.create_path(config.INDIVIDUAL_PARTPRO_F)
+    daily_files_path = Collapse_Results.create_path(config.INDIVIDUAL_DAILY_F)
+    for folder_path in [trimmed_path, summary_files_path, daily_files_path]:
+        Collapse_Results.create_folders(folder_path)
+
+    files_list = GENERIC_exh_postprocessing.reading_filelist()
+    anomalies_df = GENERIC_exh_postprocessing.anomalies() if config.PROCESSING.lower() == 'pampro' else None
+    metadata_catalogue = Metadata_Catalogue.catalogue()
+
+    run_summary = Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_SUMMARY.lower() == 'yes'
+    run_daily = Acc_Post_Processing_Orchestra.RUN_COLLAPSE_RESULTS_TO_DAILY.lower() == 'yes'
+
+    accumulated_dataframes = {}
+    results = []
+    summary_headers_df = None
+    daily_headers_df = None
+
+    for file_id in files_list:
+        # Any errors are caught so the other files can carry on processing (the same as process_file_worker in GENERIC_exh_postprocessing)
+        result = {'file_id': file_id, 'worker': os.getpid(), 'error': None}
+        results.append(result)
+        try:
+            df = GENERIC_exh_postprocessing.process_file(file_id, anomalies_df, print_housekeeping_message=(file_id == files_list[0]), metadata_catalogue=metadata_catalogue)
+            if df is None:
+                result['error'] = "Metadata or data file not found"
+                continue
+
+            # Outputting the part processed file (only kept as a record of the processing)
+            if config.OUTPUT_PART_PROC_FILES.lower() == 'yes':
+                os.makedirs(partPro_path, exist_ok=True)
+                Intermediate_Files.write(df, Intermediate_Files.path(partPro_path, f"{file_id}_{config.OUTPUT_FILE_EXT}"))
+
+            part_proc_dfs = {file_id: df}
+            file_summary_headers_df, file_daily_headers_df = Collapse_Results.collapsing_file(file_id, partPro_path, summary_files_path, trimmed_path, daily_files_path, accumulated_dataframes,
+                                                                                              run_summary, run_daily, part_proc_dfs, collapsed_dfs)
+        except Exception:
+            result['error'] = traceback.format_exc()
+            continue
+        summary_headers_df = file_summary_headers_df if file_summary_headers_df is not None else summary_headers_df
+        daily_headers_df = file_daily_headers_df if file_daily_headers_df is not None else daily_headers_df
+
+    # Outputting data dictionaries
+    if summary_headers_df is not None:
+        Collapse_Results.data_dic(summary_headers_df, collapse_level='summary', file_path=summary_files_path, dictionary_name="Data_dictionary_summary_means.csv")
+    if daily_headers_df is not None:
+        Collapse_Results.data_dic(daily_headers_df, collapse_level='daily', file_path=daily_files_path, dictionary_name="Data_dictionary_daily_means.csv")
+
+    # Reporting the failed files the same way as GENERIC_exh_postprocessing
+    GENERIC_exh_postprocessing.reporting_failures(results)
+
+    return collapsed_dfs
+
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,30 @@
 # Date: 15/11/2024
 # Version: 1.1. Added sections to be able to run on Pampro output
 # Version: 1.0 Translated from Stata code
+# Version: 1.2 Files can be processed in parallel (GENERIC_WORKERS in config.py)
+# Version: 1.3 Files are read, processed and outputted one at a time, so memory use does not grow with the number of files
+# Version: 1.4 Clock changes are looked up once per timezone/year and applied to all timestamps at once. Clocks going back now happens at 2am (summer time).
+# Version: 1.5 Timestamps are calculated from the first timestamp and epoch length rather than parsing every timestamp
+# Version: 1.6 Data files can be read in with compact data types (COMPACT_DTYPES in config.py)
+# Version: 1.7 Part processed files can be written as parquet/feather files (INTERMEDIATE_FORMAT in config.py)
+# Version: 1.8 Wear log is read once and looked up by id. Participants can have more than one wear window in the wear log.
+# Version: 1.9 Corruption conditions are read once and looked up by file_id. Corrupted ranges can be given with start/end.
+# Version: 2.0 Metadata is looked up in the metadata catalogue (Metadata_Catalogue.py) instead of reading each metadata file
+# Version: 2.1 Files that fail (or have no metadata/data file) are reported and stop the run the same way when processed one at a time or in parallel
 ############################################################################################################
 # Importing packages
 import numpy as np
 import config
+import Dtype_Schema
+import Intermediate_Files
+import Metadata_Catalogue
 import os
+import traceback
 import pandas as pd
 import pytz
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from colorama import Fore
 
 # READING IN FILELIST
@@ -23,15 +39,16 @@ def reading_filelist():
 
     return files_list
 
-# READING METADATA
-def reading_metadata(files_list):
+# READING METADATA (from the metadata catalogue. If no catalogue is given the catalogue is updated and loaded)
+def reading_metadata(files_list, metadata_catalogue=None):
     metadata_dfs = []
+    if metadata_catalogue is None:
+        metadata_catalogue = Metadata_Catalogue.catalogue()
 
     for file_id in files_list:
-        metadata_file_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, f"metadata_{file_id}.csv")
+        metadata_df = Metadata_Catalogue.lookup(metadata_catalogue, 'metadata', file_id)
 
-        if os.path.exists(metadata_file_path):
-            metadata_df = pd.read_csv(metadata_file_path)
+        if metadata_df is not None:
             metadata_df['file_id'] = file_id
 
             columns_to_keep = ['file_id', 'subject_code', 'device', 'calibration_method', 'noise_cutoff_mg', 'processing_epoch', 'generic_first_timestamp', 'generic_last_timestamp', 'QC_first_battery_pct', 'QC_last_battery_pct', 'frequency']
@@ -59,7 +76,7 @@ def reading_datafile(files_list):
         datafile_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, f"{config.count_prefixes}_{file_id}.csv")
 
         if os.path.exists(datafile_path):
-            datafile_df = pd.read_csv(datafile_path)
+            datafile_df = Dtype_Schema.read_csv(datafile_path)
             datafile_df['file_id'] = file_id
             datafile_df.rename(columns={'id': 'database_id'}, inplace=True)
             datafile_df.columns = [col[:-6] + "plus" if col.endswith("_99999") else col for col in datafile_df.columns]
@@ -81,6 +98,72 @@ def anomalies():
     else:
         return pd.DataFrame()
 
+# LOOKING UP CLOCK CHANGES
+# Offset from UTC (in nanoseconds) in the timezone for UTC timestamps
+def utc_offsets(utc_times, timezone):
+    return (utc_times.tz_convert(timezone).tz_localize(None) - utc_times.tz_localize(None)).asi8
+
+@lru_cache(maxsize=None)
+def clock_changes(timezone, year):
+    """
+    Finding the clock changes within a year (to the minute). This is only looked up once per timezone and year.
+    :param timezone: Name of the timezone, e.g. 'Europe/London'.
+    :param year: The year to look up.
+    :return: start_offset. Offset from UTC (ns) at the start of the year.
+    :return: change_times. UTC times (datetime64[ns]) the clocks change at.
+    :return: change_offsets. Offset from UTC (ns) after each clock change.
+    """
+    tz = pytz.timezone(timezone)
+    hours = pd.date_range(f'{year}-01-01', f'{year + 1}-01-01', freq='h', tz='UTC')
+    hour_offsets = utc_offsets(hours, tz)
+    change_times = []
+    change_offsets = []
+    for change in np.flatnonzero(hour_offsets[1:] != hour_offsets[:-1]):
+        minutes = pd.date_range(hours[change], periods=61, freq='min')
+        minute_offsets = utc_offsets(minutes, tz)
+        first_changed = np.flatnonzero(minute_offsets != minute_offsets[0])[0]
+        change_times.append(minutes[first_changed].tz_localize(None).to_datetime64())
+        change_offsets.append(minute_offsets[first_changed])
+
+    return hour_offsets[0], np.array(change_times, dtype='datetime64[ns]'), np.array(change_offsets, dtype=np.int64)
+
+# Offset from UTC (ns) for each UTC timestamp, using the clock changes for the years covered
+def utc_offset_at(utc_times, timezone):
+    utc_times = np.asarray(utc_times, dtype='datetime64[ns]')
+    years = range(pd.Timestamp(utc_times.min()).year, pd.Timestamp(utc_times.max()).year + 1)
+    start_offset = clock_changes(timezone, years[0])[0]
+    change_times = np.concatenate([clock_changes(timezone, year)[1] for year in years])
+    offsets = np.concatenate([[start_offset]] + [clock_changes(timezone, year)[2] for year in years])
+    return offsets[np.searchsorted(change_times, utc_times, side='right')]
+
+# The monitor time is the local time when the monitor was set up and the monitor does not change with the clocks.
+# The monitor time is converted to UTC using the offset at the first timestamp, and the adjustment is the change in offset since the first timestamp.
+def clock_change_adjustment(monitor_times, timezone):
+    monitor_times = np.asarray(monitor_times, dtype='datetime64[ns]')
+    first_time = monitor_times[:1]
+    start_offset = utc_offset_at(first_time, timezone)
+    start_offset = utc_offset_at(first_time - start_offset.astype('timedelta64[ns]'), timezone)[0]
+    utc_times = monitor_times - np.timedelta64(start_offset, 'ns')
+    return utc_offset_at(utc_times, timezone) - start_offset
+
+
+# CREATING DATETIME FROM THE TIMESTAMP STRINGS
+# The epochs are regular, so only the first two timestamps are parsed and the rest are calculated from the epoch length.
+# The calculated timestamps are checked against a sample of the timestamp strings (including the last one). If they don't match, e.g. if there is a gap in the data, all timestamps are parsed.
+def regular_timestamps(timestamps, format='%d/%m/%Y %H:%M:%S', sample_size=100):
+    rows = len(timestamps)
+    if rows > 2:
+        first_timestamps = pd.to_datetime(timestamps.iloc[:2], format=format)
+        epoch = first_timestamps.iloc[1] - first_timestamps.iloc[0]
+        if epoch > pd.Timedelta(0):
+            calculated = pd.Series(first_timestamps.iloc[0] + pd.to_timedelta(np.arange(rows) * epoch.value, unit='ns'), index=timestamps.index)
+            sample = np.unique(np.linspace(0, rows - 1, min(rows, sample_size)).astype(int))
+            if (calculated.iloc[sample].dt.strftime(format).values == timestamps.iloc[sample].values).all():
+                return calculated
+
+    return pd.to_datetime(timestamps, format=format)
+
+
 # MERGING METADATA FILE AND DATA FILE, THEN MERGING ON ANOMALIES FILE AND FORMATTING MERGED DATAFRAME
 def merging_data(files_list, metadata_dfs, datafiles_dfs, anomalies_df):
     merged_dfs = []
@@ -104,7 +187,7 @@ def merging_data(files_list, metadata_dfs, datafiles_dfs, anomalies_df):
         merged_df['timestamp'] = merged_df['timestamp'].str.replace(':000000', '')
 
         # Create DATETIME variable. This is the monitor time. Not adjusted for BST
-        merged_df['DATETIME_ORIG'] = pd.to_datetime(merged_df['timestamp'], format='%d/%m/%Y %H:%M:%S')
+        merged_df['DATETIME_ORIG'] = regular_timestamps(merged_df['timestamp'])
 
         # Changing order of columns and sorting the data
         columns = merged_df.columns.tolist()
@@ -129,51 +212,26 @@ def merging_data(files_list, metadata_dfs, datafiles_dfs, anomalies_df):
         merged_df['DATETIME'] = merged_df['DATETIME_ORIG']
 
         if config.CLOCK_CHANGES.lower() == 'yes':
-            merged_df['DATETIME_COPY'] = merged_df['DATETIME']
-
-            #Retrieving timezone information and converting datetime_copy variable to specified timezone
-            tz = pytz.timezone(config.TIMEZONE)
-            merged_df['DATETIME_COPY'] = merged_df['DATETIME_ORIG'].dt.tz_localize('UTC').dt.tz_convert(tz)
-            merged_df['BST'] = merged_df['DATETIME_COPY'].apply(lambda x: x.dst() != timedelta(0))
-
-            # Creating bst variables, to check if there is a change through the data from from summer time to winter time or other way
-            prev_bst = None
-
-            bst_values = merged_df['BST'].unique()
-
-            if len(bst_values) == 2 and True in bst_values and False in bst_values:
-                adjustment = 0
-                for idx in range(len(merged_df)):
-                    curr_bst = merged_df.at[idx, 'BST']
-
-                    # If dataset goes over clock change, adding or subtracting 1 hour from DATETIME variable
-                    if prev_bst is not None and prev_bst != curr_bst:
-                        if not prev_bst and curr_bst:
-
-                            adjustment += 1
-                            print(f"Transition from winter to summer time detected at 1am for the file id: {file_id}")
-
-                        elif prev_bst and not curr_bst:
-
-                             adjustment -= 1
-                             print(f"Transition from summer to winter time detected at 1am for the file id: {file_id}")
-                    # OBS! IT IS CHANGING THE CLOCK AT 1AM BOTH TIMES, FIND A WAY TO MAKE IT CHANGE AT 2AM FROM SUMMER TO WINTER TIME.
-                    merged_df.at[idx, 'DATETIME'] += timedelta(hours=adjustment)
-                    prev_bst = curr_bst
+            adjustment = clock_change_adjustment(merged_df['DATETIME_ORIG'], config.TIMEZONE)
+
+            # If dataset goes over clock change, adding or subtracting the change (normally 1 hour) from DATETIME variable
+            if adjustment.any():
+                for change in np.flatnonzero(np.diff(adjustment)):
+                    if adjustment[change + 1] > adjustment[change]:
+                        print(f"Transition from winter to summer time detected at {merged_df['DATETIME_ORIG'].iloc[change + 1]} (monitor time) for the file id: {file_id}")
+                    else:
+                        print(f"Transition from summer to winter time detected at {merged_df['DATETIME_ORIG'].iloc[change + 1]} (monitor time) for the file id: {file_id}")
+                merged_df['DATETIME'] = merged_df['DATETIME_ORIG'] + pd.to_timedelta(adjustment, unit='ns')
                 print("Date and time variables have been adjusted for clock changes.")
-                merged_df.drop(columns=['DATETIME_COPY', 'BST'], inplace=True)
 
-            else:
-                merged_df.drop(columns=['DATETIME_COPY', 'BST'], inplace=True)
-                pass
-
-        # Calculating DATE and TIME variables with new time
-        merged_df['DATE'] = pd.to_datetime(merged_df['DATETIME']).dt.date
-        merged_df['TIME'] = pd.to_datetime(merged_df['DATETIME']).dt.time
-        merged_df['hourofday'] = pd.to_datetime(merged_df['DATETIME']).dt.hour + 1
-        merged_df['dayofweek'] = merged_df['DATETIME'].apply(lambda x: x.isoweekday())
+        # Calculating DATE and TIME variables with new time. Hour, minute and day of week (1=Monday, 1970-01-01 was a Thursday) are calculated from the minutes/days since 1970
+        merged_df['DATE'] = merged_df['DATETIME'].dt.date
+        merged_df['TIME'] = merged_df['DATETIME'].dt.time
+        minutes = merged_df['DATETIME'].values.astype('datetime64[m]').astype(np.int64)
+        merged_df['hourofday'] = (minutes // 60) % 24 + 1
+        merged_df['dayofweek'] = (minutes // 1440 + 3) % 7 + 1
         if config.count_prefixes.lower() == '1m':
-            merged_df['minuteofhour'] = pd.to_datetime(merged_df['DATETIME']).dt.minute + 1
+            merged_df['minuteofhour'] = minutes % 60 + 1
 
         # Changing order of columns
         columns = merged_df.columns.tolist()
@@ -203,7 +261,7 @@ def indicator_variable(time_resolutions, merged_dfs):
 
         # Generating temporary tag to check if any valid hours. If there are any valid hours, it is dropping rows that are not valid. If no valid hours, keep all rows but flag temp_flag_no_valid_days
         merged_df['valid'] = ~(merged_df['prestart'] == 1) & ~(merged_df['postend'] == 1)
-        merged_df['temp_flag_no_valid_days'] = 1 if not merged_df['valid'].any() else None
+        merged_df['temp_flag_no_valid_days'] = 1 if not merged_df['valid'].any() else np.nan
         if merged_df['valid'].any():
             merged_df = merged_df.loc[merged_df['valid']]
 
@@ -267,6 +325,54 @@ def pwear_variables(valid_dfs, time_resolutions):
         formatted_dfs.append(valid_df)
     return formatted_dfs
 
+# READING IN THE WEAR LOG (only read once and reused for all files)
+@lru_cache(maxsize=1)
+def reading_wear_log(wear_log_path, modified_time):
+    """
+    Reading in the wear log and indexing it by id. A participant can have more than one wear window (one row per window in the wear log).
+    :param wear_log_path: Path to the wear log.
+    :param modified_time: Time the wear log was last modified, so it is read in again if it has been changed.
+    :return: wear_info_df. One row per id with the first start, the last end and the highest value of the other variables (e.g. flags) across the wear windows.
+    :return: wear_windows. Dictionary with the start and end times of the wear windows for each id (see time_windows).
+    """
+    wear_df = pd.read_csv(wear_log_path, dtype={'id': str})
+    variables = ['start', 'end']
+    for var in variables:
+        wear_df[var] = pd.to_datetime(wear_df[var], format='%d/%m/%Y %H:%M')
+
+    aggregations = {}
+    for var in wear_df.columns.drop('id'):
+        if var == 'start':
+            aggregations[var] = 'min'
+        elif var == 'end' or pd.api.types.is_numeric_dtype(wear_df[var]):
+            aggregations[var] = 'max'
+        else:
+            aggregations[var] = 'first'
+    wear_info_df = wear_df.groupby('id', sort=False).agg(aggregations).reset_index()
+
+    wear_windows = time_windows(wear_df, 'id')
+
+    return wear_info_df, wear_windows
+
+# Creating the start and end times (as nanoseconds) of the time windows for each id, sorted by start time. The end times are the latest end time of this and all earlier windows, so overlapping windows are handled.
+def time_windows(windows_df, id_variable):
+    windows = {}
+    windows_df = windows_df.dropna(subset=['start', 'end']).sort_values(by=[id_variable, 'start'])
+    for id, id_windows_df in windows_df.groupby(id_variable, sort=False):
+        starts = id_windows_df['start'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        ends = np.maximum.accumulate(id_windows_df['end'].to_numpy(dtype='datetime64[ns]').astype(np.int64))
+        windows[id] = (starts, ends)
+    return windows
+
+# Finding the timestamps that are within one of the time windows (start <= timestamp < end)
+def in_time_windows(datetimes, windows):
+    if windows is None:
+        return np.zeros(len(datetimes), dtype=bool)
+    starts, ends = windows
+    times = datetimes.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    window = np.searchsorted(starts, times, side='right') - 1     # Last window starting at or before each timestamp
+    return (window >= 0) & (times < ends[np.maximum(window, 0)])
+
 # Using start/end times from wear log if this was used
 def wear_log(formatted_dfs):
 
@@ -274,25 +380,21 @@ def wear_log(formatted_dfs):
     wear_log_path = os.path.join(config.ROOT_FOLDER, config.WEAR_LOG_FOLDER, f"{config.WEAR_LOG}.csv")
 
     if os.path.exists(wear_log_path):
-        wear_df = pd.read_csv(wear_log_path)
-        variables = ['start', 'end']
-        for var in variables:
-            wear_df[var] = pd.to_datetime(wear_df[var], format='%d/%m/%Y %H:%M')
+        wear_info_df, wear_windows = reading_wear_log(wear_log_path, os.path.getmtime(wear_log_path))
 
         # Merging wear log with each file, merging on id
         for i, formatted_df in enumerate(formatted_dfs):
             id_series = formatted_df['file_id'].str.split('_', n=1).str[0]
             formatted_df = pd.concat([formatted_df, pd.DataFrame({'id': id_series})], axis=1)
-            formatted_df = pd.merge(formatted_df, wear_df, how='outer', on='id', indicator=True)
-            formatted_df = formatted_df[formatted_df['_merge'] != 'right_only']
+            formatted_df = pd.merge(formatted_df, wear_info_df, how='left', on='id', indicator=True)
             formatted_df['day_valid'] = 0
             formatted_df['flag_no_wear_info'] = 0
             if formatted_df['_merge'].iloc[0] == 'both':
-                formatted_df['day_valid'] = formatted_df.apply(lambda x: 1 if x['start'] <= x['DATETIME'] < x['end'] else 0, axis=1)
+                formatted_df['day_valid'] = in_time_windows(formatted_df['DATETIME'], wear_windows.get(formatted_df['id'].iloc[0])).astype(int)
 
             if formatted_df['_merge'].iloc[0] == 'left_only':
                 formatted_df['flag_no_wear_info'] = 1
-            formatted_df['day_valid'] = formatted_df.apply(lambda x: 2 if x['flag_no_wear_info'] == 1 else x['day_valid'], axis=1)
+                formatted_df['day_valid'] = 2
             formatted_df = formatted_df.drop(columns=['id', '_merge'])
             formatted_dfs[i] = formatted_df
 
@@ -301,11 +403,51 @@ def wear_log(formatted_dfs):
         print(f"There is no wear log saved in this folder location: {wear_log_path}. If you have a wear log that you wish to use make sure to save it in the folder. If no wear log the script can continue running without this.")
 
 
+# READING IN THE CORRUPTION CONDITIONS (only read once and reused for all files)
+# Variables identifying a corrupted epoch
+def corruption_epoch_variables():
+    if config.count_prefixes.lower() == '1m':
+        return ['DATE', 'minuteofhour', 'hourofday', 'dayofweek']
+    return ['DATE', 'hourofday', 'dayofweek']
+
+@lru_cache(maxsize=1)
+def reading_corruption_conditions(conditions_path, modified_time):
+    """
+    Reading in the corruption conditions csv file and indexing it by file_id. Each row is either one corrupted epoch (DATE, hourofday, dayofweek and also minuteofhour for minute level data)
+    or a corrupted range (start and end in the format dd/mm/YYYY HH:MM, corrupted if start <= DATETIME < end), so a corrupted week can be given in one row.
+    :param conditions_path: Path to the corruption conditions csv file.
+    :param modified_time: Time the file was last modified, so it is read in again if it has been changed.
+    :return: corrupted_epochs. Dictionary with the corrupted epochs (MultiIndex) for each file_id.
+    :return: corrupted_windows. Dictionary with the start and end times of the corrupted ranges for each file_id (see time_windows).
+    """
+    conditions_df = pd.read_csv(conditions_path, dtype={'file_id': str})
+    # Files with only corrupted epochs or only corrupted ranges have the other columns missing
+    for var in corruption_epoch_variables() + ['start', 'end']:
+        if var not in conditions_df.columns:
+            conditions_df[var] = np.nan
+
+    try:
+        conditions_df['DATE'] = pd.to_datetime(conditions_df['DATE'], format='%d/%m/%Y', errors='raise')
+        for var in ['start', 'end']:
+            conditions_df[var] = pd.to_datetime(conditions_df[var], format='%d/%m/%Y %H:%M', errors='raise')
+    except ValueError as e:
+        print(Fore.RED + "\nError: Ensure that all dates in the DATE column in the corruptions condition csv are in the format dd/mm/YYYY (e.g., 01/01/1990) and start/end are in the format dd/mm/YYYY HH:MM (e.g., 01/01/1990 13:00). Re-run scripts once this has been corrected." + Fore.RESET)
+        return {}, {}
+
+    epoch_variables = corruption_epoch_variables()
+    epochs_df = conditions_df.dropna(subset=epoch_variables)
+    epochs_df = epochs_df.astype({var: 'int64' for var in epoch_variables if var != 'DATE'})
+    corrupted_epochs = {file_id: pd.MultiIndex.from_frame(file_epochs_df[epoch_variables]) for file_id, file_epochs_df in epochs_df.groupby('file_id')}
+    corrupted_windows = time_windows(conditions_df, 'file_id')
+
+    return corrupted_epochs, corrupted_windows
+
+
 # CREATING FLAG FOR MECHANICAL NOISE THAT IS BEING COUNTED AS WEAR TIME AND RUNNING CORRUPTIONS HOUSEKEEPING
-def mechanical_noise(formatted_dfs):
+def mechanical_noise(formatted_dfs, print_housekeeping_message=True):
 
     # Printing out message that corruptions housekeeping is run (It is run a bit later in this function, but put it here so that it only prints out the message once and not fo each file)
-    if config.RUN_CORRUPTIONS_HOUSEKEEPING.lower() == 'yes':
+    if config.RUN_CORRUPTIONS_HOUSEKEEPING.lower() == 'yes' and print_housekeeping_message:
         print(Fore.GREEN + "RUNNING CORRUPTIONS HOUSEKEEPING TO ADJUST PWEAR BASED ON VERIFICATION CHECKS AND SPECIFICATIONS IN CORRUPTIONS CONDITIONS CSV" + Fore.RESET)
 
     dataframes = []
@@ -325,34 +467,18 @@ def mechanical_noise(formatted_dfs):
         if config.RUN_CORRUPTIONS_HOUSEKEEPING.lower() == 'yes':
             # Reading in corruption condition csv file where rows that are corrupted are specified manually
             if os.path.exists(config.CORRUPTION_CONDITION_FILE_PATH):
-                conditions_df = pd.read_csv(config.CORRUPTION_CONDITION_FILE_PATH)
-
-                try:
-                    conditions_df['DATE'] = pd.to_datetime(conditions_df['DATE'], format='%d/%m/%Y', errors='raise')
-                    formatted_df['DATE'] = pd.to_datetime(formatted_df['DATE'], format='%Y-%m-%d', errors='coerce')
-                except ValueError as e:
-                    print(Fore.RED + "\nError: Ensure that all dates in the DATE column in the corruptions condition csv are in the format dd/mm/YYYY (e.g., 01/01/1990). Re-run scripts once this has been corrected." + Fore.RESET)
-
-                # Specifying rows to filter conditions on
-                for _, row in conditions_df.iterrows():
-                    if config.count_prefixes.lower() == '1h':
-                        conditions = (
-                            (formatted_df['DATE'] == row['DATE']) &
-                            (formatted_df['hourofday'] == row['hourofday']) &
-                            (formatted_df['dayofweek'] == row['dayofweek']) &
-                            (formatted_df['file_id'] == row['file_id'])
-                        )
-                    if config.count_prefixes.lower() == '1m':
-                        conditions = (
-                        (formatted_df['DATE'] == row['DATE']) &
-                        (formatted_df['minuteofhour'] == row['minuteofhour']) &
-                        (formatted_df['hourofday'] == row['hourofday']) &
-                        (formatted_df['dayofweek'] == row['dayofweek']) &
-                        (formatted_df['file_id'] == row['file_id'])
-                        )
-
-                    # Changing Pwear to 0 where conditions are met
-                    formatted_df.loc[conditions, 'Pwear'] = 0
+                corrupted_epochs, corrupted_windows = reading_corruption_conditions(config.CORRUPTION_CONDITION_FILE_PATH, os.path.getmtime(config.CORRUPTION_CONDITION_FILE_PATH))
+                file_id = formatted_df['file_id'].iloc[0]
+
+                # Specifying rows to filter conditions on: Epochs within a corrupted range or matching a corrupted epoch
+                conditions = in_time_windows(formatted_df['DATETIME'], corrupted_windows.get(file_id))
+                if file_id in corrupted_epochs:
+                    epoch_variables = corruption_epoch_variables()
+                    epochs_df = formatted_df[epoch_variables].assign(DATE=pd.to_datetime(formatted_df['DATE'].astype(str), format='%Y-%m-%d', errors='coerce'))
+                    conditions |= pd.MultiIndex.from_frame(epochs_df).isin(corrupted_epochs[file_id])
+
+                # Changing Pwear to 0 where conditions are met
+                formatted_df.loc[conditions, 'Pwear'] = 0
             else:
                 print(f"No corruption condition csv file was found in the specified location: {config.CORRUPTION_CONDITION_FILE_PATH}. Make sure to save the file and edit the CORRUPTION_CONDITION_FILE_PATH in the config.py file.")
         dataframes.append(formatted_df)
@@ -360,35 +486,139 @@ def mechanical_noise(formatted_dfs):
     return dataframes
 
 
-# OUTPUTTING THE DATAFRAME TO THE INDIVIDUAL_PARTPRO_FILES FOLDER
-def outputting_dataframe(dataframes, files_list):
-
-    for dataframe, file_list in zip(dataframes, files_list):
-        dataframe.sort_values(by=['file_id', 'DATETIME'], inplace=True)
+# SORTING AND ROUNDING THE PART PROCESSED DATAFRAME (AS IT IS OUTPUTTED)
+def formatting_part_proc(dataframe):
+    dataframe.sort_values(by=['file_id', 'DATETIME'], inplace=True)
 
-        # Rounding all numeric columns to 4 decimal places
+    # Rounding all numeric columns to 6 decimal places (only if outputting csv files)
+    if Intermediate_Files.round_part_proc():
         numeric_columns = dataframe.select_dtypes(include=['float64', 'float32']).columns
         dataframe[numeric_columns] = dataframe[numeric_columns].round(6)
 
+# OUTPUTTING THE DATAFRAME TO THE INDIVIDUAL_PARTPRO_FILES FOLDER
+def outputting_dataframe(dataframes, files_list):
+
+    for dataframe, file_list in zip(dataframes, files_list):
+        formatting_part_proc(dataframe)
 
         file_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER, config.INDIVIDUAL_PARTPRO_F, config.TIME_RES_FOLDER)
         os.makedirs(file_path, exist_ok=True)
-        file_name = os.path.join(file_path, f"{file_list}_{config.OUTPUT_FILE_EXT}.csv")
-
-        dataframe.to_csv(file_name, index=False)
-
-if __name__ == '__main__':
-    files_list = reading_filelist()
-    metadata_dfs = reading_metadata(files_list)
+        file_name = Intermediate_Files.path(file_path, f"{file_list}_{config.OUTPUT_FILE_EXT}")
+
+        Intermediate_Files.write(dataframe, file_name)
+
+# RUNNING THE GENERIC EXHAUSTIVE POST PROCESSING ON ONE FILE (used when run together with Collapse_Results in Fused_Pipeline.py)
+def process_file(file_id, anomalies_df, print_housekeeping_message=True, metadata_catalogue=None):
+    """
+    Running merging -> indicator variable -> pwear -> wear log -> mechanical noise on one file.
+    :param file_id: The file to process.
+    :param anomalies_df: The collapsed anomalies (Pampro output) or None (Wave output).
+    :param print_housekeeping_message: If the corruptions housekeeping message should be printed (only printed for the first file).
+    :param metadata_catalogue: The metadata catalogue from Metadata_Catalogue.catalogue(). If None it is loaded.
+    :return: The part processed dataframe (sorted and rounded as in the part processed csv file) or None if the metadata or data file is missing.
+    """
+    files_list = [file_id]
+    metadata_dfs = reading_metadata(files_list, metadata_catalogue)
     datafiles_dfs = reading_datafile(files_list)
-    if config.PROCESSING.lower() == 'pampro':
-        anomalies_df = anomalies()
-        time_resolutions, merged_dfs = merging_data(files_list, metadata_dfs, datafiles_dfs, anomalies_df)
-    if config.PROCESSING.lower() == 'wave':
-        time_resolutions, merged_dfs = merging_data(files_list, metadata_dfs, datafiles_dfs, None)
+    if metadata_dfs is None or datafiles_dfs is None:
+        return None
+
+    time_resolutions, merged_dfs = merging_data(files_list, metadata_dfs, datafiles_dfs, anomalies_df)
     valid_dfs = indicator_variable(time_resolutions, merged_dfs)
     formatted_dfs = pwear_variables(valid_dfs, time_resolutions)
     if config.USE_WEAR_LOG == 'Yes':
         wear_log(formatted_dfs)
-    dataframes = mechanical_noise(formatted_dfs)
-    outputting_dataframe(dataframes, files_list)
+    dataframes = mechanical_noise(formatted_dfs, print_housekeeping_message)
+    formatting_part_proc(dataframes[0])
+
+    return dataframes[0]
+
+
+# PROCESSING AND OUTPUTTING ONE FILE (IN A WORKER PROCESS WHEN RUN IN PARALLEL)
+def process_file_worker(file_id, anomalies_df, print_housekeeping_message, hand_over_dataframes, metadata_catalogue):
+    """
+    Processing one file and outputting the part processed file. Any errors are caught and returned so the other files can carry on processing.
+    :return: result. Dictionary with file_id, the process id of the worker and the error (None if the file was processed).
+    :return: dataframe. The part processed dataframe if hand_over_dataframes is True, otherwise None (so the dataframe is not sent back to the main process).
+    """
+    result = {'file_id': file_id, 'worker': os.getpid(), 'error': None}
+    try:
+        dataframe = process_file(file_id, anomalies_df, print_housekeeping_message, metadata_catalogue)
+        if dataframe is None:
+            result['error'] = "Metadata or data file not found"
+            return result, None
+        outputting_dataframe([dataframe], [file_id])
+        return result, dataframe if hand_over_dataframes else None
+    except Exception:
+        result['error'] = traceback.format_exc()
+        return result, None
+
+# PRINTING SUMMARY OF THE FILES PROCESSED AND FAILED BY EACH WORKER
+def worker_summary(results):
+    workers = {}
+    for result in results:
+        workers.setdefault(result['worker'], []).append(result)
+
+    for worker_number, worker in enumerate(sorted(workers), start=1):
+        failed = [result for result in workers[worker] if result['error'] is not None]
+        print(f"Worker {worker_number} (process {worker}): {len(workers[worker]) - len(failed)} files processed, {len(failed)} failed")
+        for result in failed:
+            print(Fore.RED + f"    {result['file_id']} failed: {result['error']}" + Fore.RESET)
+
+# REPORTING THE FAILED FILES. The other files are still processed, then the run is stopped if any file failed.
+def reporting_failures(results):
+    worker_summary(results)
+
+    failed = [result['file_id'] for result in results if result['error'] is not None]
+    if failed:
+        raise RuntimeError(f"{len(failed)} file(s) failed in the generic exhaustive post processing: {', '.join(failed)}")
+
+# PROCESSING THE FILES IN PARALLEL. EACH FILE IS PROCESSED AND OUTPUTTED BY ONE WORKER, SO THE OUTPUT DOES NOT DEPEND ON THE ORDER THE FILES FINISH IN.
+def parallel_processing(files_list, anomalies_df, hand_over_dataframes, metadata_catalogue):
+    print(f"Processing {len(files_list)} files using {config.GENERIC_WORKERS} workers")
+    with ProcessPoolExecutor(max_workers=config.GENERIC_WORKERS) as executor:
+        outputs = list(executor.map(process_file_worker, files_list, [anomalies_df] * len(files_list),
+                                    [file_id == files_list[0] for file_id in files_list], [hand_over_dataframes] * len(files_list),
+                                    # Each worker is only sent the metadata of its own file
+                                    [Metadata_Catalogue.selecting(metadata_catalogue, 'metadata', file_id) for file_id in files_list]))
+
+    reporting_failures([result for result, dataframe in outputs])
+
+    if not hand_over_dataframes:
+        return None
+    return {file_id: dataframe for file_id, (result, dataframe) in zip(files_list, outputs)}
+
+# PROCESSING THE FILES ONE AT A TIME. Each file is read, processed and outputted before the next file is read, so only one file is held in memory at a time.
+def processed_files(files_list, anomalies_df, metadata_catalogue):
+    results = []
+    for file_id in files_list:
+        result, dataframe = process_file_worker(file_id, anomalies_df, file_id == files_list[0], True, metadata_catalogue)
+        results.append(result)
+        if result['error'] is None:
+            yield file_id, dataframe
+
+    reporting_failures(results)
+
+
+def main(hand_over_dataframes=False):
+    """
+    Running the generic exhaustive post processing on all files in the filelist. If GENERIC_WORKERS in config.py is above 1 the files are processed in parallel.
+    :param hand_over_dataframes: If True the part processed dataframes are kept and returned so they can be handed over to Collapse_Results when the orchestra is run in-process. This holds all part processed files in memory.
+    :return: Dictionary of the part processed dataframes (by file_id) if hand_over_dataframes is True, otherwise None.
+    """
+    files_list = reading_filelist()
+    anomalies_df = anomalies() if config.PROCESSING.lower() == 'pampro' else None
+    metadata_catalogue = Metadata_Catalogue.catalogue()
+    if config.GENERIC_WORKERS > 1:
+        return parallel_processing(files_list, anomalies_df, hand_over_dataframes, metadata_catalogue)
+
+    part_proc_dfs = {}
+    for file_id, dataframe in processed_files(files_list, anomalies_df, metadata_catalogue):
+        if hand_over_dataframes:
+            part_proc_dfs[file_id] = dataframe
+
+    return part_proc_dfs if hand_over_dataframes else None
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+############################################################################################################
+# This file evaluates a grid of inclusion criteria in one pass over the data, instead of editing config.py and re-running Collapse_Results and Prepare_releases for each setting.
+# For every combination of SWEEP_SUM_MIN_HOUR_INCLUSION, SWEEP_SUM_PWEAR, SWEEP_SUM_PWEAR_MORNING and SWEEP_SUM_PWEAR_QUAD (summary) and SWEEP_DAY_PWEAR (daily) in config.py
+# it counts how many files/days would be included in the release (include criteria as in Prepare_releases) and describes the distribution of enmo_mean of the included files/days.
+# The diurnally adjusted enmo_mean is taken from the collapse statistics (OUTPUT_COLLAPSE_STATISTICS in config.py), so it is only solved once per file/day for all SUM_MIN_HOUR_INCLUSION values.
+# The results are saved as one table (SWEEP_OUTPUT_FILE) in the Summary_Files folder, with one row per release level and grid point.
+# Date: 16/10/2026
+# Version: 1.0
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import itertools
+import numpy as np
+import pandas as pd
+import config
+import Intermediate_Files
+import Collapse_Results
+import Collapse_Statistics
+import Prepare_releases
+
+SWEEP_PERCENTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+# --- ENMO_MEAN FROM THE COLLAPSE STATISTICS --- #
+def enmo_means(statistics_df, by=None):
+    """
+    Solving the diurnally adjusted ENMO_mean of a file (or each day) before and after imputation, without applying the inclusion criteria.
+    :param statistics_df: Statistics of one file.
+    :param by: 'day_number' for the daily means. If None all days are used.
+    :return: Dataframe (one row, or one row per day_number) with enmo_mean and the hours of wear it is based on (enmo_hours), and enmo_mean_IMP/enmo_hours_IMP if IMPUTE_DATA is 'Yes'.
+             enmo_mean is included in the collapsed files if enmo_hours >= SUM_MIN_HOUR_INCLUSION/DAY_MIN_HOUR_INCLUSION.
+    """
+    formula = 60 / statistics_df['TIME_RESOLUTION'].iloc[0]
+    versions = [('', False)]
+    if config.IMPUTE_DATA.lower() == 'yes':
+        versions.append(('_IMP', True))
+
+    means = {}
+    for suffix, impute in versions:
+        version_df = Collapse_Statistics.adjusted_statistics(statistics_df, ['ENMO_mean'], impute)
+        constants, pwear_sums = Collapse_Statistics.adjusted_means(version_df, ['ENMO_mean'], inclusion_criteria=-np.inf, formula=formula, by=by)
+        if by is None:
+            constants, pwear_sums = {0: constants}, {0: pwear_sums}
+        means[f'enmo_mean{suffix}'] = pd.Series({segment: values.get('ENMO_mean', np.nan) for segment, values in constants.items()})
+        means[f'enmo_hours{suffix}'] = pd.Series({segment: values['ENMO_mean'] / formula for segment, values in pwear_sums.items()})
+
+    means_df = pd.DataFrame(means)
+    if by is not None:
+        means_df = means_df.rename_axis(by).reset_index()
+    return means_df
+
+def reading_files(file_id, statistics_path, summary_files_path, daily_files_path):
+    """
+    Reading the individual summary/daily file of a file (for the Pwear and metadata variables used in the include criteria) and adding the enmo_mean solved from the collapse statistics.
+    :return: summary_df and daily_df. None if the file (or its collapse statistics) does not exist.
+    """
+    statistics_df = Collapse_Statistics.reading_statistics(file_id, statistics_path)
+    if statistics_df is None:
+        return None, None
+
+    collapsed = {}
+    for collapse_level, file_path, file_name, by in [('summary', summary_files_path, config.SUM_OVERALL_MEANS, None),
+                                                     ('daily', daily_files_path, config.DAY_OVERALL_MEAN, 'day_number')]:
+        output_file = Intermediate_Files.path(file_path, f"{file_id}_{file_name}")
+        if not os.path.exists(output_file):
+            collapsed[collapse_level] = None
+            continue
+        df = Intermediate_Files.read(output_file, dtype={'id': str, 'subject_code': str})
+        df = df.drop(columns=[column for column in df.columns if column.startswith('enmo_mean')])
+        means_df = enmo_means(statistics_df, by)
+        collapsed[collapse_level] = pd.concat([df.reset_index(drop=True), means_df], axis=1) if by is None else df.merge(means_df, on=by, how='left')
+
+    return collapsed['summary'], collapsed['daily']
+
+
+# --- EVALUATING THE GRID --- #
+def sweep_results(df, release_level, min_hour_inclusion, pwear, pwear_morning, pwear_quad):
+    """
+    Counting the included files/days and describing enmo_mean for one grid point.
+    :param df: Appended summary or daily dataframe from reading_files().
+    :param release_level: 'summary' or 'daily'.
+    :param min_hour_inclusion: SUM_MIN_HOUR_INCLUSION/DAY_MIN_HOUR_INCLUSION. enmo_mean is missing if it is based on fewer hours of wear.
+    :return: Dictionary with the grid point, number of files/days included and the distribution of enmo_mean (consolidated, so the imputed enmo_mean is used for include=2).
+    """
+    include = Prepare_releases.include_criteria(df, pwear, pwear_morning, pwear_quad)
+    enmo_mean = df['enmo_mean'].where(df['enmo_hours'] >= min_hour_inclusion)
+    if 'enmo_mean_IMP' in df.columns:
+        enmo_mean = enmo_mean.mask(include == 2, df['enmo_mean_IMP'].where(df['enmo_hours_IMP'] >= min_hour_inclusion))
+    enmo_mean = enmo_mean[include > 0].dropna()
+
+    results = {'release_level': release_level, 'min_hour_inclusion': min_hour_inclusion, 'pwear': pwear, 'pwear_morning': pwear_morning, 'pwear_quad': pwear_quad,
+               'n': len(df), 'n_include_1': int((include == 1).sum()), 'n_include_2': int((include == 2).sum()),
+               'enmo_mean_n': len(enmo_mean), 'enmo_mean_mean': enmo_mean.mean(), 'enmo_mean_sd': enmo_mean.std(), 'enmo_mean_min': enmo_mean.min()}
+    for percentile in SWEEP_PERCENTILES:
+        results[f'enmo_mean_p{round(percentile * 100)}'] = enmo_mean.quantile(percentile) if len(enmo_mean) else np.nan
+    results['enmo_mean_max'] = enmo_mean.max()
+    return results
+
+def sweeping_grid(df, release_level):
+    if df.empty:
+        return []
+
+    # Flagging axis anomalies (Pampro output), the same as Prepare_releases does before generating the include criteria
+    if config.PROCESSING.lower() == 'pampro' and 'QC_axis_anomaly' in df.columns:
+        Prepare_releases.flagging_axis_fault(df)
+
+    if release_level == 'summary':
+        grid = itertools.product(config.SWEEP_SUM_MIN_HOUR_INCLUSION, config.SWEEP_SUM_PWEAR, config.SWEEP_SUM_PWEAR_MORNING, config.SWEEP_SUM_PWEAR_QUAD)
+    else:
+        grid = itertools.product([config.DAY_MIN_HOUR_INCLUSION], config.SWEEP_DAY_PWEAR, [config.DAY_PWEAR_MORNING], [config.DAY_PWEAR_QUAD])
+    return [sweep_results(df, release_level, *grid_point) for grid_point in grid]
+
+
+def main():
+    """
+    Evaluating the grid of inclusion criteria set in config.py on all files in the filelist that have collapse statistics.
+    :return: sweep_df: The table of results (also saved as SWEEP_OUTPUT_FILE).
+    """
+    statistics_path = Collapse_Results.create_path(config.INDIVIDUAL_STATS_F)
+    summary_files_path = Collapse_Results.create_path(config.INDIVIDUAL_SUM_F)
+    daily_files_path = Collapse_Results.create_path(config.INDIVIDUAL_DAILY_F)
+
+    summary_dfs, daily_dfs = [], []
+    for file_id in Collapse_Results.reading_filelist():
+        summary_df, daily_df = reading_files(file_id, statistics_path, summary_files_path, daily_files_path)
+        if summary_df is not None:
+            summary_dfs.append(summary_df)
+        if daily_df is not None:
+            daily_dfs.append(daily_df)
+
+    if not summary_dfs and not daily_dfs:
+        print(f"No collapse statistics were found in {statistics_path}. Set OUTPUT_COLLAPSE_STATISTICS to 'Yes' in config.py and run Collapse_Results before running the inclusion sweep.")
+        return None
+
+    results = []
+    for release_level, dfs in [('summary', summary_dfs), ('daily', daily_dfs)]:
+        results += sweeping_grid(pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(), release_level)
+
+    sweep_df = pd.DataFrame(results)
+    sweep_df.to_csv(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER, f'{config.SWEEP_OUTPUT_FILE}.csv'), index=False)
+    return sweep_df
+
+
+if __name__ == '__main__':
+    main()
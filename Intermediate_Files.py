@@ -0,0 +1,183 @@
+############################################################################################################
+# This file reads and writes the files passed between the post processing scripts (part processed, trimmed, individual summary/daily files and the appended *_MEANS files).
+# The format is set by INTERMEDIATE_FORMAT in config.py:
+#   - 'csv': Files are written as csv files (the part processed files are rounded to 6 decimals).
+#   - 'parquet' or 'feather': Files are written as compressed binary column files. These are much faster to read, only the columns needed are read in and no precision is lost.
+# The release files (_releases folder) and data dictionaries are always written as csv files.
+# Date: 16/10/2026
+# Version: 1.0
+# Version: 1.1 Reading the columns of a file without reading the data and writing files chunk by chunk (used to stream the appended hourly/minute level file)
+# Version: 1.2 Copying the partitions (chunks) of a file written chunk by chunk across to a new file without reading them in (used to append incrementally)
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import pandas as pd
+import config
+import Dtype_Schema
+
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+
+# --- FILE NAMES --- #
+def intermediate_format():
+    file_format = config.INTERMEDIATE_FORMAT.lower()
+    if file_format not in FORMATS:
+        raise ValueError(f"INTERMEDIATE_FORMAT in config.py is '{config.INTERMEDIATE_FORMAT}'. It should be one of: {', '.join(FORMATS)}")
+    return file_format
+
+def extension():
+    return FORMATS[intermediate_format()]
+
+def path(folder, name):
+    """
+    Creating the path of an intermediate file.
+    :param folder: Folder the file is saved in.
+    :param name: Filename without extension, e.g. 'AAA001_1h_part_proc'.
+    :return: Path to the file with the extension of the format set in config.py.
+    """
+    return os.path.join(folder, f"{name}{extension()}")
+
+
+# --- WRITING AND READING FILES --- #
+def write(df, file_path):
+    """
+    Writing an intermediate file in the format set in config.py.
+    :param df: Dataframe to write.
+    :param file_path: Path created with path().
+    :return: None
+    """
+    file_format = intermediate_format()
+    if file_format == 'csv':
+        df.to_csv(file_path, index=False)
+    elif file_format == 'parquet':
+        df.to_parquet(file_path, index=False, compression=config.INTERMEDIATE_COMPRESSION)
+    elif file_format == 'feather':
+        df.reset_index(drop=True).to_feather(file_path, compression=config.INTERMEDIATE_COMPRESSION)
+
+def read(file_path, columns=None, dtype=None):
+    """
+    Reading an intermediate file in the format set in config.py. The binary files are memory mapped, so only the columns asked for are read from disk.
+    :param file_path: Path created with path().
+    :param columns: List of columns to read. All columns are read if None.
+    :param dtype: Dictionary of columns to read as text, e.g. {'subject_code': str}. For the binary files, values are changed to text where not missing.
+    :return: The dataframe (with compact data types if COMPACT_DTYPES is 'Yes' in config.py).
+    """
+    file_format = intermediate_format()
+    if file_format == 'csv':
+        return Dtype_Schema.read_csv(file_path, usecols=columns, dtype=dtype)
+
+    if file_format == 'parquet':
+        df = pd.read_parquet(file_path, columns=columns, memory_map=True)
+    else:
+        import pyarrow.feather
+        df = pyarrow.feather.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+
+    for column, column_type in (dtype or {}).items():
+        if column in df.columns:
+            df[column] = df[column].mask(df[column].notna(), df[column].astype(column_type))
+    return Dtype_Schema.compact_dtypes(df)
+
+def read_columns(file_path):
+    """
+    Reading the column names of an intermediate file without reading in the data.
+    :param file_path: Path created with path().
+    :return: List of column names.
+    """
+    if intermediate_format() == 'csv':
+        return list(pd.read_csv(file_path, nrows=0).columns)
+    return read_schema(file_path).names
+
+def read_schema(file_path):
+    """
+    Reading the schema (column names and data types) of a binary file from the file footer, without reading in the data.
+    :param file_path: Path created with path().
+    :return: pyarrow schema. None if INTERMEDIATE_FORMAT is 'csv'.
+    """
+    file_format = intermediate_format()
+    if file_format == 'parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(file_path).remove_metadata()
+    if file_format == 'feather':
+        import pyarrow
+        with pyarrow.memory_map(file_path) as source:
+            return pyarrow.ipc.open_file(source).schema.remove_metadata()
+    return None
+
+def arrow_batch(chunk, schema):
+    import pyarrow
+    # Columns with only missing values in the chunk are written as missing values of the type of the column in the file
+    arrays = [pyarrow.nulls(len(chunk), field.type) if field.name not in chunk.columns or chunk[field.name].isna().all()
+              else pyarrow.array(chunk[field.name], type=field.type, from_pandas=True) for field in schema]
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+def write_chunks(chunks, file_path, columns, schema=None, source_path=None):
+    """
+    Writing an intermediate file chunk by chunk, so the full dataset is never held in memory. The file is written to a temporary file first and then moved to file_path.
+    :param chunks: Iterable of dataframes (e.g. a generator reading in the data) or partitions of source_path (as returned by this function), which are copied across without reading them in. Columns missing in a chunk are written as missing values. None is skipped.
+    :param file_path: Path created with path().
+    :param columns: List of all columns in the file (in the order they are written).
+    :param schema: pyarrow schema of the file. Only needed if INTERMEDIATE_FORMAT is 'parquet' or 'feather'.
+    :param source_path: File previously written with write_chunks() with the same columns/schema, that partitions are copied from. Can be file_path itself.
+    :return: List with the partition each chunk was written to: [start byte, end byte] for csv, the row group (parquet) or record batch (feather) number otherwise. None for empty chunks.
+    """
+    file_format = intermediate_format()
+    temporary_path = f"{file_path}.tmp"
+    partitions = []
+
+    if file_format == 'csv':
+        source = open(source_path, 'rb') if source_path else None
+        with open(temporary_path, 'wb') as f:
+            f.write(pd.DataFrame(columns=columns).to_csv(index=False).encode())
+            for chunk in chunks:
+                if chunk is None or (isinstance(chunk, pd.DataFrame) and chunk.empty):
+                    partitions.append(None)
+                    continue
+                if isinstance(chunk, pd.DataFrame):
+                    data = chunk.reindex(columns=columns).to_csv(index=False, header=False).encode()
+                else:
+                    source.seek(chunk[0])
+                    data = source.read(chunk[1] - chunk[0])
+                partitions.append([f.tell(), f.tell() + len(data)])
+                f.write(data)
+        if source is not None:
+            source.close()
+        os.replace(temporary_path, file_path)
+        return partitions
+
+    import pyarrow
+    import pyarrow.parquet
+    if file_format == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(temporary_path, schema, compression=config.INTERMEDIATE_COMPRESSION)
+    else:
+        writer = pyarrow.ipc.new_file(temporary_path, schema, options=pyarrow.ipc.IpcWriteOptions(compression=config.INTERMEDIATE_COMPRESSION))
+    source_file = pyarrow.memory_map(source_path) if source_path else None
+    if source_file is not None:
+        source = pyarrow.parquet.ParquetFile(source_file) if file_format == 'parquet' else pyarrow.ipc.open_file(source_file)
+
+    written = 0
+    with writer:
+        for chunk in chunks:
+            if chunk is None or (isinstance(chunk, pd.DataFrame) and chunk.empty):
+                partitions.append(None)
+                continue
+            if isinstance(chunk, pd.DataFrame):
+                table = pyarrow.Table.from_batches([arrow_batch(chunk, schema)])
+            elif file_format == 'parquet':
+                table = source.read_row_group(chunk)
+            else:
+                table = pyarrow.Table.from_batches([source.get_batch(chunk)])
+            # Each chunk is written as one row group (parquet) or record batch (feather), so it can be copied across on its own next time
+            if file_format == 'parquet':
+                writer.write_table(table, row_group_size=max(table.num_rows, 1))
+            else:
+                writer.write_table(table, max_chunksize=max(table.num_rows, 1))
+            partitions.append(written)
+            written += 1
+    if source_file is not None:
+        source_file.close()
+    os.replace(temporary_path, file_path)
+    return partitions
+
+def round_part_proc():
+    # The csv part processed files are rounded to 6 decimals to keep the file size down. The binary files keep full precision.
+    return intermediate_format() == 'csv'
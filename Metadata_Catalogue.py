@@ -0,0 +1,133 @@
+############################################################################################################
+# This file keeps a catalogue of the metadata files in the results folder (metadata_*, qc_meta_*, analysis_meta_* and file_meta_* csv files), so each file is only read once instead of by every script that needs it.
+# All files are held in one table, saved in the Summary_Files folder (METADATA_CATALOGUE_FILE in config.py). Each time the catalogue is used, files that are new or have a different size or modified time
+# are read in (METADATA_WORKERS files at the same time) and files that have been removed are dropped, so only the changed files are read.
+# The columns and data types of each file are kept, so a file looked up in the catalogue is the same as when it is read in with pd.read_csv.
+# Date: 16/10/2026
+# Version: 1.0
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import pandas as pd
+import config
+import Results_Index
+from concurrent.futures import ThreadPoolExecutor
+
+# Metadata files in the results folder: {meta type}_{file_id}.csv
+META_TYPES = ['metadata', 'qc_meta', 'analysis_meta', 'file_meta']
+
+
+# --- READING AND SAVING THE CATALOGUE --- #
+def catalogue_path():
+    return os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER, config.METADATA_CATALOGUE_FILE)
+
+def empty_catalogue():
+    return {'files': pd.DataFrame(columns=['meta_type', 'file_id', 'size', 'mtime_ns', 'columns', 'dtypes'], index=pd.Index([], name='file_name')),
+            'table': pd.DataFrame(index=pd.Index([], name='file_name'))}
+
+def load_catalogue():
+    if os.path.exists(catalogue_path()):
+        try:
+            return pd.read_pickle(catalogue_path())
+        except Exception:
+            print(f"{config.METADATA_CATALOGUE_FILE} could not be read. All metadata files are read in again.")
+    return empty_catalogue()
+
+def save_catalogue(catalogue):
+    os.makedirs(os.path.dirname(catalogue_path()), exist_ok=True)
+    pd.to_pickle(catalogue, f"{catalogue_path()}.tmp")
+    os.replace(f"{catalogue_path()}.tmp", catalogue_path())
+
+
+# --- UPDATING THE CATALOGUE --- #
+def listing_files():
+    """
+    Listing the metadata files in the results folder.
+    :return: Dataframe (indexed by file name) with the meta type, file_id, size and modified time of each file.
+    """
+    files_df = Results_Index.classifying(Results_Index.listing(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER), extension='.csv'))
+    files_df = files_df[files_df['file_type'].isin(META_TYPES)].rename(columns={'filename': 'file_name', 'file_type': 'meta_type'})
+    return files_df[['file_name', 'meta_type', 'file_id', 'size', 'mtime_ns']].set_index('file_name')
+
+def reading_file(file_name):
+    df = pd.read_csv(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, file_name))
+    return df, list(df.columns), {column: str(dtype) for column, dtype in df.dtypes.items()}
+
+def catalogue():
+    """
+    Updating the catalogue with the metadata files that are new, changed or removed since it was last used, and saving it.
+    :return: Dictionary with 'files' (one row per file: meta type, file_id, size, modified time, columns and data types) and 'table' (the rows of all files, indexed by file name).
+    """
+    saved = load_catalogue()
+    files = listing_files()
+
+    old_files = saved['files'].reindex(files.index)
+    unchanged = (old_files['size'] == files['size']) & (old_files['mtime_ns'] == files['mtime_ns'])
+    new_files = files.index[~unchanged].tolist()
+    removed_files = saved['files'].index.difference(files.index)
+    if not new_files and removed_files.empty:
+        return saved
+
+    # Reading the new and changed files with a pool of threads
+    with ThreadPoolExecutor(max_workers=config.METADATA_WORKERS) as executor:
+        new_data = list(executor.map(reading_file, new_files))
+
+    new_entries = {file_name: (columns, dtypes) for file_name, (df, columns, dtypes) in zip(new_files, new_data)}
+    files['columns'] = [new_entries[file_name][0] if file_name in new_entries else columns for file_name, columns in old_files['columns'].items()]
+    files['dtypes'] = [new_entries[file_name][1] if file_name in new_entries else dtypes for file_name, dtypes in old_files['dtypes'].items()]
+
+    kept_table = saved['table'][saved['table'].index.isin(files.index[unchanged])]
+    # Files with no rows (only a header) are only kept in the files table
+    new_tables = [df.set_axis(pd.Index([file_name] * len(df), name='file_name'), axis=0) for file_name, (df, columns, dtypes) in zip(new_files, new_data) if not df.empty]
+    table = pd.concat([table for table in [kept_table] + new_tables if not table.empty]).sort_index(kind='stable') if new_tables else kept_table
+
+    updated = {'files': files, 'table': table}
+    save_catalogue(updated)
+    print(f"Metadata catalogue updated: {len(new_files)} new or changed files read in, {len(removed_files)} removed files dropped, {int(unchanged.sum())} unchanged files.")
+    return updated
+
+def selecting(metadata_catalogue, meta_type, file_id):
+    # Part of the catalogue with only one file (e.g. to send to a worker process)
+    file_names = [file_name for file_name in [f"{meta_type}_{file_id}.csv"] if file_name in metadata_catalogue['files'].index]
+    table_names = [file_name for file_name in file_names if file_name in metadata_catalogue['table'].index]
+    return {'files': metadata_catalogue['files'].loc[file_names], 'table': metadata_catalogue['table'].loc[table_names]}
+
+
+# --- LOOKING UP FILES IN THE CATALOGUE --- #
+def column_type(dtypes, in_all_files):
+    # The data type pandas gives a column when appending files where it has these data types
+    if in_all_files and len(set(dtypes)) == 1:
+        return dtypes[0]
+    if all(pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) for dtype in dtypes):
+        return 'float64'
+    return 'object'
+
+def lookup(metadata_catalogue, meta_type, file_id):
+    """
+    Looking up one metadata file in the catalogue.
+    :param metadata_catalogue: The catalogue from catalogue().
+    :param meta_type: 'metadata', 'qc_meta', 'analysis_meta' or 'file_meta'.
+    :param file_id: The file_id, e.g. 'AAA001'.
+    :return: Dataframe the same as pd.read_csv of the file. None if there is no such file.
+    """
+    file_name = f"{meta_type}_{file_id}.csv"
+    if file_name not in metadata_catalogue['files'].index:
+        return None
+    entry = metadata_catalogue['files'].loc[file_name]
+    table = metadata_catalogue['table']
+    df = table.loc[[file_name], entry['columns']] if file_name in table.index else pd.DataFrame(columns=entry['columns'])
+    return df.astype(entry['dtypes']).reset_index(drop=True)
+
+def appended_table(metadata_catalogue, meta_type):
+    """
+    All files of one meta type appended together (in order of file name).
+    :return: Dataframe indexed by file name, the same as appending the files read in with pd.read_csv.
+    """
+    files = metadata_catalogue['files'][metadata_catalogue['files']['meta_type'] == meta_type]
+    columns = list(dict.fromkeys(column for file_columns in files['columns'] for column in file_columns))
+    table = metadata_catalogue['table']
+    df = table.loc[table.index.isin(files.index)].reindex(columns=columns)
+    for column in columns:
+        dtypes = [file_dtypes[column] for file_dtypes in files['dtypes'] if column in file_dtypes]
+        df[column] = df[column].astype(column_type(dtypes, in_all_files=len(dtypes) == len(files)))
+    return df
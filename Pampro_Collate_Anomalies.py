@@ -3,6 +3,7 @@
 # Author: cas254
 # Date: 11/11/2024
 # Version: 1.0
+# Version: 1.1 The qc_meta files are taken from the metadata catalogue (Metadata_Catalogue.py)
 ############################################################################################################
 
 # --- IMPORTING PACKAGES --- #
@@ -11,6 +12,7 @@ import pandas as pd
 import config
 import glob
 import numpy as np
+import Metadata_Catalogue
 
 # --- GETTING LIST OF FILES AND APPENDING THEM --- #
 def list_files(FOLDER, pattern, variable, REPLACE):
@@ -71,13 +73,15 @@ def create_time_diff(df, var_diff, var1, var2):
 
 
 
-if __name__ == '__main__':
+def main():
     # Appending all anomalies files
     all_anomalies_df, all_anomalies_files = list_files(FOLDER=config.ANOMALIES_FOLDER, pattern='*anomalies.csv', variable='anomaly_file', REPLACE='_anomalies.csv')
 
-    # Appending all qc_meta files
-    all_qc_meta_df, all_qc_files = list_files(FOLDER=config.RESULTS_FOLDER, pattern='qc_meta*', variable='qc_file', REPLACE='qc_meta_')
-    all_qc_meta_df['file_id'] = all_qc_meta_df['file_id'].str.replace('.csv', '', regex=False)
+    # Appending all qc_meta files (from the metadata catalogue)
+    all_qc_meta_df = Metadata_Catalogue.appended_table(Metadata_Catalogue.catalogue(), 'qc_meta')
+    all_qc_meta_df['qc_file'] = all_qc_meta_df.index
+    all_qc_meta_df['file_id'] = all_qc_meta_df['qc_file'].str.replace('qc_meta_', '', regex=False).str.replace('.csv', '', regex=False)
+    all_qc_meta_df = all_qc_meta_df.reset_index(drop=True)
 
     # Only continuing with formatting the anomalies dataset if any anomalies were present, otherwise finishing this script
     if all_anomalies_files:
@@ -145,3 +149,5 @@ if __name__ == '__main__':
         collapsed_df.to_csv(output_path, index=False)
 
 
+if __name__ == '__main__':
+    main()
@@ -4,51 +4,46 @@
 # Author: cas254
 # Date: 07/10/2024
 # Version: 1.0
+# Version: 1.1 The meta files are listed and read from the metadata catalogue (Metadata_Catalogue.py)
 ############################################################################################################
 
 # --- IMPORTING PACKAGES --- #
 import os
 import pandas as pd
 import config
+import Metadata_Catalogue
 
 
 # --- GETTING LIST OF META FILES --- #
-def list_files():
+def list_files(metadata_catalogue):
     '''
-    The function creates a filelist, keeps files with meta in, extract filetype and id and then group the files by id.
-    :param results_folder:
+    The function takes the meta files (not the metadata files) from the metadata catalogue, with their filetype and id and then group the files by id.
+    :param metadata_catalogue: The metadata catalogue from Metadata_Catalogue.catalogue()
     :return: groups
     '''
-    files = os.listdir(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER))
-    df = pd.DataFrame(files, columns=['filename'])
-    df = df[df['filename'].str.contains('meta') & ~df['filename'].str.startswith('metadata')]
-    df[['file_type', 'id']] = df['filename'].str.split(r'(?<=meta)', expand=True)
-    df['id'] = df['id'].str.lstrip('_').str.replace('.csv', '', regex=False)
+    df = metadata_catalogue['files'].reset_index().rename(columns={'file_name': 'filename', 'meta_type': 'file_type', 'file_id': 'id'})
+    df = df[df['file_type'] != 'metadata']
 
     # Grouping files with same id
     groups = df.groupby('id')
     return groups
 
 # --- MERING META FILES WITH SAME ID INTO 1 METADATA file --- #
-def merge_meta(groups, variables):
+def merge_meta(groups, variables, metadata_catalogue):
     for id, group in groups:
 
         # Defining output path:
         output_file = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, f'metadata_{id}.csv')
 
         # Checking if metadata file already exist for each id:
-        if os.path.exists(output_file):
+        if f'metadata_{id}.csv' in metadata_catalogue['files'].index:
             print(f'metadata already exist for {id}. Skipping')
             continue
 
         # Merge the metafiles for the id's that does not already have a metadata file
-        file_paths = {}
         missing_file = False
         for var in variables:
-            try:
-                file_name = group[group['file_type'].str.contains(var)]['filename'].values[0]
-                file_paths[f'{var}_file'] = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, file_name)
-            except IndexError:
+            if not group['file_type'].str.contains(var).any():
                 print(f'File {var} is not found for {id}. Skipping this.')
                 missing_file = True
                 break
@@ -56,12 +51,12 @@ def merge_meta(groups, variables):
             continue # if any required file is missing it will skip to the next group
 
         # Reading analysis_meta file
-        analysis_df = pd.read_csv(file_paths['analysis_meta_file'])
+        analysis_df = Metadata_Catalogue.lookup(metadata_catalogue, 'analysis_meta', id)
         if 'file_name' not in analysis_df:
             analysis_df['file_filename'] = id
 
         # Merge with qc_meta
-        qc_meta_df = pd.read_csv(file_paths['qc_meta_file'])
+        qc_meta_df = Metadata_Catalogue.lookup(metadata_catalogue, 'qc_meta', id)
 
         if 'file_name' not in qc_meta_df:
             qc_meta_df['file_filename'] = id
@@ -75,6 +70,11 @@ def merge_meta(groups, variables):
 
 
 
+def main():
+    metadata_catalogue = Metadata_Catalogue.catalogue()
+    groups = list_files(metadata_catalogue)
+    merge_meta(groups, ['analysis_meta', 'file_meta', 'qc_meta'], metadata_catalogue)
+
+
 if __name__ == '__main__':
-    groups = list_files()
-    merge_meta(groups, ['analysis_meta', 'file_meta', 'qc_meta'])
\ No newline at end of file
+    main()
@@ -10,6 +10,8 @@ import os
 from numpy.ma.core import angle
 
 import config
+import Dtype_Schema
+import Intermediate_Files
 import pandas as pd
 from colorama import Fore
 from datetime import date
@@ -21,7 +23,70 @@ import Acc_Post_Processing_Orchestra
 # --- IMPORTING AND FORMATTING SUMMARY RESULTS FILE --- #
 #########################################################
 
-def formatting_file(import_file_name, release_level, pwear, pwear_morning, pwear_quad, print_message, output_filename):
+# Flagging axis anomalies (Pampro output) and setting all Pwear/ENMO/HPFVM variables to missing if confirmed axis issue
+def flagging_axis_fault(df):
+    df['FLAG_AXIS_FAULT'] = 0
+    df.loc[df['QC_axis_anomaly'] == 'True', 'FLAG_AXIS_FAULT'] = 1
+
+    columns_to_replace = [col for col in df.columns if any(pattern in col for pattern in ['Pwear', 'pwear', 'ENMO', 'enmo', 'HPFVM', 'hpfvm'])]
+    for col in columns_to_replace:
+        df.loc[df['FLAG_AXIS_FAULT'] == 1, col] = np.nan
+
+
+def include_criteria(df, pwear, pwear_morning, pwear_quad):
+    """
+    Generating the include criteria for the summary/daily release.
+    :param df: Summary or daily dataframe.
+    :param pwear: Minimum hours of wear overall (SUM_PWEAR/DAY_PWEAR).
+    :param pwear_morning: Minimum hours of wear in the morning quadrant (SUM_PWEAR_MORNING/DAY_PWEAR_MORNING).
+    :param pwear_quad: Minimum hours of wear in each of the noon, afternoon and night quadrants (SUM_PWEAR_QUAD/DAY_PWEAR_QUAD).
+    :return: include. 0=Not included, 1=Included, 2=Included with imputed sleep data (only if IMPUTE_DATA is 'Yes').
+    """
+    include = pd.Series(0, index=df.index)
+
+    if config.IMPUTE_DATA.lower() == 'no':
+        include.loc[
+            (df['Pwear'] >= pwear) &
+            (df['Pwear_morning'] >= pwear_morning) &
+            (df['Pwear_noon'] >= pwear_quad) &
+            (df['Pwear_afternoon'] >= pwear_quad) &
+            (df['Pwear_night'] >= pwear_quad) &
+            (df['file_end_error'] <= df['noise_cutoff'])] = 1
+
+    if config.IMPUTE_DATA.lower() == 'yes':
+
+        # Checking if FLAG_NO_VALID_DAYS is a variable in the dataframe and otherwise it will give it the value 0
+        FLAG_NO_VALID_DAYS_exists = 'FLAG_NO_VALID_DAYS' in df.columns
+        FLAG_NO_VALID_DAYS_condition = (df['FLAG_NO_VALID_DAYS'] != 1) if FLAG_NO_VALID_DAYS_exists else True
+        CALIBRATION_TYPE_exists = 'calibration_type' in df.columns
+        CALIBRATION_TYPE_condition = (df['calibration_type'] != 'fail') if CALIBRATION_TYPE_exists else True
+        FLAG_AXIS_FAULT_exists = 'FLAG_AXIS_FAULT' in df.columns
+        FLAG_AXIS_FAULT_condition = (df['FLAG_AXIS_FAULT'] != 1) if FLAG_AXIS_FAULT_exists else True
+
+        include.loc[
+            (df['Pwear'] >= pwear) &
+            (df['Pwear_morning'] >= pwear_morning) &
+            (df['Pwear_noon'] >= pwear_quad) &
+            (df['Pwear_afternoon'] >= pwear_quad) &
+            (df['Pwear_night'] >= pwear_quad) &
+            (CALIBRATION_TYPE_condition) &
+            (FLAG_NO_VALID_DAYS_condition) &
+            (FLAG_AXIS_FAULT_condition)] = 1
+        include.loc[
+            (df['Pwear'] >= pwear) &
+            (df['Pwear_morning'] < pwear_morning) &
+            (df['Pwear_noon'] >= pwear_quad) &
+            (df['Pwear_afternoon'] >= pwear_quad) &
+            (df['Pwear_night'] >= pwear_quad) &
+            (CALIBRATION_TYPE_condition) &
+            (FLAG_NO_VALID_DAYS_condition) &
+            (include != 1) &
+            (FLAG_AXIS_FAULT_condition)] = 2
+
+    return include
+
+
+def formatting_file(import_file_name, release_level, pwear, pwear_morning, pwear_quad, print_message, output_filename, df=None):
     # Make release directories if not already present
     try:
         os.makedirs(os.path.join(config.ROOT_FOLDER, config.RELEASES_FOLDER, config.PC_DATE))
@@ -29,8 +94,15 @@ def formatting_file(import_file_name, release_level, pwear, pwear_morning, pwear
         pass
 
     file_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER, import_file_name)
-    if os.path.exists(file_path):
-        df = pd.read_csv(file_path, dtype={'subject_code': str})
+    # Using the appended dataset handed over from Appending_Files if the orchestra is run in-process
+    if df is not None:
+        df = df.copy()
+        if 'subject_code' in df.columns:
+            df['subject_code'] = df['subject_code'].mask(df['subject_code'].notna(), df['subject_code'].astype(str))
+        df = Dtype_Schema.compact_dtypes(df)
+
+    elif os.path.exists(file_path):
+        df = Intermediate_Files.read(file_path, dtype={'subject_code': str})
 
     else:
         print(f"The file {file_path} does not exist. The release on {release_level} level could not be prepared.")
@@ -54,14 +126,7 @@ def formatting_file(import_file_name, release_level, pwear, pwear_morning, pwear
         else:
             df['FLAG_ANOMALY'] = np.nan
 
-        # Flagging axis anomalies
-        df['FLAG_AXIS_FAULT'] = 0
-        df.loc[df['QC_axis_anomaly'] == 'True', 'FLAG_AXIS_FAULT'] = 1
-
-        # Setting all variables to missing if confirmed axis issue
-        columns_to_replace = [col for col in df.columns if any(pattern in col for pattern in ['Pwear', 'pwear', 'ENMO', 'enmo', 'HPFVM', 'hpfvm'])]
-        for col in columns_to_replace:
-            df.loc[df['FLAG_AXIS_FAULT'] == 1, col] = np.nan
+        flagging_axis_fault(df)
 
 
     # Sorting dataset
@@ -87,47 +152,9 @@ def formatting_file(import_file_name, release_level, pwear, pwear_morning, pwear
 
     # Generating include criteria
     if release_level == 'summary' or release_level == 'daily':
-        df['include'] = 0
-
-        if config.IMPUTE_DATA.lower() == 'no':
-            df.loc[
-                (df['Pwear'] >= pwear) &
-                (df['Pwear_morning'] >= pwear_morning) &
-                (df['Pwear_noon'] >= pwear_quad) &
-                (df['Pwear_afternoon'] >= pwear_quad) &
-                (df['Pwear_night'] >= pwear_quad) &
-                (df['file_end_error'] <= df['noise_cutoff']), 'include'] = 1
+        df['include'] = include_criteria(df, pwear, pwear_morning, pwear_quad)
 
         if config.IMPUTE_DATA.lower() == 'yes':
-
-            # Checking if FLAG_NO_VALID_DAYS is a variable in the dataframe and otherwise it will give it the value 0
-            FLAG_NO_VALID_DAYS_exists = 'FLAG_NO_VALID_DAYS' in df.columns
-            FLAG_NO_VALID_DAYS_condition = (df['FLAG_NO_VALID_DAYS'] != 1) if FLAG_NO_VALID_DAYS_exists else True
-            CALIBRATION_TYPE_exists = 'calibration_type' in df.columns
-            CALIBRATION_TYPE_condition = (df['calibration_type'] != 'fail') if CALIBRATION_TYPE_exists else True
-            FLAG_AXIS_FAULT_exists = 'FLAG_AXIS_FAULT' in df.columns
-            FLAG_AXIS_FAULT_condition = (df['FLAG_AXIS_FAULT'] != 1) if FLAG_AXIS_FAULT_exists else True
-
-            df.loc[
-                (df['Pwear'] >= pwear) &
-                (df['Pwear_morning'] >= pwear_morning) &
-                (df['Pwear_noon'] >= pwear_quad) &
-                (df['Pwear_afternoon'] >= pwear_quad) &
-                (df['Pwear_night'] >= pwear_quad) &
-                (CALIBRATION_TYPE_condition) &
-                (FLAG_NO_VALID_DAYS_condition) &
-                (FLAG_AXIS_FAULT_condition), 'include'] = 1
-            df.loc[
-                (df['Pwear'] >= pwear) &
-                (df['Pwear_morning'] < pwear_morning) &
-                (df['Pwear_noon'] >= pwear_quad) &
-                (df['Pwear_afternoon'] >= pwear_quad) &
-                (df['Pwear_night'] >= pwear_quad) &
-                (CALIBRATION_TYPE_condition) &
-                (FLAG_NO_VALID_DAYS_condition) &
-                (df['include'] != 1) &
-                (FLAG_AXIS_FAULT_condition), 'include'] = 2
-
             df.loc[(df['include'] == 2), 'imputed'] = 1
 
         if release_level == 'summary' or release_level == 'daily':
@@ -319,7 +346,7 @@ def formatting_file(import_file_name, release_level, pwear, pwear_morning, pwear
         unique_filename = sorted(set(filename_list))
 
 
-        grouped = df.groupby('filename')['day_number'].count()
+        grouped = df.groupby('filename', observed=True)['day_number'].count()
         print(Fore.YELLOW + "Filenames and rows/days per ID:" + Fore.RESET)
         for filename in unique_filename:
             count_days = grouped.get(filename, 0)
@@ -642,22 +669,29 @@ def data_dictionary(df, filename, release_level, pwear, pwear_quad, append_level
 #################################
 # --- Calling the functions --- #
 #################################
-if __name__ == '__main__':
+def main(appended_dfs=None):
+    """
+    Preparing the summary, daily and hourly/minute level release files.
+    :param appended_dfs: Optional dictionary of the appended datasets handed over from Appending_Files when the orchestra is run in-process. Datasets not in the dictionary are read from the Summary_Files folder.
+    :return: None
+    """
+    appended_dfs = appended_dfs or {}
+
     # Preparing summary release file
     if Acc_Post_Processing_Orchestra.RUN_PREPARE_SUMMARY_RELEASE.lower() == 'yes':
         Acc_Post_Processing_Orchestra.print_message("PREPARING A SUMMARY RELEASE FILE")
 
-        summary_df = formatting_file(import_file_name=f'{config.SUM_OUTPUT_FILE}.csv', release_level='summary',
+        summary_df = formatting_file(import_file_name=f'{config.SUM_OUTPUT_FILE}{Intermediate_Files.extension()}', release_level='summary',
                                      pwear=config.SUM_PWEAR, pwear_morning=config.SUM_PWEAR_MORNING, pwear_quad=config.SUM_PWEAR_QUAD, print_message='files/IDs',
-                                     output_filename=config.SUM_OUTPUT_FILE)
+                                     output_filename=config.SUM_OUTPUT_FILE, df=appended_dfs.get('summary'))
         data_dictionary(df=summary_df, filename=config.SUM_OUTPUT_FILE, release_level='summary', pwear=config.SUM_PWEAR, pwear_quad=config.SUM_PWEAR_QUAD, append_level='summary')
 
     # Preparing daily release file
     if Acc_Post_Processing_Orchestra.RUN_PREPARE_DAILY_RELEASE.lower() == 'yes':
         Acc_Post_Processing_Orchestra.print_message("PREPARING A DAILY RELEASE FILE")
-        daily_df = formatting_file(import_file_name=f'{config.DAY_OUTPUT_FILE}.csv', release_level='daily',
+        daily_df = formatting_file(import_file_name=f'{config.DAY_OUTPUT_FILE}{Intermediate_Files.extension()}', release_level='daily',
                                    pwear=config.DAY_PWEAR, pwear_morning=config.DAY_PWEAR_MORNING, pwear_quad=config.DAY_PWEAR_QUAD, print_message='rows of data',
-                                   output_filename=config.DAY_OUTPUT_FILE)
+                                   output_filename=config.DAY_OUTPUT_FILE, df=appended_dfs.get('daily'))
         data_dictionary(df=daily_df, filename=config.DAY_OUTPUT_FILE, release_level='daily', pwear=config.DAY_PWEAR, pwear_quad=config.DAY_PWEAR_QUAD, append_level='daily')
 
     # Preparing hourly release file
@@ -667,8 +701,10 @@ if __name__ == '__main__':
         if config.count_prefixes.lower() == '1m':
             Acc_Post_Processing_Orchestra.print_message("PREPARING A MINUTE LEVEL RELEASE FILE")
 
-        hourly_df = formatting_file(import_file_name=f'{config.HOUR_OUTPUT_FILE}.csv', release_level='hourly',
-                                    pwear=None, pwear_morning=None, pwear_quad=None, print_message='rows of data', output_filename=config.HOUR_OUTPUT_FILE)
+        hourly_df = formatting_file(import_file_name=f'{config.HOUR_OUTPUT_FILE}{Intermediate_Files.extension()}', release_level='hourly',
+                                    pwear=None, pwear_morning=None, pwear_quad=None, print_message='rows of data', output_filename=config.HOUR_OUTPUT_FILE, df=appended_dfs.get('hourly'))
         data_dictionary(df=hourly_df, filename=config.HOUR_OUTPUT_FILE, release_level='hourly', pwear=None, pwear_quad=None, append_level='hourly')
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+############################################################################################################
+# This file lists the files in the results folder (and the individual files folders) with os.scandir, instead of writing a filelist with 'dir'/'ls' and reading it back in.
+# This works the same on Windows and Mac and does not depend on the working directory. Each file is listed with its size and modified time,
+# and the results files are classified by type (1h, 1m, metadata, qc_meta, analysis_meta, file_meta) and file_id.
+# The index of the results folder is saved in the Filelists folder (RESULTS_INDEX_FILE in config.py).
+# Date: 16/10/2026
+# Version: 1.0
+# Version: 1.1 - 17/10/2026: Extensions are matched with the dot and ignoring case (the same as 'dir /b *csv' on Windows)
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import re
+import pandas as pd
+import config
+
+# Results files: {file type}_{file_id}.csv (the extension can be in any case, e.g. .CSV)
+RESULTS_FILE = re.compile(r'^(?P<file_type>1h|1m|metadata|qc_meta|analysis_meta|file_meta)_(?P<file_id>.+)\.(?i:csv)$')
+
+
+# --- LISTING FILES --- #
+def listing(folder, extension=''):
+    """
+    Listing the files in a folder (not the sub folders).
+    :param folder: Full path of the folder.
+    :param extension: Only files ending with this (in any case) are listed, e.g. '.csv'. All files are listed if ''.
+    :return: Dataframe with filename, size and mtime_ns (modified time) of each file, in order of filename.
+    """
+    files = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(extension.lower()) and entry.is_file():
+                stat = entry.stat()
+                files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    files.sort()
+    return pd.DataFrame(files, columns=['filename', 'size', 'mtime_ns'])
+
+def classifying(files_df):
+    # Adding the file type and file_id of the results files. Missing for any other files.
+    matches = [RESULTS_FILE.match(filename) for filename in files_df['filename']]
+    files_df = files_df.copy()
+    files_df['file_type'] = [match.group('file_type') if match else None for match in matches]
+    files_df['file_id'] = [match.group('file_id') if match else None for match in matches]
+    return files_df
+
+
+# --- INDEXING THE RESULTS FOLDER --- #
+def results_index():
+    """
+    Listing and classifying the csv files in the results folder and saving the index in the Filelists folder.
+    :return: Dataframe with filename, size, mtime_ns, file_type and file_id of each csv file.
+    """
+    index_df = classifying(listing(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER), extension='.csv'))
+
+    output_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.FILELIST_FOLDER)
+    os.makedirs(output_path, exist_ok=True)
+    index_df.to_csv(os.path.join(output_path, config.RESULTS_INDEX_FILE), index=False)
+    return index_df
@@ -0,0 +1,210 @@
+############################################################################################################
+# This file decides which parts of the post processing need to be re-run. Each script (stage) has its inputs and outputs declared below.
+# A fingerprint is made of the content of the input files, the config.py values and orchestra switches used by the script and the script code itself.
+# A stage is only re-run if the fingerprint has changed since it was last run or if any of its outputs are missing.
+# Because the outputs of one stage are the inputs of the next, a change early on will flow through to the later stages.
+# Date: 16/10/2026
+# Version: 1.0
+############################################################################################################
+# --- IMPORTING PACKAGES --- #
+import os
+import re
+import glob
+import json
+import hashlib
+import config
+import Intermediate_Files
+import Acc_Post_Processing_Orchestra
+
+# Folder the post processing scripts are saved in (the scripts change working directory while running)
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- DECLARING INPUTS AND OUTPUTS FOR EACH STAGE --- #
+def stage_artifacts(script):
+    """
+    Declaring the input and output files for each stage. Files are given as glob patterns.
+    :param script: Name of the stage script, e.g. 'Collapse_Results.py'.
+    :return: inputs. List of glob patterns of files the stage reads.
+    :return: outputs. List of glob patterns of files the stage writes. If any of these patterns do not match a file the stage is re-run.
+    """
+    results = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER)
+    summary = os.path.join(results, config.SUMMARY_FOLDER)
+    filelists = os.path.join(results, config.FILELIST_FOLDER)
+    anomalies = os.path.join(config.ROOT_FOLDER, config.ANOMALIES_FOLDER)
+    part_proc = os.path.join(summary, config.INDIVIDUAL_PARTPRO_F, config.TIME_RES_FOLDER)
+    individual_summary = os.path.join(summary, config.INDIVIDUAL_SUM_F, config.TIME_RES_FOLDER)
+    individual_daily = os.path.join(summary, config.INDIVIDUAL_DAILY_F, config.TIME_RES_FOLDER)
+    individual_trimmed = os.path.join(summary, config.INDIVIDUAL_TRIMMED_F, config.TIME_RES_FOLDER)
+    individual_statistics = os.path.join(summary, config.INDIVIDUAL_STATS_F, config.TIME_RES_FOLDER)
+    orchestra = Acc_Post_Processing_Orchestra
+    ext = Intermediate_Files.extension()
+
+    if script == 'Pampro_Merge_MetaFiles.py':
+        return [os.path.join(results, '*meta*.csv')], [os.path.join(results, 'metadata_*.csv')]
+
+    if script == 'Pampro_Collate_Anomalies.py':
+        # collapsed_anomalies.csv is only produced if there are any anomalies, so no outputs are declared
+        return [os.path.join(anomalies, '*anomalies.csv'), os.path.join(results, 'qc_meta*')], []
+
+    if script == 'Filelist_Generation.py':
+        return [os.path.join(results, '*.csv'), os.path.join(summary, f'{config.PROJECT}_SUMMARY_MEANS{ext}')], \
+               [os.path.join(filelists, 'filelist.txt')]
+
+    if script == 'GENERIC_exh_postprocessing.py':
+        return [os.path.join(filelists, 'filelist.txt'), os.path.join(results, '*.csv'),
+                os.path.join(config.ROOT_FOLDER, config.WEAR_LOG_FOLDER, f'{config.WEAR_LOG}.csv'),
+                os.path.join(anomalies, config.ANOMALIES_FILE), config.CORRUPTION_CONDITION_FILE_PATH], \
+               [os.path.join(part_proc, f'*_{config.OUTPUT_FILE_EXT}{ext}')]
+
+    if script == 'Collapse_Results.py':
+        outputs = []
+        if orchestra.RUN_COLLAPSE_RESULTS_TO_SUMMARY.lower() == 'yes':
+            outputs.append(os.path.join(individual_summary, f'*_{config.SUM_OVERALL_MEANS}{ext}'))
+        if orchestra.RUN_COLLAPSE_RESULTS_TO_DAILY.lower() == 'yes':
+            outputs.append(os.path.join(individual_daily, f'*_{config.DAY_OVERALL_MEAN}{ext}'))
+        return [os.path.join(filelists, 'filelist.txt'), os.path.join(part_proc, f'*{ext}')], outputs
+
+    if script == 'Collapse_Statistics.py':
+        # Updating the same files as Collapse_Results from the collapse statistics
+        collapse_inputs, collapse_outputs = stage_artifacts('Collapse_Results.py')
+        return [os.path.join(filelists, 'filelist.txt'), os.path.join(individual_statistics, f'*{ext}')], collapse_outputs
+
+    if script == 'Inclusion_Sweep.py':
+        return [os.path.join(filelists, 'filelist.txt'), os.path.join(individual_statistics, f'*{ext}'),
+                os.path.join(individual_summary, f'*{ext}'), os.path.join(individual_daily, f'*{ext}')], \
+               [os.path.join(summary, f'{config.SWEEP_OUTPUT_FILE}.csv')]
+
+    if script == 'Fused_Pipeline.py':
+        # Reading the same files as GENERIC_exh_postprocessing and outputting the same files as Collapse_Results
+        generic_inputs, generic_outputs = stage_artifacts('GENERIC_exh_postprocessing.py')
+        collapse_inputs, collapse_outputs = stage_artifacts('Collapse_Results.py')
+        return generic_inputs, collapse_outputs
+
+    if script == 'Appending_Files.py':
+        outputs = []
+        if orchestra.RUN_APPEND_SUMMARY_FILES.lower() == 'yes':
+            outputs.append(os.path.join(summary, f'{config.SUM_OUTPUT_FILE}{ext}'))
+        if orchestra.RUN_APPEND_DAILY_FILES.lower() == 'yes':
+            outputs.append(os.path.join(summary, f'{config.DAY_OUTPUT_FILE}{ext}'))
+        if orchestra.RUN_APPEND_HOURLY_FILES.lower() == 'yes' or orchestra.RUN_APPEND_MINUTE_LEVEL_FILES.lower() == 'yes':
+            outputs.append(os.path.join(summary, f'{config.HOUR_OUTPUT_FILE}{ext}'))
+        return [os.path.join(filelists, 'filelist.txt'), os.path.join(filelists, 'No_Analysis_Files.txt'),
+                os.path.join(individual_summary, f'*{ext}'), os.path.join(individual_daily, f'*{ext}'),
+                os.path.join(individual_trimmed, f'*{ext}'), os.path.join(results, 'metadata_*.csv')], outputs
+
+    if script == 'Verification_Checks.py':
+        return [os.path.join(summary, f'{config.SUM_OUTPUT_FILE}{ext}'), os.path.join(summary, f'{config.HOUR_OUTPUT_FILE}{ext}')], \
+               [os.path.join(config.ROOT_FOLDER, config.LOG_FOLDER, f'{config.VERIF_NAME}_{config.PC_DATE}.docx')]
+
+    if script == 'Prepare_releases.py':
+        return [os.path.join(summary, f'{config.SUM_OUTPUT_FILE}{ext}'), os.path.join(summary, f'{config.DAY_OUTPUT_FILE}{ext}'),
+                os.path.join(summary, f'{config.HOUR_OUTPUT_FILE}{ext}'), os.path.join(anomalies, 'collapsed_anomalies.csv')], \
+               [os.path.join(config.ROOT_FOLDER, config.RELEASES_FOLDER, config.PC_DATE, '*.csv')]
+
+    raise ValueError(f"No inputs/outputs are declared for {script} in Stage_Scheduler.py")
+
+
+# --- READING AND SAVING THE FINGERPRINTS OF PREVIOUS RUNS --- #
+def fingerprint_path():
+    return os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER, config.STAGE_FINGERPRINT_FILE)
+
+def load_fingerprints():
+    """
+    Reading in the fingerprints saved from previous runs.
+    :return: Dictionary with 'stages' (fingerprint per stage) and 'files' (size, modified time and content hash per input file).
+    """
+    if os.path.exists(fingerprint_path()):
+        with open(fingerprint_path()) as f:
+            return json.load(f)
+    return {'stages': {}, 'files': {}}
+
+def save_fingerprints(fingerprints):
+    os.makedirs(os.path.dirname(fingerprint_path()), exist_ok=True)
+    with open(fingerprint_path(), 'w') as f:
+        json.dump(fingerprints, f, indent=1, sort_keys=True)
+
+
+# --- CREATING FINGERPRINT FOR A STAGE --- #
+# Hashing the content of a file. The hash is reused if the file size and modified time is unchanged since the file was last hashed, so only new or changed files are read.
+def file_hash(file_path, file_cache):
+    stat = os.stat(file_path)
+    cached = file_cache.get(file_path)
+    if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    file_cache[file_path] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+    return sha.hexdigest()
+
+# Finding the post processing modules used by a script (e.g. Housekeeping.py). config.py and the orchestra are not included as only the values used are part of the fingerprint.
+def local_modules(script, found=None):
+    found = [] if found is None else found
+    found.append(script)
+    with open(os.path.join(SCRIPT_FOLDER, script)) as f:
+        source = f.read()
+    for module in re.findall(r'^\s*(?:import|from)\s+(\w+)', source, flags=re.M):
+        module_file = f'{module}.py'
+        if module in ('config', 'Acc_Post_Processing_Orchestra') or module_file in found:
+            continue
+        if os.path.exists(os.path.join(SCRIPT_FOLDER, module_file)):
+            local_modules(module_file, found)
+    return found
+
+def stage_fingerprint(script, fingerprints):
+    """
+    Creating a fingerprint of everything that decides the output of a stage.
+    :param script: Name of the stage script.
+    :param fingerprints: The fingerprints loaded with load_fingerprints(). The file hash cache in here is updated.
+    :return: Fingerprint (sha256 hex string) for the stage.
+    """
+    inputs, outputs = stage_artifacts(script)
+    file_cache = fingerprints.setdefault('files', {})
+    content = {'code': {}, 'config': {}, 'switches': {}, 'inputs': {}}
+
+    for module_file in local_modules(script):
+        module_path = os.path.join(SCRIPT_FOLDER, module_file)
+        content['code'][module_file] = file_hash(module_path, file_cache)
+        with open(module_path) as f:
+            source = f.read()
+        # config.py values and orchestra switches that are used by the script
+        for name in sorted(set(re.findall(r'\bconfig\.([A-Za-z_]\w*)', source))):
+            content['config'][name] = repr(getattr(config, name, None))
+        for name in sorted(set(re.findall(r'\bAcc_Post_Processing_Orchestra\.(RUN_\w+)', source))):
+            content['switches'][name] = repr(getattr(Acc_Post_Processing_Orchestra, name, None))
+
+    for pattern in inputs:
+        for file_path in sorted(glob.glob(pattern)):
+            if os.path.isfile(file_path):
+                content['inputs'][file_path] = file_hash(file_path, file_cache)
+
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+# --- CHECKING IF A STAGE NEEDS TO BE RUN AND RECORDING WHEN IT HAS BEEN RUN --- #
+def stage_up_to_date(script):
+    """
+    Checking if a stage can be skipped: Its fingerprint is the same as when it was last run and all its outputs are present.
+    :param script: Name of the stage script.
+    :return: True if the stage is up-to-date and can be skipped, False if it needs to be run.
+    """
+    fingerprints = load_fingerprints()
+    fingerprint = stage_fingerprint(script, fingerprints)
+    save_fingerprints(fingerprints)
+
+    inputs, outputs = stage_artifacts(script)
+    outputs_present = all(glob.glob(pattern) for pattern in outputs)
+    return outputs_present and fingerprints['stages'].get(script) == fingerprint
+
+def record_stage(script):
+    """
+    Saving the fingerprint of a stage after it has been run. The fingerprint is made after the run so stages writing into their own input folder (e.g. Pampro_Merge_MetaFiles) are not re-run next time.
+    :param script: Name of the stage script.
+    :return: None
+    """
+    fingerprints = load_fingerprints()
+    fingerprints['stages'][script] = stage_fingerprint(script, fingerprints)
+    save_fingerprints(fingerprints)
@@ -9,6 +9,8 @@
 # IMPORTING PACKAGES #
 import docx
 import config
+import Dtype_Schema
+import Intermediate_Files
 import os
 import pandas as pd
 from docx.shared import RGBColor
@@ -114,16 +116,27 @@ def portrait(log):
     new_section.page_width, new_section.page_height = new_section.page_height, new_section.page_width
 
 # --- CHECKING IF DATASET EXISTS AND THEN READING IT IN --- #
-def dataframe(file_name, variable):
+def dataframe(file_name, variable, df=None):
     """
     Importing dataset as dataframe and creating a flag if the dataset doesn't exist.
     :param file_name: The dataset to import.
+    :param df: The dataset if it was handed over from Appending_Files (in-process mode). The dataset is then not read in again.
     :return: df. The dataset as dataframe if it exists.
     :return: file_exists. Flag to indicate if the dataset exists.
     """
-    dataframe_path = os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER, f'{file_name}.csv')
+    dataframe_path = Intermediate_Files.path(os.path.join(config.ROOT_FOLDER, config.RESULTS_FOLDER, config.SUMMARY_FOLDER), file_name)
+    if df is not None:
+        df = df.copy()
+        if 'subject_code' in df.columns:
+            df['subject_code'] = df['subject_code'].mask(df['subject_code'].notna(), df['subject_code'].astype(str))
+
+        file_exists = True
+        if config.RUN_HOUSEKEEPING.lower() == 'yes':
+            df = df[(~df[variable].isin(filenames_to_remove))]
+        return Dtype_Schema.compact_dtypes(df), file_exists
+
     if os.path.exists(dataframe_path):
-        df = pd.read_csv(dataframe_path, dtype={'subject_code': str})
+        df = Intermediate_Files.read(dataframe_path, dtype={'subject_code': str})
 
         file_exists = True
         if config.RUN_HOUSEKEEPING.lower() == 'yes':
@@ -649,7 +662,7 @@ def check_negative_values(df, log, text_to_log, description, variables, text_no_
     # Creating flag and list if any variables with negative values
     flag_negative_found = False
     files_with_negative_values = set()
-    grouped = df.groupby('id')
+    grouped = df.groupby('id', observed=True)
 
     # Adding files with negative values to list
     for file_id, group in grouped:
@@ -938,12 +951,19 @@ def print_impute_checks(df, log, text_to_log, description, variables, condition_
 
 
 
-if __name__ == '__main__':
+def main(appended_dfs=None):
+    """
+    Running the verification checks on the appended summary and hourly/minute level datasets and outputting the verification log.
+    :param appended_dfs: Optional dictionary of the appended datasets handed over from Appending_Files when the orchestra is run in-process. Datasets not in the dictionary are read from the Summary_Files folder.
+    :return: None
+    """
+    global verif_log, summary_df
+    appended_dfs = appended_dfs or {}
 
     # --- SECTION 1: VERIFICATION OF OUTPUT SUMMARY OVERALL MEANS --- #
     # Creating verification log and importing summary dataframe
     verif_log = create_verif_log("VERIFICATION LOG")
-    summary_df, summary_file_exists = dataframe(file_name=config.SUM_OUTPUT_FILE, variable='id')
+    summary_df, summary_file_exists = dataframe(file_name=config.SUM_OUTPUT_FILE, variable='id', df=appended_dfs.get('summary'))
 
     # If dataframe exists, print out files processed, devices used and summary of start dates
     if summary_file_exists:
@@ -1184,7 +1204,7 @@ if __name__ == '__main__':
 
     # --- SECTION 2: VERIFICATION OF HOURLY FILE(S) --- #
     # Importing hourly dataframe
-    hourly_df, hourly_file_exists = dataframe(file_name=config.HOUR_OUTPUT_FILE, variable='file_id')
+    hourly_df, hourly_file_exists = dataframe(file_name=config.HOUR_OUTPUT_FILE, variable='file_id', df=appended_dfs.get('hourly'))
     if config.count_prefixes.lower() == '1h':
         PREFIX = 'HOURLY'
     if config.count_prefixes.lower() == '1m':
@@ -1272,4 +1292,5 @@ if __name__ == '__main__':
             text_no_error='There are no timepoints flagged as mechanical noise. No files to check.')
 
 
-
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,7 @@ INDIVIDUAL_PARTPRO_F = 'Individual_PartPro_files'
 INDIVIDUAL_SUM_F = 'Individual_Summary_files'                                                       # DO NOT EDIT: Auto generated folder to contain all individual summary files (found within _Summary_Files folder)
 INDIVIDUAL_DAILY_F = 'Individual_Daily_files'                                                       # DO NOT EDIT: Auto generated folder to contain all individual daily files (found within _Summary_Files folder)
 INDIVIDUAL_TRIMMED_F = 'Individual_Trimmed_files'                                                   # DO NOT EDIT: Auto generated folder to contain all individual hourly trimmed files (found within _Summary_Files folder)
+INDIVIDUAL_STATS_F = 'Individual_Statistics_files'                                                 # DO NOT EDIT: Auto generated folder to contain the collapse statistics of each file if OUTPUT_COLLAPSE_STATISTICS is 'Yes' (found within _Summary_Files folder)
 TIME_RES_FOLDER = f"{count_prefixes}_level"                                                         # DO NOT EDIT: Auto generated folder for the specified time resolution (within each summary/daily/hourly folder)
 WEAR_LOG_FOLDER = '_analysis/trim_times'                                                           # EDIT: Name of folder were the wear log is saved in, if a wear log is used. Add the name of the sub-folder as well if the wear log is saved within a sub-folder in the root folder for the project.
 
@@ -50,6 +51,13 @@ RUN_HOUSEKEEPING = 'Yes'        # EDIT: Set to 'Yes' if you have housekeeping sc
 RUN_CORRUPTIONS_HOUSEKEEPING = 'No'  # EDIT: Set to 'yes' if you have a corruptions housekeeping file to adjust pwear based on verification checks
 CORRUPTION_CONDITION_FILE_PATH = 'example_file_path/corruptions_conditions.csv'  # EDIT: Edit to the file path for the corruptions_conditions filepath, this should include the name and file extension of the file itself. (e.g., corruptions_conditions.csv)
 
+# --- ONLY RUNNING CHANGED STAGES --- #
+STAGE_FINGERPRINT_FILE = 'stage_fingerprints.json'  # DO NOT EDIT: File (within the Summary_Files folder) where fingerprints of the inputs, config values and code of each stage are saved when RUN_ONLY_CHANGED_STAGES is 'Yes' in the orchestra. Delete the file to force all stages to run again.
+
+# --- METADATA CATALOGUE --- #
+METADATA_CATALOGUE_FILE = 'metadata_catalogue.pkl'  # DO NOT EDIT: File (within the Summary_Files folder) where the metadata, qc_meta, analysis_meta and file_meta files are kept after they have been read in once (Metadata_Catalogue.py). Only new or changed files are read in again. Delete the file to read all metadata files in again.
+METADATA_WORKERS = 4                                # EDIT: Number of metadata files read at the same time (each in its own thread) when new or changed metadata files are added to the metadata catalogue.
+
 ###########################################################################
 # --- VARIABLES BELOW ARE SPECIFIC TO EACH PART OF THE POSTPROCESSING --- #
 ###########################################################################
@@ -58,6 +66,7 @@ CORRUPTION_CONDITION_FILE_PATH = 'example_file_path/corruptions_conditions.csv'
 # EDIT: Variables below can be adapted depending on the Wave output. Can also be changed if wanting to post process all files again or just newly added files.
 SUB_SET_PREFIXES = ['1h', 'metadata']                # DO NOT EDIT: File resolution and meta files to look for when creating filelist. (Add each in the format ['1h', 'metadata']). Not tested on minute level data.
 ONLY_NEW_FILES = 'Yes'                               # EDIT: Set to 'No' if you want to process all files. If running a dataset as continue processing throughout the study can be set to "Yes" so only new files are processed.
+RESULTS_INDEX_FILE = 'results_index.csv'             # DO NOT EDIT: File (within the Filelists folder) where the csv files in the results folder are listed with their size, modified time, file type and file_id when the filelist is created.
 
 
 # --- GENERIC EXH POSTPROCESSING ADDITIONAL VARIABLES --- #
@@ -70,6 +79,14 @@ WEAR_LOG = 'example_wear_log'                           # EDIT: Name of wear log
 # DO NOT EDIT: Variables below do not need editing if you are happy with the standard file naming output.
 ANOMALIES_FILE = 'collapsed_anomalies.csv'          # DO NOT EDIT: Filename for collapsed anomalies files. This file is generated if data were processed through Pampro and if the Pampro_Collate_Anomalies are run (only if any anomalies are present in dataset)
 OUTPUT_FILE_EXT = f"{count_prefixes}_part_proc"     # DO NOT EDIT: Extension for the output files from exhaustive post processing.
+STATS_FILE_EXT = f"{count_prefixes}_collapse_statistics"   # DO NOT EDIT: Extension for the collapse statistics files (OUTPUT_COLLAPSE_STATISTICS).
+OUTPUT_PART_PROC_FILES = 'No'                       # EDIT: Only used if RUN_FUSED_GENERIC_AND_COLLAPSE is 'Yes' in the orchestra. Set to 'Yes' to still output the part processed files (as a record of the processing). Set to 'No' to skip writing them, which is faster.
+GENERIC_WORKERS = 1                                 # EDIT: Number of files to process at the same time (each in its own process) in the generic exhaustive post processing. Set to 1 to process one file at a time. Should not be set higher than the number of CPU cores.
+COLLAPSE_BATCH_SIZE = 1                             # EDIT: Number of files collapsed together in Collapse_Results. The files in a batch are trimmed one by one and the regressions for all of them are solved together, which is faster for large studies. Set to 1 to collapse one file at a time.
+OUTPUT_COLLAPSE_STATISTICS = 'No'                   # EDIT: Set to 'Yes' to save summed statistics of each file when collapsing. The summary and daily files can then be re-collapsed from these in seconds (RUN_RECOLLAPSE_FROM_STATISTICS in the orchestra) after changing SUM_MIN_HOUR_INCLUSION, DAY_MIN_HOUR_INCLUSION, IMPUTE_DATA, IMPUTE_HOURS or MIN_DAY_HOURS.
+COMPACT_DTYPES = 'No'                               # EDIT: Set to 'Yes' to read in the data files with compact data types (float32, small integers and categories, see Dtype_Schema.py). This uses much less memory for large studies. Pwear and the regression weights are kept as float64, but the means can differ slightly (around the 7th significant digit) and an epoch with an ENMO mean right at one of the mechanical noise cut offs can be flagged differently.
+INTERMEDIATE_FORMAT = 'csv'                         # EDIT: Format of the files passed between the scripts (part processed, trimmed, individual summary/daily files and the appended *_MEANS files). Set to 'parquet' or 'feather' for faster reading and no rounding of the part processed files (needs the pyarrow package). The release files are always csv.
+INTERMEDIATE_COMPRESSION = 'zstd'                   # DO NOT EDIT: Compression used if INTERMEDIATE_FORMAT is 'parquet' or 'feather'.
 
 
 # --- COLLAPSE RESULTS TO SUMMARY AND/OR DAILY LEVEL ADDITIONAL VARIABLES --- #
@@ -106,6 +123,10 @@ if count_prefixes == '1h':
     HOUR_OUTPUT_FILE = f'{PROJECT}_HOURLY_TRIMMED_MEANS' # DO NOT EDIT: Output filename for the hourly appended dataset.
 if count_prefixes == '1m':
     HOUR_OUTPUT_FILE = f'{PROJECT}_MINUTE_TRIMMED_MEANS'
+APPEND_WORKERS = 4                                  # EDIT: Number of individual files read at the same time (each in its own thread) when appending the files. Set to 1 to read one file at a time.
+STREAM_HOURLY_APPEND = 'No'                         # EDIT: Set to 'Yes' to write the appended hourly/minute level file in chunks while the individual trimmed files are read, so the whole dataset is never held in memory (recommended for minute level data on large studies). Verification_Checks and Prepare_releases then read the appended file in from the Summary_Files folder, also if the orchestra is run in-process.
+APPEND_CHUNK_ROWS = 1000000                         # DO NOT EDIT: Number of rows written at a time if STREAM_HOURLY_APPEND is 'Yes'.
+INCREMENTAL_APPEND = 'No'                           # EDIT: Set to 'Yes' to only add, replace or remove the individual files that are new, changed or removed since the appended summary, daily and hourly/minute level files were last written, instead of appending all files again. Which files are in the appended files is kept in a manifest ({output file}_manifest.json) in the Summary_Files folder. The appended files are then read in from the Summary_Files folder by Verification_Checks and Prepare_releases, also if the orchestra is run in-process.
 
 # --- VERIFICATION CHECKS --- #
 # DO NOT EDIT: All variables below do not need editing if you are happy with the name of verification log and using ENMO as standard variables to verify.
@@ -131,3 +152,14 @@ SUM_PWEAR_QUAD = 9                                  # EDIT: Minumum number of ho
 DAY_PWEAR = 12                                      # EDIT: Minimum number of hours to signify each day contains enough data to be included in final release.
 DAY_PWEAR_MORNING = 3                               # EDIT: Minimum number of hours needed each day within morning quadrant to show monitor worn overnight
 DAY_PWEAR_QUAD = 3                                  # EDIT: Minumum number of hours needed each day within each of noon, afternoon and night quadrant to be included in final release.
+
+# --- INCLUSION CRITERIA SWEEP --- #
+# EDIT: Inclusion criteria evaluated by Inclusion_Sweep.py (RUN_INCLUSION_SWEEP in the orchestra). Every combination of the values below is evaluated in one pass. Needs OUTPUT_COLLAPSE_STATISTICS to be 'Yes' when Collapse_Results is run.
+# SUMMARY
+SWEEP_SUM_MIN_HOUR_INCLUSION = [12, 18, 24]         # EDIT: Values of SUM_MIN_HOUR_INCLUSION to evaluate.
+SWEEP_SUM_PWEAR = [48, 72, 96]                      # EDIT: Values of SUM_PWEAR to evaluate.
+SWEEP_SUM_PWEAR_MORNING = [6, 9]                    # EDIT: Values of SUM_PWEAR_MORNING to evaluate.
+SWEEP_SUM_PWEAR_QUAD = [6, 9]                       # EDIT: Values of SUM_PWEAR_QUAD to evaluate.
+# DAILY
+SWEEP_DAY_PWEAR = [8, 10, 12, 16]                   # EDIT: Values of DAY_PWEAR to evaluate (with DAY_MIN_HOUR_INCLUSION, DAY_PWEAR_MORNING and DAY_PWEAR_QUAD as set above).
+SWEEP_OUTPUT_FILE = f'{PROJECT}_INCLUSION_SWEEP'    # DO NOT EDIT: Output filename for the inclusion sweep results (saved as csv in the Summary_Files folder).